@@ -0,0 +1,247 @@
+"""
+HTTP load benchmark for every challenger-bank page and /api/* route.
+
+Seeds a database at the requested scale (optional), starts a local uvicorn
+against it, drives every GET route with N concurrent clients, and reports
+p50/p95/p99 latency, throughput and response size per route.  Results are
+written as JSON so a later run can diff against them.
+
+Usage (from the challenger-bank/ directory):
+    python -m bench.http_bench --seed --scale 10 --concurrency 16 --requests 200
+    python -m bench.http_bench --out data/bench/baseline.json
+    python -m bench.http_bench --compare data/bench/baseline.json --tolerance 0.25
+
+--compare exits non-zero when any route's p95 regresses by more than the
+tolerance (fractional) versus the baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_DB = os.path.join(ROOT, "data", "bench", "bank.db")
+DEFAULT_OUT = os.path.join(ROOT, "data", "bench", "results.json")
+
+# Sample values for path parameters
+PATH_PARAMS = {
+    "cp_id":       "1",
+    "asset_id":    "USD_10Y",
+    "scenario_id": "1",
+    "pnl_date":    "2025-12-31",
+    "source":      "trades",
+}
+
+# Extra query strings worth timing separately
+EXTRA_ROUTES = [
+    "/api/market/data/USD_10Y?days=1250",
+    "/api/market/data/USD_10Y?days=1250&points=300",
+    "/api/scenarios/reverse?loss=250",
+    "/api/market/backtest?var=model&series=true",
+    "/api/search?q=energy",
+    "/api/search?q=term-loan&kind=facility",
+]
+
+# Routes that are not request/response (streams) or not data routes
+SKIP_ROUTES = {"/", "/openapi.json", "/docs", "/docs/oauth2-redirect", "/redoc", "/debug/sql",
+               "/api/scenarios/reverse", "/api/search", "/api/stream/kpis"}
+
+
+def discover_routes():
+    """Every GET route registered on main.app, with path params filled in."""
+    os.environ.setdefault("BANK_DB_PATH", DEFAULT_DB)
+    import main
+    paths = []
+    for r in main.app.routes:
+        methods = getattr(r, "methods", None) or set()
+        if "GET" not in methods or r.path in SKIP_ROUTES or r.path.startswith("/static"):
+            continue
+        paths.append(re.sub(r"\{(\w+)\}", lambda m: PATH_PARAMS.get(m.group(1), "1"), r.path))
+    return sorted(set(paths)) + EXTRA_ROUTES
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, port, workers=1):
+    env = dict(os.environ, BANK_DB_PATH=db_path)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            # /health answers while the data is still warming up; /health/ready only once it is servable
+            if httpx.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not become ready within 120 s")
+
+
+async def _drive(client, path, n_requests, concurrency, warmup):
+    for _ in range(warmup):
+        await client.get(path)
+
+    latencies, sizes, errors = [], [], 0
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                resp = await client.get(path)
+                body = resp.content
+                if resp.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - t0) * 1000)
+            sizes.append(int(resp.headers.get("content-length") or len(body)))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+
+    lat = np.asarray(latencies) if latencies else np.zeros(1)
+    return {
+        "requests":       len(latencies),
+        "errors":         errors,
+        "p50_ms":         round(float(np.percentile(lat, 50)), 2),
+        "p95_ms":         round(float(np.percentile(lat, 95)), 2),
+        "p99_ms":         round(float(np.percentile(lat, 99)), 2),
+        "mean_ms":        round(float(lat.mean()), 2),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall > 0 else 0.0,
+        "bytes":          int(np.median(sizes)) if sizes else 0,
+    }
+
+
+async def run_bench(base_url, routes, n_requests, concurrency, warmup, gzip):
+    headers = {"Accept-Encoding": "gzip" if gzip else "identity"}
+    limits = httpx.Limits(max_connections=concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, headers=headers,
+                                 limits=limits, timeout=60) as client:
+        for path in routes:
+            results[path] = await _drive(client, path, n_requests, concurrency, warmup)
+            r = results[path]
+            print(f"  {path:<52} p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  "
+                  f"p99 {r['p99_ms']:>8.1f} ms  {r['throughput_rps']:>7.1f} rps  "
+                  f"{r['bytes']:>9,} B" + (f"  {r['errors']} errors" if r["errors"] else ""))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return routes whose p95 regressed by more than `tolerance` vs baseline."""
+    regressions = []
+    for path, r in results.items():
+        b = baseline.get("routes", {}).get(path)
+        if not b or not b.get("p95_ms"):
+            continue
+        ratio = r["p95_ms"] / b["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append((path, b["p95_ms"], r["p95_ms"], ratio))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default=DEFAULT_DB, help="database file to serve")
+    ap.add_argument("--seed", action="store_true", help="(re)seed --db before running")
+    ap.add_argument("--scale", type=int, default=1, help="book multiplier when seeding")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=100, help="timed requests per route")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    ap.add_argument("--url", help="benchmark an already-running server instead")
+    ap.add_argument("--route", action="append", help="restrict to these paths")
+    ap.add_argument("--no-gzip", action="store_true", help="request identity encoding")
+    ap.add_argument("--out", default=DEFAULT_OUT, help="write results JSON here")
+    ap.add_argument("--compare", help="baseline JSON to diff against")
+    ap.add_argument("--tolerance", type=float, default=0.20, help="allowed p95 regression")
+    args = ap.parse_args()
+
+    # Read the baseline up front so a run can never overwrite what it diffs against
+    baseline = None
+    if args.compare:
+        if os.path.abspath(args.compare) == os.path.abspath(args.out):
+            ap.error("--out and --compare are the same file; pass a different --out")
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    db_path = os.path.abspath(args.db)
+    os.environ["BANK_DB_PATH"] = db_path
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    if args.seed or not os.path.exists(db_path):
+        from bench.seed_scaled import seed_scaled
+        seed_scaled(args.scale)
+
+    routes = args.route or discover_routes()
+
+    proc = None
+    base_url = args.url
+    if not base_url:
+        port = _free_port()
+        proc = start_server(db_path, port, args.workers)
+        base_url = f"http://127.0.0.1:{port}"
+
+    print(f"\nBenchmarking {len(routes)} routes at {base_url} "
+          f"(concurrency {args.concurrency}, {args.requests} req/route)\n")
+    try:
+        results = asyncio.run(run_bench(base_url, routes, args.requests,
+                                        args.concurrency, args.warmup, not args.no_gzip))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    report = {
+        "created":     time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "db":          db_path,
+        "db_size_mb":  round(os.path.getsize(db_path) / 1_048_576, 1),
+        "scale":       args.scale,
+        "concurrency": args.concurrency,
+        "requests":    args.requests,
+        "routes":      results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} route(s) regressed beyond {args.tolerance:.0%}:")
+            for path, old, new, ratio in regressions:
+                print(f"  {path:<52} p95 {old:.1f} → {new:.1f} ms (×{ratio:.2f})")
+            sys.exit(1)
+        print(f"\nNo p95 regressions beyond {args.tolerance:.0%} vs {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Seed a benchmark database and inflate it to a larger book.
+
+The generators produce a fixed 50-counterparty universe; `scale_up` clones
+every counterparty-keyed table (factor - 1) times with shifted ids so pages
+and API routes see `factor` × the rows with realistic shapes.
+
+Usage (from the challenger-bank/ directory):
+    BANK_DB_PATH=data/bench/bank.db python -m bench.seed_scaled --scale 10
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+# Tables cloned per copy, in FK order.  remap: column → table whose id shift applies
+CLONE_TABLES = [
+    ("counterparties",    {"id": "counterparties"}),
+    ("financials",        {"counterparty_id": "counterparties"}),
+    ("credit_ratings",    {"counterparty_id": "counterparties"}),
+    ("credit_facilities", {"id": "credit_facilities", "counterparty_id": "counterparties"}),
+    ("credit_events",     {"counterparty_id": "counterparties", "facility_id": "credit_facilities"}),
+    ("pd_history",        {"counterparty_id": "counterparties"}),
+    ("trades",            {"counterparty_id": "counterparties"}),
+    ("netting_sets",      {"id": "netting_sets", "counterparty_id": "counterparties"}),
+    ("collateral",        {"netting_set_id": "netting_sets"}),
+    ("mtm_exposure",      {"counterparty_id": "counterparties", "netting_set_id": "netting_sets"}),
+    ("pfe_profiles",      {"counterparty_id": "counterparties"}),
+    ("cva_history",       {"counterparty_id": "counterparties"}),
+    ("sa_ccr",            {"counterparty_id": "counterparties"}),
+]
+
+# TEXT columns declared UNIQUE — suffixed per copy
+UNIQUE_TEXT = {"trades": "trade_id", "netting_sets": "netting_set_id"}
+
+
+def scale_up(conn, factor):
+    if factor <= 1:
+        return
+    base_max = {t: conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {t}").fetchone()[0]
+                for t in ("counterparties", "credit_facilities", "netting_sets")}
+    for k in range(1, factor):
+        for table, remap in CLONE_TABLES:
+            cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+            exprs = []
+            for c in cols:
+                if c in remap:
+                    exprs.append(f"{c} + {k * base_max[remap[c]]}")
+                elif c == "id":
+                    exprs.append("NULL")
+                elif UNIQUE_TEXT.get(table) == c:
+                    exprs.append(f"{c} || '-{k}'")
+                elif table == "counterparties" and c == "name":
+                    exprs.append(f"{c} || ' #{k + 1}'")
+                else:
+                    exprs.append(c)
+            # Only clone rows belonging to the original universe
+            if table in base_max:
+                src_filter = f"WHERE id <= {base_max[table]}"
+            else:
+                fk = next(iter(remap))
+                src_filter = f"WHERE {fk} <= {base_max[remap[fk]]}"
+            conn.execute(f"""
+                INSERT INTO {table} ({', '.join(cols)})
+                SELECT {', '.join(exprs)} FROM {table} {src_filter}
+            """)
+        conn.commit()
+    print(f"  Scaled book ×{factor}: "
+          f"{conn.execute('SELECT COUNT(*) FROM counterparties').fetchone()[0]:,} counterparties, "
+          f"{conn.execute('SELECT COUNT(*) FROM trades').fetchone()[0]:,} trades.")
+
+
+def seed_scaled(scale=1):
+    from db import get_db
+    from generators.seed_all import seed
+    seed(force=True)
+    conn = get_db()
+    scale_up(conn, scale)
+    conn.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", type=int, default=1, help="multiply the counterparty universe")
+    args = ap.parse_args()
+    seed_scaled(args.scale)
@@ -1,7 +1,16 @@
+import fcntl
 import os
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "data", "bank.db")
+from services import fx
+from services.sql_profiler import ProfiledConnection
+
+DB_PATH = os.environ.get("BANK_DB_PATH") or os.path.join(os.path.dirname(__file__), "data", "bank.db")
 
 SCHEMA = """
 -- ── Master ────────────────────────────────────────────────────────────────────
@@ -141,6 +150,14 @@ CREATE TABLE IF NOT EXISTS market_data (
     UNIQUE(asset_id, price_date)
 );
 
+-- USD per unit of currency, derived from the FX series above (services/fx.py)
+CREATE TABLE IF NOT EXISTS fx_rates (
+    currency                TEXT NOT NULL,
+    rate_date               TEXT NOT NULL,
+    usd_per_unit            REAL NOT NULL,
+    PRIMARY KEY(currency, rate_date)
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS trades (
     id                      INTEGER PRIMARY KEY,
     trade_id                TEXT NOT NULL UNIQUE,
@@ -156,6 +173,7 @@ CREATE TABLE IF NOT EXISTS trades (
     fixed_rate              REAL,
     floating_index          TEXT,
     strike                  REAL,
+    option_type             TEXT,            -- Call/Put (options only)
     delta                   REAL,
     mark_to_market          REAL NOT NULL,   -- USD millions
     dv01                    REAL,            -- USD per bp
@@ -356,21 +374,431 @@ CREATE TABLE IF NOT EXISTS scenario_results (
     notes                   TEXT,
     UNIQUE(scenario_id, desk, product)
 );
+
+-- ── P&L explain (services/pnl_explain.py) ─────────────────────────────────────
+CREATE TABLE IF NOT EXISTS pnl_explain (
+    id                      INTEGER PRIMARY KEY,
+    pnl_date                TEXT NOT NULL,
+    desk                    TEXT NOT NULL,
+    rates_pnl               REAL,            -- USD millions, delta terms by factor class
+    fx_pnl                  REAL,
+    credit_pnl              REAL,
+    equity_pnl              REAL,
+    gamma_pnl               REAL,            -- ½ γ x² over all factors
+    theta_pnl               REAL,            -- time decay / carry
+    explained_pnl           REAL,
+    actual_pnl              REAL,            -- full revaluation
+    unexplained_pnl         REAL,
+    trade_count             INTEGER,
+    UNIQUE(pnl_date, desk)
+);
+
+-- ── Covenant tests (services/covenants.py) ───────────────────────────────────
+CREATE TABLE IF NOT EXISTS covenant_tests (
+    facility_id             INTEGER NOT NULL REFERENCES credit_facilities(id),
+    fiscal_year             INTEGER NOT NULL,
+    counterparty_id         INTEGER NOT NULL REFERENCES counterparties(id),
+    test_date               TEXT NOT NULL,
+    leverage                REAL,            -- net debt / EBITDA
+    leverage_max            REAL,
+    leverage_headroom       REAL,            -- (max − actual) / max
+    coverage                REAL,            -- interest coverage
+    coverage_min            REAL,
+    coverage_headroom       REAL,            -- (actual − min) / min
+    status                  TEXT NOT NULL,   -- Pass, Watch, Breach
+    tested_at               TEXT,
+    PRIMARY KEY(facility_id, fiscal_year)
+);
+-- one engine-raised breach event per facility and test date
+CREATE UNIQUE INDEX IF NOT EXISTS ux_credit_events_facility
+    ON credit_events(facility_id, event_type, event_date) WHERE facility_id IS NOT NULL;
+
+-- ── Anomaly scoring state (services/anomaly.py) ──────────────────────────────
+CREATE TABLE IF NOT EXISTS anomaly_state (
+    counterparty_id         INTEGER PRIMARY KEY REFERENCES counterparties(id),
+    input_fingerprint       TEXT NOT NULL,   -- scoring inputs at last run
+    anomaly_score           REAL,
+    scored_at               TEXT
+);
+
+-- ── Snapshot registry ─────────────────────────────────────────────────────────
+CREATE TABLE IF NOT EXISTS snapshots (
+    table_name              TEXT NOT NULL,
+    snapshot_date           TEXT NOT NULL,
+    PRIMARY KEY(table_name, snapshot_date)
+) WITHOUT ROWID;
+"""
+
+# Date-partitioned tables → their snapshot column.  Each gets an index led by
+# the date (so one snapshot is a contiguous range) and a trigger that keeps
+# the snapshots registry in step with inserts.
+SNAPSHOT_TABLES = {
+    "pd_history":        "snapshot_date",
+    "positions":         "snapshot_date",
+    "var_history":       "snapshot_date",
+    "pnl_attribution":   "pnl_date",
+    "collateral":        "snapshot_date",
+    "mtm_exposure":      "snapshot_date",
+    "pfe_profiles":      "snapshot_date",
+    "cva_history":       "snapshot_date",
+    "sa_ccr":            "snapshot_date",
+    "country_exposures": "snapshot_date",
+    "transfer_risk":     "snapshot_date",
+    "market_data":       "price_date",
+    "pnl_explain":       "pnl_date",
+}
+
+
+def _snapshot_ddl():
+    ddl = []
+    for table, col in SNAPSHOT_TABLES.items():
+        ddl.append(f"CREATE INDEX IF NOT EXISTS ix_{table}_{col} ON {table}({col});")
+        ddl.append(f"""
+CREATE TRIGGER IF NOT EXISTS tr_{table}_snapshot AFTER INSERT ON {table}
+BEGIN
+    INSERT OR IGNORE INTO snapshots (table_name, snapshot_date) VALUES ('{table}', NEW.{col});
+END;""")
+    return "\n".join(ddl)
+
+
+# ── FX rates ──────────────────────────────────────────────────────────────────
+# fx_rates mirrors the FX rows of market_data: XXXUSD as quoted, USDXXX inverted.
+
+def _fx_select(r):
+    return f"""
+        CASE WHEN substr({r}.asset_id, 1, 3) = 'USD' THEN substr({r}.asset_id, 4, 3)
+             ELSE substr({r}.asset_id, 1, 3) END,
+        {r}.price_date,
+        CASE WHEN substr({r}.asset_id, 1, 3) = 'USD' THEN 1.0 / {r}.value ELSE {r}.value END"""
+
+
+_FX_WHERE = "{r}.asset_type = 'FX' AND length({r}.asset_id) = 6 AND instr({r}.asset_id, 'USD') IN (1, 4)"
+
+
+def _fx_ddl():
+    # An explicit ON CONFLICT clause: a trigger's OR REPLACE is overridden by
+    # the conflict policy of the statement that fires it (e.g. an UPSERT).
+    # The triggers are recreated so existing databases pick up the change.
+    new, old = _FX_WHERE.format(r="NEW"), _FX_WHERE.format(r="OLD")
+    return f"""
+DROP TRIGGER IF EXISTS tr_market_data_fx_ins;
+DROP TRIGGER IF EXISTS tr_market_data_fx_upd;
+CREATE TRIGGER IF NOT EXISTS tr_market_data_fx_ins AFTER INSERT ON market_data WHEN {new}
+BEGIN
+    INSERT INTO fx_rates (currency, rate_date, usd_per_unit) VALUES ({_fx_select("NEW")})
+        ON CONFLICT(currency, rate_date) DO UPDATE SET usd_per_unit = excluded.usd_per_unit;
+END;
+CREATE TRIGGER IF NOT EXISTS tr_market_data_fx_upd AFTER UPDATE OF value ON market_data WHEN {new}
+BEGIN
+    INSERT INTO fx_rates (currency, rate_date, usd_per_unit) VALUES ({_fx_select("NEW")})
+        ON CONFLICT(currency, rate_date) DO UPDATE SET usd_per_unit = excluded.usd_per_unit;
+END;
+CREATE TRIGGER IF NOT EXISTS tr_market_data_fx_del AFTER DELETE ON market_data WHEN {old}
+BEGIN
+    DELETE FROM fx_rates WHERE rate_date = OLD.price_date
+        AND currency = CASE WHEN substr(OLD.asset_id, 1, 3) = 'USD' THEN substr(OLD.asset_id, 4, 3)
+                            ELSE substr(OLD.asset_id, 1, 3) END;
+END;"""
+
+
+def rebuild_fx_rates(conn):
+    """Repopulate fx_rates from market_data."""
+    conn.execute("DELETE FROM fx_rates")
+    conn.execute(f"""
+        INSERT OR REPLACE INTO fx_rates (currency, rate_date, usd_per_unit)
+        SELECT {_fx_select("m")} FROM market_data m WHERE {_FX_WHERE.format(r="m")}
+    """)
+    conn.commit()
+
+
+# ── Full-text search ──────────────────────────────────────────────────────────
+# One FTS5 index over the text fields of several tables.  Each source row maps
+# to rowid = id × 8 + kind code, so triggers can find their row without a
+# lookup.  Expressions use {r} for the NEW/OLD row alias.
+#   kind: (table, code, counterparty_id expr, title expr, body expr, tags expr)
+SEARCH_SOURCES = {
+    "counterparty": ("counterparties", 0, "{r}.id", "{r}.name",
+                     "COALESCE({r}.ai_summary, '') || ' ' || COALESCE({r}.embedding_text, '')",
+                     "{r}.risk_tags"),
+    "financials":   ("financials", 1, "{r}.counterparty_id", "'FY' || {r}.fiscal_year",
+                     "{r}.ai_summary", "{r}.risk_tags"),
+    "facility":     ("credit_facilities", 2, "{r}.counterparty_id",
+                     "{r}.facility_name",
+                     "{r}.ai_summary", "{r}.risk_tags"),
+    "trade":        ("trades", 3, "{r}.counterparty_id",
+                     "{r}.trade_id || ' ' || {r}.desk || ' ' || {r}.product",
+                     "{r}.ai_summary", "{r}.risk_tags"),
+}
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    kind UNINDEXED, ref_id UNINDEXED, counterparty_id UNINDEXED,
+    title, body, tags,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
 """
 
 
-def get_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+def _search_select(kind, r):
+    table, code, cp, title, body, tags = SEARCH_SOURCES[kind]
+    return (f"{r}.id * 8 + {code}, '{kind}', {r}.id, {cp.format(r=r)}, "
+            f"{title.format(r=r)}, {body.format(r=r)}, {tags.format(r=r)}")
+
+
+def _search_ddl():
+    cols = "rowid, kind, ref_id, counterparty_id, title, body, tags"
+    ddl = [SEARCH_SCHEMA]
+    for kind, (table, code, *exprs) in SEARCH_SOURCES.items():
+        # only re-index when an indexed column changes
+        watched = ", ".join(dict.fromkeys(re.findall(r"\{r\}\.(\w+)", " ".join(exprs))))
+        ddl.append(f"""
+CREATE TRIGGER IF NOT EXISTS tr_{table}_search_ins AFTER INSERT ON {table}
+BEGIN
+    INSERT INTO search_index ({cols}) VALUES ({_search_select(kind, "NEW")});
+END;
+CREATE TRIGGER IF NOT EXISTS tr_{table}_search_upd AFTER UPDATE OF {watched} ON {table}
+BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};
+    INSERT INTO search_index ({cols}) VALUES ({_search_select(kind, "NEW")});
+END;
+CREATE TRIGGER IF NOT EXISTS tr_{table}_search_del AFTER DELETE ON {table}
+BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};
+END;""")
+    return "\n".join(ddl)
+
+
+def rebuild_search_index(conn):
+    """Repopulate search_index from its source tables (e.g. after a bulk load)."""
+    conn.execute("DELETE FROM search_index")
+    for kind, (table, *_) in SEARCH_SOURCES.items():
+        conn.execute(f"""
+            INSERT INTO search_index (rowid, kind, ref_id, counterparty_id, title, body, tags)
+            SELECT {_search_select(kind, "s")} FROM {table} s
+        """)
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    conn.commit()
+
+
+def get_db(path=None):
+    path = path or DB_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, factory=ProfiledConnection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    fx.register(conn, os.path.realpath(path))
     return conn
 
 
-def init_db():
-    conn = get_db()
+def init_db(path=None):
+    conn = get_db(path)
     conn.executescript(SCHEMA)
+    conn.executescript(_snapshot_ddl())
+    conn.executescript(_search_ddl())
+    conn.executescript(_fx_ddl())
+    # Backfill the registry for databases seeded before it existed
+    for table, col in SNAPSHOT_TABLES.items():
+        if not conn.execute("SELECT 1 FROM snapshots WHERE table_name=? LIMIT 1", (table,)).fetchone():
+            conn.execute(f"""
+                INSERT OR IGNORE INTO snapshots (table_name, snapshot_date)
+                SELECT DISTINCT ?, {col} FROM {table}
+            """, (table,))
+    # ... the option type, once only recorded in the risk tags
+    if "option_type" not in {r[1] for r in conn.execute("PRAGMA table_info(trades)")}:
+        conn.execute("ALTER TABLE trades ADD COLUMN option_type TEXT")
+        conn.execute("""
+            UPDATE trades SET option_type = CASE WHEN risk_tags LIKE '%"call"%' THEN 'Call' ELSE 'Put' END
+            WHERE product IN ('Equity Option', 'FX Option')
+        """)
+    # ... and the FX rate table
+    if not conn.execute("SELECT 1 FROM fx_rates LIMIT 1").fetchone() and \
+            conn.execute("SELECT 1 FROM market_data WHERE asset_type='FX' LIMIT 1").fetchone():
+        rebuild_fx_rates(conn)
+    # ... and the search index for databases seeded before it existed
+    if not conn.execute("SELECT 1 FROM search_index LIMIT 1").fetchone() and \
+            conn.execute("SELECT 1 FROM counterparties LIMIT 1").fetchone():
+        rebuild_search_index(conn)
     conn.commit()
     conn.close()
     print("Database schema initialised.")
+
+
+# ── Snapshot files ────────────────────────────────────────────────────────────
+# DB_PATH is a symlink to a published file in SNAPSHOT_DIR.  A rebuild (seed,
+# full recompute) writes a new file, built from scratch or from an online
+# backup of the current one, and publish() swaps the link with one atomic
+# rename.  Connections opened before the swap keep reading the file they
+# opened (SQLite resolves the link, so each file has its own WAL); new ones
+# see the new file.
+#
+# A build holds an exclusive flock on WRITE_LOCK from stage() to publish(),
+# and writes to the published file hold it shared (live_write), so no write
+# can land in the old file while a copy of it is being rebuilt.  Waiting
+# writers would stall for the whole build, so live_write() raises
+# BuildInProgress instead (routes answer 503) unless asked to wait.  flock
+# works across processes (CLI builds vs the web app) and is released if the
+# holder dies.
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(DB_PATH), "snapshots")
+KEEP_SNAPSHOTS = 3                 # published files kept, current included
+STALE_BUILD_SECONDS = 6 * 3600     # unpublished builds older than this are removed
+_BUILDING = ".building"
+
+_publish_lock = threading.Lock()
+
+
+class BuildInProgress(RuntimeError):
+    """A snapshot rebuild is running; live writes would be lost when it publishes."""
+
+
+def _write_lock():
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    return open(os.path.join(SNAPSHOT_DIR, _stem() + "write.lock"), "a")
+
+
+@contextmanager
+def live_write(wait=False):
+    """
+    Hold off snapshot builds while writing to the published database.
+    Raises BuildInProgress if one is running, or waits for it with wait=True.
+    """
+    lock = _write_lock()
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            raise BuildInProgress("a snapshot rebuild is in progress; retry when it is published")
+        yield
+    finally:
+        lock.close()
+
+
+def _stem():
+    return os.path.splitext(os.path.basename(DB_PATH))[0] + "-"
+
+
+def current():
+    """Real path of the published database file (None if there is none yet)."""
+    return os.path.realpath(DB_PATH) if os.path.exists(DB_PATH) else None
+
+
+def published():
+    """Published snapshot files for DB_PATH, oldest first."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    return sorted(os.path.join(SNAPSHOT_DIR, f) for f in os.listdir(SNAPSHOT_DIR)
+                  if f.startswith(_stem()) and f.endswith(".db"))
+
+
+def stage(copy=True):
+    """
+    Path of a new snapshot file to build into: an online backup of the
+    current database (readers and writers carry on), or empty with copy=False.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    path = os.path.join(SNAPSHOT_DIR, f"{_stem()}{stamp}.db{_BUILDING}")
+    if copy and os.path.exists(DB_PATH):
+        src = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        dst = sqlite3.connect(path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    return path
+
+
+def discard(path):
+    """Remove an unpublished build and its journal files."""
+    for f in (path, path + "-wal", path + "-shm", path + "-journal"):
+        if os.path.exists(f):
+            os.remove(f)
+
+
+def publish(path):
+    """
+    Check and checkpoint a finished build, then point DB_PATH at it
+    atomically.  Returns the published file's path.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        check = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"snapshot {path} failed quick_check: {check}")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()                   # last connection: WAL and shm are removed
+    if os.path.exists(path + "-wal"):
+        raise sqlite3.OperationalError(f"snapshot {path} is still open elsewhere")
+    final = path[:-len(_BUILDING)] if path.endswith(_BUILDING) else path
+    if final != path:
+        os.rename(path, final)
+    with _publish_lock:
+        legacy = os.path.exists(DB_PATH) and not os.path.islink(DB_PATH)
+        link = DB_PATH + ".next"
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(final, os.path.dirname(DB_PATH)), link)
+        os.replace(link, DB_PATH)
+        if legacy:                     # a plain database file replaced by the first link
+            for f in (DB_PATH + "-wal", DB_PATH + "-shm"):
+                if os.path.exists(f):
+                    os.remove(f)
+        prune()
+    return final
+
+
+def prune(keep=KEEP_SNAPSHOTS):
+    """Delete all but the newest `keep` published files (never the current one) and stale builds."""
+    live = current()
+    for f in published()[:-keep]:
+        if f != live:
+            discard(f)
+    cutoff = time.time() - STALE_BUILD_SECONDS
+    if os.path.isdir(SNAPSHOT_DIR):
+        for f in os.listdir(SNAPSHOT_DIR):
+            p = os.path.join(SNAPSHOT_DIR, f)
+            if f.startswith(_stem()) and f.endswith(_BUILDING) and os.path.getmtime(p) < cutoff:
+                discard(p)
+
+
+def recover():
+    """Re-point a missing or dangling DB_PATH at the newest published file."""
+    if os.path.exists(DB_PATH):
+        return current()
+    files = published()
+    if not files:
+        return None
+    if os.path.lexists(DB_PATH):
+        os.remove(DB_PATH)
+    os.symlink(os.path.relpath(files[-1], os.path.dirname(DB_PATH)), DB_PATH)
+    return files[-1]
+
+
+@contextmanager
+def staged(copy=True):
+    """
+    Connection to a new snapshot file (a copy of the current database by
+    default), published when the block exits cleanly and discarded otherwise.
+    Live writes are locked out from the copy until the swap (see live_write).
+    """
+    lock = _write_lock()
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)          # waits for in-flight writes to finish
+        path = stage(copy)
+        init_db(path)
+        conn = get_db(path)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.close()
+            discard(path)
+            raise
+        conn.close()
+        publish(path)
+    finally:
+        lock.close()
@@ -6,7 +6,7 @@ import json
 import random
 from datetime import date
 
-random.seed(42)
+from generators.rng import stream
 
 # PD (annual) by internal rating — S&P-calibrated
 PD_BY_RATING = {
@@ -50,9 +50,6 @@ SECTOR_PARAMS = {
     "Financial":     dict(assets=(20.0, 500.0), roe=(0.08, 0.18), equity_ratio=(0.08, 0.14), int_rate=(0.035,0.065)),
 }
 
-# FX: average 2023 rates to convert financials to USD for AI metadata
-FX_TO_USD = {"USD": 1.0, "GBP": 1.24, "CNY": 1/7.10, "BRL": 1/5.00, "ZAR": 1/18.8}
-
 # Base rate name by currency
 BASE_RATE = {"USD": "SOFR", "GBP": "SONIA", "CNY": "SHIBOR", "BRL": "CDI", "ZAR": "JIBAR"}
 
@@ -242,10 +239,10 @@ def insert_counterparties(conn):
 
 def insert_credit_ratings(conn, cp_rows):
     """Seed a 5-year rating history per counterparty (one entry per year + current)."""
-    rng = random.Random(99)
     records = []
     years = [2021, 2022, 2023, 2024, 2025]
     for cp in cp_rows:
+        rng = stream("credit_ratings", cp["id"])
         base_idx = RATING_ORDER.index(cp["internal_rating"])
         prev_idx = base_idx
         for yr in years:
@@ -4,21 +4,8 @@ Amounts in LOCAL CURRENCY BILLIONS unless stated.
 Financial Institutions (banks) use an asset-based model.
 """
 import json
-import random
 from generators.counterparties import SECTOR_PARAMS, RAW
-
-RNG = random.Random(7)
-
-# Year-average FX rate (local ccy units per 1 USD, or USD per GBP)
-# Used only to compute USD equivalents stored in ai_summary / embedding_text
-AVG_FX = {
-    # year: {ccy: local-per-USD}  (USD itself = 1.0)
-    2021: {"USD": 1.0, "GBP": 1/1.38, "CNY": 6.45, "BRL": 5.40, "ZAR": 15.5},
-    2022: {"USD": 1.0, "GBP": 1/1.24, "CNY": 6.73, "BRL": 5.16, "ZAR": 16.4},
-    2023: {"USD": 1.0, "GBP": 1/1.24, "CNY": 7.10, "BRL": 5.00, "ZAR": 18.8},
-    2024: {"USD": 1.0, "GBP": 1/1.28, "CNY": 7.20, "BRL": 5.20, "ZAR": 18.5},
-    2025: {"USD": 1.0, "GBP": 1/1.27, "CNY": 7.15, "BRL": 5.10, "ZAR": 18.5},
-}
+from generators.rng import stream, shard_map
 
 YEARS = [2021, 2022, 2023, 2024, 2025]
 
@@ -41,7 +28,7 @@ def _jitter(base, lo, hi, rng):
     return max(lo, min(hi, base + rng.uniform(-0.5, 0.5) * (hi - lo) * 0.15))
 
 
-def _gen_non_fi(cp_raw, cp_id):
+def _gen_non_fi(cp_raw, cp_id, rng):
     """Generate financials for a non-FI entity."""
     sp = SECTOR_PARAMS[cp_raw["sector"]]
     rows = []
@@ -51,32 +38,32 @@ def _gen_non_fi(cp_raw, cp_id):
     for yr_i, yr in enumerate(YEARS):
         # Apply sector growth (compound from base)
         g = SECTOR_GROWTH[cp_raw["sector"]][yr_i]
-        noise_g = RNG.uniform(-0.03, 0.03)
+        noise_g = rng.uniform(-0.03, 0.03)
         rev = rev_base * (1 + g + noise_g)
         rev_base = rev   # carry forward
 
         # EBITDA margin
-        em = _jitter(em_base, sp["ebitda_margin"][0], sp["ebitda_margin"][1], RNG)
+        em = _jitter(em_base, sp["ebitda_margin"][0], sp["ebitda_margin"][1], rng)
         ebitda = rev * em
 
         # D&A ≈ 5–9% of revenue
-        da_pct = RNG.uniform(0.05, 0.09)
+        da_pct = rng.uniform(0.05, 0.09)
         da     = rev * da_pct
         ebit   = ebitda - da
 
         # Leverage → total debt; capex
         leverage = _jitter(
             (sp["leverage"][0] + sp["leverage"][1]) / 2,
-            sp["leverage"][0], sp["leverage"][1], RNG
+            sp["leverage"][0], sp["leverage"][1], rng
         )
         total_debt = max(0.01, leverage * ebitda)
-        cash       = total_debt * RNG.uniform(0.05, 0.20)
+        cash       = total_debt * rng.uniform(0.05, 0.20)
         net_debt   = total_debt - cash
 
         # Interest expense
         int_rate = _jitter(
             (sp["int_rate"][0] + sp["int_rate"][1]) / 2,
-            sp["int_rate"][0], sp["int_rate"][1], RNG
+            sp["int_rate"][0], sp["int_rate"][1], rng
         )
         int_exp  = total_debt * int_rate
 
@@ -86,7 +73,7 @@ def _gen_non_fi(cp_raw, cp_id):
 
         capex_pct = _jitter(
             (sp["capex_rev"][0] + sp["capex_rev"][1]) / 2,
-            sp["capex_rev"][0], sp["capex_rev"][1], RNG
+            sp["capex_rev"][0], sp["capex_rev"][1], rng
         )
         capex = rev * capex_pct
         fcf   = net_inc + da - capex
@@ -122,44 +109,44 @@ def _gen_non_fi(cp_raw, cp_id):
     return rows
 
 
-def _gen_fi(cp_raw, cp_id):
+def _gen_fi(cp_raw, cp_id, rng):
     """Generate financials for a Financial Institution."""
     sp = SECTOR_PARAMS["Financial"]
     rows = []
     assets_base = _jitter(
         (sp["assets"][0] + sp["assets"][1]) / 2,
-        sp["assets"][0], sp["assets"][1], RNG
+        sp["assets"][0], sp["assets"][1], rng
     )
 
     for yr_i, yr in enumerate(YEARS):
         g = SECTOR_GROWTH["Financial"][yr_i]
-        assets_base = assets_base * (1 + g + RNG.uniform(-0.02, 0.02))
+        assets_base = assets_base * (1 + g + rng.uniform(-0.02, 0.02))
         assets      = assets_base
 
         eq_ratio    = _jitter(
             (sp["equity_ratio"][0] + sp["equity_ratio"][1]) / 2,
-            sp["equity_ratio"][0], sp["equity_ratio"][1], RNG
+            sp["equity_ratio"][0], sp["equity_ratio"][1], rng
         )
         equity = assets * eq_ratio
         total_debt = assets - equity
 
         roe = _jitter(
             (sp["roe"][0] + sp["roe"][1]) / 2,
-            sp["roe"][0], sp["roe"][1], RNG
+            sp["roe"][0], sp["roe"][1], rng
         )
         net_inc = equity * roe
         # Revenue proxy = Net Interest Income + Non-Interest Income
-        nim     = assets * RNG.uniform(0.012, 0.025)
-        fees    = net_inc * RNG.uniform(0.3, 0.6)
+        nim     = assets * rng.uniform(0.012, 0.025)
+        fees    = net_inc * rng.uniform(0.3, 0.6)
         revenue = nim + fees
         ebitda  = revenue * 0.35  # cost-income ratio ~65%
         ebit    = ebitda * 0.92
         int_exp = total_debt * _jitter(
             (sp["int_rate"][0] + sp["int_rate"][1]) / 2,
-            sp["int_rate"][0], sp["int_rate"][1], RNG
+            sp["int_rate"][0], sp["int_rate"][1], rng
         )
-        cash    = assets * RNG.uniform(0.05, 0.15)
-        capex   = revenue * RNG.uniform(0.02, 0.05)
+        cash    = assets * rng.uniform(0.05, 0.15)
+        capex   = revenue * rng.uniform(0.02, 0.05)
         fcf     = net_inc - capex
 
         rows.append({
@@ -219,14 +206,17 @@ def _fin_tags(net_debt, ebitda, em, ebit, int_exp):
     return tags
 
 
+def _financials_for_cp(cp_id):
+    cp_raw = RAW[cp_id - 1]
+    rng = stream("financials", cp_id)
+    if cp_raw["is_fi"]:
+        return _gen_fi(cp_raw, cp_id, rng)
+    return _gen_non_fi(cp_raw, cp_id, rng)
+
+
 def insert_financials(conn):
-    raw_by_id = {i+1: r for i, r in enumerate(RAW)}
     all_rows = []
-    for cp_id, cp_raw in raw_by_id.items():
-        if cp_raw["is_fi"]:
-            rows = _gen_fi(cp_raw, cp_id)
-        else:
-            rows = _gen_non_fi(cp_raw, cp_id)
+    for rows in shard_map(_financials_for_cp, range(1, len(RAW) + 1)):
         all_rows.extend(rows)
 
     conn.executemany("""
@@ -29,7 +29,7 @@ Credit spreads over risk-free (bps):
 import numpy as np
 from datetime import date, timedelta
 
-RNG = np.random.default_rng(42)
+from generators.rng import np_stream
 
 
 # ── Trading calendar ─────────────────────────────────────────────────────────
@@ -140,59 +140,64 @@ def generate_market_data():
     _wp_zar5  = [(0, 0.090), (300, 0.105), (600, 0.095), (n-1, 0.100)]
     _wp_zar2  = [(0, 0.085), (300, 0.100), (600, 0.090), (n-1, 0.093)]
 
-    def _rate(r0, wp, kappa, sigma):
+    # Each asset draws from its own stream, so adding or reordering assets
+    # leaves the others' paths unchanged
+    def _rng(asset_id):
+        return np_stream("market_data", asset_id)
+
+    def _rate(asset_id, r0, wp, kappa, sigma):
         tp = _theta_path(n, wp)
-        return _vasicek(r0, kappa, tp, sigma, n, RNG)
+        return _vasicek(r0, kappa, tp, sigma, n, _rng(asset_id))
 
     # USD rates
-    usd10 = _rate(0.015, _wp_usd10, kappa=0.35, sigma=0.007)
-    usd5  = _rate(0.014, _wp_usd5,  kappa=0.35, sigma=0.007)
-    usd2  = _rate(0.013, _wp_usd2,  kappa=0.45, sigma=0.008)
+    usd10 = _rate("USD_10Y", 0.015, _wp_usd10, kappa=0.35, sigma=0.007)
+    usd5  = _rate("USD_5Y",  0.014, _wp_usd5,  kappa=0.35, sigma=0.007)
+    usd2  = _rate("USD_2Y",  0.013, _wp_usd2,  kappa=0.45, sigma=0.008)
     _add("USD_10Y", "Rate", "USD", usd10 * 100)
     _add("USD_5Y",  "Rate", "USD", usd5  * 100)
     _add("USD_2Y",  "Rate", "USD", usd2  * 100)
 
     # GBP rates
-    gbp10 = _rate(0.010, _wp_gbp10, kappa=0.35, sigma=0.006)
-    gbp5  = _rate(0.009, _wp_gbp5,  kappa=0.35, sigma=0.006)
-    gbp2  = _rate(0.008, _wp_gbp2,  kappa=0.45, sigma=0.007)
+    gbp10 = _rate("GBP_10Y", 0.010, _wp_gbp10, kappa=0.35, sigma=0.006)
+    gbp5  = _rate("GBP_5Y",  0.009, _wp_gbp5,  kappa=0.35, sigma=0.006)
+    gbp2  = _rate("GBP_2Y",  0.008, _wp_gbp2,  kappa=0.45, sigma=0.007)
     _add("GBP_10Y", "Rate", "GBP", gbp10 * 100)
     _add("GBP_5Y",  "Rate", "GBP", gbp5  * 100)
     _add("GBP_2Y",  "Rate", "GBP", gbp2  * 100)
 
     # CNY rates
-    cny10 = _rate(0.031, _wp_cny10, kappa=0.40, sigma=0.003)
-    cny5  = _rate(0.030, _wp_cny5,  kappa=0.40, sigma=0.003)
-    cny2  = _rate(0.028, _wp_cny2,  kappa=0.40, sigma=0.003)
+    cny10 = _rate("CNY_10Y", 0.031, _wp_cny10, kappa=0.40, sigma=0.003)
+    cny5  = _rate("CNY_5Y",  0.030, _wp_cny5,  kappa=0.40, sigma=0.003)
+    cny2  = _rate("CNY_2Y",  0.028, _wp_cny2,  kappa=0.40, sigma=0.003)
     _add("CNY_10Y", "Rate", "CNY", cny10 * 100)
     _add("CNY_5Y",  "Rate", "CNY", cny5  * 100)
     _add("CNY_2Y",  "Rate", "CNY", cny2  * 100)
 
     # BRL rates (higher vol)
-    brl10 = _rate(0.110, _wp_brl10, kappa=0.25, sigma=0.015)
-    brl5  = _rate(0.108, _wp_brl5,  kappa=0.25, sigma=0.015)
-    brl2  = _rate(0.105, _wp_brl2,  kappa=0.30, sigma=0.016)
+    brl10 = _rate("BRL_10Y", 0.110, _wp_brl10, kappa=0.25, sigma=0.015)
+    brl5  = _rate("BRL_5Y",  0.108, _wp_brl5,  kappa=0.25, sigma=0.015)
+    brl2  = _rate("BRL_2Y",  0.105, _wp_brl2,  kappa=0.30, sigma=0.016)
     _add("BRL_10Y", "Rate", "BRL", brl10 * 100)
     _add("BRL_5Y",  "Rate", "BRL", brl5  * 100)
     _add("BRL_2Y",  "Rate", "BRL", brl2  * 100)
 
     # ZAR rates
-    zar10 = _rate(0.095, _wp_zar10, kappa=0.30, sigma=0.010)
-    zar5  = _rate(0.090, _wp_zar5,  kappa=0.30, sigma=0.010)
-    zar2  = _rate(0.085, _wp_zar2,  kappa=0.30, sigma=0.010)
+    zar10 = _rate("ZAR_10Y", 0.095, _wp_zar10, kappa=0.30, sigma=0.010)
+    zar5  = _rate("ZAR_5Y",  0.090, _wp_zar5,  kappa=0.30, sigma=0.010)
+    zar2  = _rate("ZAR_2Y",  0.085, _wp_zar2,  kappa=0.30, sigma=0.010)
     _add("ZAR_10Y", "Rate", "ZAR", zar10 * 100)
     _add("ZAR_5Y",  "Rate", "ZAR", zar5  * 100)
     _add("ZAR_2Y",  "Rate", "ZAR", zar2  * 100)
 
     # ── FX rates ──────────────────────────────────────────────────────────────
     # GBP/USD: GBP weakens from 1.37 to ~1.27
-    gbpusd = _gbm(1.367, -0.008, 0.075, n, RNG)
+    gbpusd = _gbm(1.367, -0.008, 0.075, n, _rng("GBPUSD"))
     # USD/CNY: CNY weakens; USDCNY rises 6.47 → ~7.15
-    usdcny = _gbm(6.47,  0.018,  0.040, n, RNG)
+    usdcny = _gbm(6.47,  0.018,  0.040, n, _rng("USDCNY"))
     # USD/BRL: BRL volatile, slight appreciation
-    usdbrl = _gbm(5.40, -0.008,  0.140, n, RNG)
+    usdbrl = _gbm(5.40, -0.008,  0.140, n, _rng("USDBRL"))
     # USD/ZAR: ZAR weakens 15.5 → ~18.5
-    usdzar = _gbm(15.50,  0.025,  0.110, n, RNG)
+    usdzar = _gbm(15.50,  0.025,  0.110, n, _rng("USDZAR"))
 
     _add("GBPUSD", "FX", "USD", gbpusd)
     _add("USDCNY", "FX", "CNY", usdcny)
@@ -200,11 +205,11 @@ def generate_market_data():
     _add("USDZAR", "FX", "ZAR", usdzar)
 
     # ── Equity indices ────────────────────────────────────────────────────────
-    spx  = _gbm(3756,   0.115, 0.180, n, RNG)   # S&P 500
-    ftse = _gbm(6720,   0.045, 0.140, n, RNG)   # FTSE 100
-    csi  = _gbm(5211,   0.015, 0.200, n, RNG)   # CSI 300
-    ibov = _gbm(119345, 0.055, 0.210, n, RNG)   # Ibovespa
-    jse  = _gbm(58967,  0.075, 0.175, n, RNG)   # JSE Top 40
+    spx  = _gbm(3756,   0.115, 0.180, n, _rng("US_SPX"))   # S&P 500
+    ftse = _gbm(6720,   0.045, 0.140, n, _rng("UK_FTSE"))   # FTSE 100
+    csi  = _gbm(5211,   0.015, 0.200, n, _rng("CN_CSI"))   # CSI 300
+    ibov = _gbm(119345, 0.055, 0.210, n, _rng("BR_IBOV"))   # Ibovespa
+    jse  = _gbm(58967,  0.075, 0.175, n, _rng("ZA_JSE"))   # JSE Top 40
 
     _add("US_SPX",  "Equity", "USD", spx)
     _add("UK_FTSE", "Equity", "GBP", ftse)
@@ -214,12 +219,12 @@ def generate_market_data():
 
     # ── Credit spreads (bps, generic market) ──────────────────────────────────
     # Base spreads post-pandemic: tighten in 2021, widen 2022 (Fed hike), normalise
-    cs_aa  = _spread_path(15,   kappa=1.5, sigma_bps=2,   n=n, rng=RNG)
-    cs_a   = _spread_path(35,   kappa=1.2, sigma_bps=4,   n=n, rng=RNG)
-    cs_bbb = _spread_path(90,   kappa=1.0, sigma_bps=8,   n=n, rng=RNG)
-    cs_bb  = _spread_path(220,  kappa=0.8, sigma_bps=18,  n=n, rng=RNG)
-    cs_b   = _spread_path(420,  kappa=0.7, sigma_bps=35,  n=n, rng=RNG)
-    cs_ccc = _spread_path(900,  kappa=0.5, sigma_bps=80,  n=n, rng=RNG)
+    cs_aa  = _spread_path(15,   kappa=1.5, sigma_bps=2,   n=n, rng=_rng("CS_AA"))
+    cs_a   = _spread_path(35,   kappa=1.2, sigma_bps=4,   n=n, rng=_rng("CS_A"))
+    cs_bbb = _spread_path(90,   kappa=1.0, sigma_bps=8,   n=n, rng=_rng("CS_BBB"))
+    cs_bb  = _spread_path(220,  kappa=0.8, sigma_bps=18,  n=n, rng=_rng("CS_BB"))
+    cs_b   = _spread_path(420,  kappa=0.7, sigma_bps=35,  n=n, rng=_rng("CS_B"))
+    cs_ccc = _spread_path(900,  kappa=0.5, sigma_bps=80,  n=n, rng=_rng("CS_CCC"))
 
     _add("CS_AA",  "CreditSpread", "USD", cs_aa)
     _add("CS_A",   "CreditSpread", "USD", cs_a)
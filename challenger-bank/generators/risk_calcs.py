@@ -23,13 +23,11 @@ Country Risk
 """
 import json
 import math
-import random
 from datetime import date, timedelta
 from generators.counterparties import (
     PD_BY_RATING, RATING_ORDER, RAW
 )
-
-RNG = random.Random(55)
+from generators.rng import stream, shard_map
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
@@ -48,8 +46,8 @@ while len(MONTHS_60) < 60:
 IG_RATINGS = {"AAA","AA+","AA","AA-","A+","A","A-","BBB+","BBB","BBB-"}
 TODAY_STR  = "2025-12-31"
 
-# FX end-2025
-FX_END25 = {"USD": 1.0, "GBP": 1/1.27, "CNY": 1/7.15, "BRL": 1/5.10, "ZAR": 1/18.5}
+# CSA collateral haircuts by asset type
+COLLATERAL_HAIRCUTS = {"Cash": 0.0, "Government Bond": 0.02, "IG Bond": 0.08}
 
 # Daily vol of risk factors (bps or % as appropriate)
 RATE_DVOL = {"USD": 6, "GBP": 5.5, "CNY": 2, "BRL": 18, "ZAR": 14}   # bps/day
@@ -64,36 +62,43 @@ Z99 = 2.326
 # 1. PD HISTORY
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _pd_drift(base_pd, month_idx):
+def _pd_drift(base_pd, month_idx, rng):
     """Small random walk on logit(PD) to simulate time-varying PD."""
     logit = math.log(base_pd / (1 - base_pd))
-    logit += RNG.gauss(0, 0.04)   # monthly noise
+    logit += rng.gauss(0, 0.04)   # monthly noise
     pd = 1 / (1 + math.exp(-logit))
     return max(0.00005, min(0.99, pd))
 
 
+def _pd_rows(cp):
+    rng      = stream("pd_history", cp["id"])
+    rating   = cp["internal_rating"]
+    base_pd  = PD_BY_RATING.get(rating, 0.01)
+    base_cs  = 100 * base_pd * 4   # rough CDS spread proxy
+    rows = []
+    # Cumulative PDs (Markov chain approximation)
+    pd1 = base_pd
+    for i, snap_date in enumerate(MONTHS_60):
+        pd1 = _pd_drift(pd1, i, rng)
+        pd3 = 1 - (1 - pd1) ** 3
+        pd5 = 1 - (1 - pd1) ** 5
+        cs  = max(1, base_cs * (pd1 / base_pd) + rng.uniform(-5, 5))
+        rows.append({
+            "counterparty_id": cp["id"],
+            "snapshot_date":   snap_date,
+            "pd_1y":           round(pd1, 6),
+            "pd_3y":           round(pd3, 6),
+            "pd_5y":           round(pd5, 6),
+            "rating":          rating,
+            "credit_spread_bps": round(cs, 1),
+        })
+    return rows
+
+
 def insert_pd_history(conn, cp_rows):
     rows = []
-    for cp in cp_rows:
-        rating   = cp["internal_rating"]
-        base_pd  = PD_BY_RATING.get(rating, 0.01)
-        base_cs  = 100 * base_pd * 4   # rough CDS spread proxy
-        # Cumulative PDs (Markov chain approximation)
-        pd1 = base_pd
-        for i, snap_date in enumerate(MONTHS_60):
-            pd1 = _pd_drift(pd1, i)
-            pd3 = 1 - (1 - pd1) ** 3
-            pd5 = 1 - (1 - pd1) ** 5
-            cs  = max(1, base_cs * (pd1 / base_pd) + RNG.uniform(-5, 5))
-            rows.append({
-                "counterparty_id": cp["id"],
-                "snapshot_date":   snap_date,
-                "pd_1y":           round(pd1, 6),
-                "pd_3y":           round(pd3, 6),
-                "pd_5y":           round(pd5, 6),
-                "rating":          rating,
-                "credit_spread_bps": round(cs, 1),
-            })
+    for cp_pd in shard_map(_pd_rows, cp_rows):
+        rows.extend(cp_pd)
     conn.executemany("""
         INSERT OR IGNORE INTO pd_history
         (counterparty_id, snapshot_date, pd_1y, pd_3y, pd_5y, rating, credit_spread_bps)
@@ -136,9 +141,9 @@ STRESS_IDX = [
 ]
 
 
-def _var_for_desk_month(desk, stress):
+def _var_for_desk_month(desk, stress, rng):
     base = BASE_VAR[desk]
-    noise = RNG.uniform(0.85, 1.15)
+    noise = rng.uniform(0.85, 1.15)
     v1 = base * stress * noise
     es  = v1 * 1.25        # ES ≈ 1.25 × VaR (Normal approx)
     v10 = v1 * math.sqrt(10)
@@ -148,11 +153,12 @@ def _var_for_desk_month(desk, stress):
 
 def insert_var_history(conn):
     rows = []
+    desk_rng = {desk: stream("var_history", desk) for desk in DESKS}
     for i, snap_date in enumerate(MONTHS_60):
         stress = STRESS_IDX[i] if i < len(STRESS_IDX) else 1.1
         desk_vars = {}
         for desk in DESKS:
-            v1, es, v10, sv = _var_for_desk_month(desk, stress)
+            v1, es, v10, sv = _var_for_desk_month(desk, stress, desk_rng[desk])
             desk_vars[desk] = v1
             rows.append({
                 "snapshot_date": snap_date,
@@ -187,6 +193,7 @@ def insert_pnl_attribution(conn):
     rows = []
     # Desk P&L std dev (M USD/month) — roughly VaR / 2.326 × sqrt(21)
     DESK_STD = {d: BASE_VAR[d] / Z99 * math.sqrt(21) for d in DESKS}
+    desk_rng = {d: stream("pnl_attribution", d) for d in DESKS}
 
     for i, snap_date in enumerate(MONTHS_60):
         stress = STRESS_IDX[i] if i < len(STRESS_IDX) else 1.1
@@ -194,7 +201,7 @@ def insert_pnl_attribution(conn):
             std = DESK_STD[desk] * stress
             # Positive drift: bank makes money on avg (small Sharpe ~0.3)
             drift = std * 0.08
-            total = RNG.gauss(drift, std)
+            total = desk_rng[desk].gauss(drift, std)
             # Split total into risk-factor components
             if desk == "Rates":
                 r_pnl = total * 0.6; fx_pnl = total * 0.1; cr_pnl = total * 0.1; eq_pnl = 0; th = total * 0.15; ot = total * 0.05
@@ -251,16 +258,17 @@ def insert_netting_sets(conn, cp_rows):
     for cp in cp_rows:
         if not _has_trading(cp["id"]):
             continue
+        rng    = stream("netting_sets", cp["id"])
         is_fi  = cp["is_financial_institution"]
         rating = cp["internal_rating"]
         ns_id  = f"NS-{cp['id']:03d}"
         has_csa = 1 if (is_fi or rating in IG_RATINGS) else 0
-        threshold = round(RNG.uniform(5, 50), 1) if has_csa else None   # M USD
-        mta       = round(RNG.uniform(0.5, 5.0), 2) if has_csa else None
+        threshold = round(rng.uniform(5, 50), 1) if has_csa else None   # M USD
+        mta       = round(rng.uniform(0.5, 5.0), 2) if has_csa else None
         ns_rows.append({
             "counterparty_id":      cp["id"],
             "netting_set_id":       ns_id,
-            "agreement_type":       "ISDA 2002" if is_fi else RNG.choice(["ISDA 2002","ISDA 1992"]),
+            "agreement_type":       "ISDA 2002" if is_fi else rng.choice(["ISDA 2002","ISDA 1992"]),
             "csa_in_place":         has_csa,
             "threshold_received_usd": threshold,
             "threshold_posted_usd":   threshold,
@@ -280,23 +288,27 @@ def insert_netting_sets(conn, cp_rows):
     # Collateral — current snapshot
     ns_db = {r["counterparty_id"]: r["id"]
              for r in conn.execute("SELECT id, counterparty_id FROM netting_sets").fetchall()}
+    has_csa_by_cp = {r["counterparty_id"]: r["csa_in_place"] for r in ns_rows}
     coll_rows = []
     for cp in cp_rows:
         ns_db_id = ns_db.get(cp["id"])
         if not ns_db_id:
             continue
-        if not _has_trading(cp["id"]):
+        if not _has_trading(cp["id"]) or not has_csa_by_cp[cp["id"]]:
             continue
-        # Posted collateral
-        coll_usd = round(RNG.uniform(0.5, 20.0), 2)
+        rng = stream("collateral", cp["id"])
+        # Received collateral (re-derived from the CSA by services.exposure)
+        coll_usd = round(rng.uniform(0.5, 20.0), 2)
+        coll_type = rng.choice(["Cash", "Government Bond"])
+        haircut = COLLATERAL_HAIRCUTS[coll_type]
         coll_rows.append({
             "netting_set_id":  ns_db_id,
             "snapshot_date":   TODAY_STR,
-            "collateral_type": RNG.choice(["Cash", "Government Bond"]),
+            "collateral_type": coll_type,
             "currency":        "USD",
             "notional_usd":    coll_usd,
-            "haircut":         0.0 if True else 0.02,
-            "eligible_value_usd": coll_usd,
+            "haircut":         haircut,
+            "eligible_value_usd": round(coll_usd * (1 - haircut), 2),
             "direction":       "Received",
         })
 
@@ -325,6 +337,94 @@ def _pfe_tenor(gross_notional_usd, sigma_rate=0.007, tenor_y=1.0):
     return gross_notional_usd * sigma_rate * math.sqrt(tenor_y) * Z99
 
 
+def _ccr_rows(args):
+    """MtM exposure, CVA, PFE and SA-CCR rows for one counterparty."""
+    cp, ns_db_id, mtm, coll = args
+    rng      = stream("ccr_metrics", cp["id"])
+    cp_id    = cp["id"]
+    rating   = cp["internal_rating"]
+    pd_1y    = PD_BY_RATING.get(rating, 0.02)
+    lgd      = 0.40 if rating in IG_RATINGS else 0.55
+    mtm_exp_rows = []
+    cva_rows     = []
+
+    m = mtm or {"pos": 5.0, "neg": -2.0, "notional": 100.0}
+    gross_notional = m["notional"]  # USD millions
+
+    # Monthly snapshots of exposure
+    pos_base = abs(m["pos"])
+    neg_base = abs(m["neg"])
+    for i, snap_date in enumerate(MONTHS_60):
+        noise = rng.uniform(0.8, 1.25)
+        pos_mtm = round(pos_base * noise, 3)
+        neg_mtm = round(neg_base * noise, 3)
+        net_mtm = round(pos_mtm - neg_mtm, 3)
+        ce      = round(max(net_mtm - coll, 0), 3)
+        mtm_exp_rows.append({
+            "counterparty_id":       cp_id,
+            "netting_set_id":        ns_db_id,
+            "snapshot_date":         snap_date,
+            "gross_positive_mtm_usd":pos_mtm,
+            "gross_negative_mtm_usd":-neg_mtm,
+            "net_mtm_usd":           net_mtm,
+            "collateral_held_usd":   coll,
+            "current_exposure_usd":  ce,
+        })
+
+        # CVA = LGD × PD × EE × discount_factor (simplified)
+        ee   = max(ce * 0.7 + pos_mtm * 0.3, 0.1)
+        cva  = -lgd * pd_1y * ee   # negative (cost)
+        cva_rows.append({
+            "counterparty_id":    cp_id,
+            "snapshot_date":      snap_date,
+            "cva_usd":            round(cva, 4),
+            "dva_usd":            round(-cva * 0.3, 4),
+            "bilateral_cva_usd":  round(cva * 0.7, 4),
+            "pd_market_implied":  round(pd_1y * (0.9 + rng.uniform(0, 0.2)), 6),
+            "lgd_assumption":     lgd,
+        })
+
+    # PFE profile (current snapshot)
+    n_usd = gross_notional
+    pfe_row = {
+        "counterparty_id":    cp_id,
+        "snapshot_date":      TODAY_STR,
+        "pfe_1m":    round(_pfe_tenor(n_usd, 0.007, 1/12), 3),
+        "pfe_3m":    round(_pfe_tenor(n_usd, 0.007, 3/12), 3),
+        "pfe_6m":    round(_pfe_tenor(n_usd, 0.007, 0.5),  3),
+        "pfe_1y":    round(_pfe_tenor(n_usd, 0.007, 1.0),  3),
+        "pfe_2y":    round(_pfe_tenor(n_usd, 0.007, 2.0),  3),
+        "pfe_3y":    round(_pfe_tenor(n_usd, 0.007, 3.0),  3),
+        "pfe_5y":    round(_pfe_tenor(n_usd, 0.007, 5.0),  3),
+        "pfe_7y":    round(_pfe_tenor(n_usd, 0.007, 7.0),  3),
+        "pfe_10y":   round(_pfe_tenor(n_usd, 0.007, 10.0), 3),
+        "pfe_peak":  round(_pfe_tenor(n_usd, 0.007, 5.0),  3),
+        "pfe_peak_tenor": "5Y",
+        "expected_exposure_avg": round(_pfe_tenor(n_usd, 0.007, 2.0) * 0.6, 3),
+    }
+
+    # SA-CCR (current snapshot)
+    # RC = max(net MtM, 0) / 1000 (convert M to B for consistency)
+    net_mtm_curr = mtm or {"pos":0,"neg":0}
+    rc   = max((net_mtm_curr["pos"] + net_mtm_curr["neg"]) / 1000, 0)
+    # PFE add-on ≈ 10% of gross notional (simplified)
+    pfe_addon = gross_notional * 0.10 / 1000
+    ead  = 1.4 * (rc + pfe_addon)
+    rw   = 0.50 if rating in IG_RATINGS else 1.00
+    rwa  = ead * rw
+    saccr_row = {
+        "counterparty_id":   cp_id,
+        "snapshot_date":     TODAY_STR,
+        "replacement_cost_usd": round(rc, 6),
+        "pfe_addon_usd":     round(pfe_addon, 6),
+        "ead_usd":           round(ead, 6),
+        "risk_weight":       rw,
+        "rwa_usd":           round(rwa, 6),
+    }
+
+    return mtm_exp_rows, cva_rows, pfe_row, saccr_row
+
+
 def insert_ccr_metrics(conn, cp_rows):
     """Insert mtm_exposure (monthly), pfe_profiles, cva_history, sa_ccr."""
     # Get netting set DB ids
@@ -358,89 +458,17 @@ def insert_ccr_metrics(conn, cp_rows):
     cva_rows     = []
     saccr_rows   = []
 
+    jobs = []
     for cp in cp_rows:
-        cp_id  = cp["id"]
-        if cp_id not in ns_map:
+        if cp["id"] not in ns_map:
             continue
-        ns_db_id = ns_map[cp_id]["ns_id"]
-        rating   = cp["internal_rating"]
-        pd_1y    = PD_BY_RATING.get(rating, 0.02)
-        lgd      = 0.40 if rating in IG_RATINGS else 0.55
-
-        m = mtm_by_cp.get(cp_id, {"pos": 5.0, "neg": -2.0, "notional": 100.0})
-        coll = coll_by_ns.get(ns_db_id, 0)
-        gross_notional = m["notional"]  # USD millions
-
-        # Monthly snapshots of exposure
-        pos_base = abs(m["pos"])
-        neg_base = abs(m["neg"])
-        for i, snap_date in enumerate(MONTHS_60):
-            noise = RNG.uniform(0.8, 1.25)
-            pos_mtm = round(pos_base * noise, 3)
-            neg_mtm = round(neg_base * noise, 3)
-            net_mtm = round(pos_mtm - neg_mtm, 3)
-            ce      = round(max(net_mtm - coll, 0), 3)
-            mtm_exp_rows.append({
-                "counterparty_id":       cp_id,
-                "netting_set_id":        ns_db_id,
-                "snapshot_date":         snap_date,
-                "gross_positive_mtm_usd":pos_mtm,
-                "gross_negative_mtm_usd":-neg_mtm,
-                "net_mtm_usd":           net_mtm,
-                "collateral_held_usd":   coll,
-                "current_exposure_usd":  ce,
-            })
-
-            # CVA = LGD × PD × EE × discount_factor (simplified)
-            ee   = max(ce * 0.7 + pos_mtm * 0.3, 0.1)
-            cva  = -lgd * pd_1y * ee   # negative (cost)
-            cva_rows.append({
-                "counterparty_id":    cp_id,
-                "snapshot_date":      snap_date,
-                "cva_usd":            round(cva, 4),
-                "dva_usd":            round(-cva * 0.3, 4),
-                "bilateral_cva_usd":  round(cva * 0.7, 4),
-                "pd_market_implied":  round(pd_1y * (0.9 + RNG.uniform(0, 0.2)), 6),
-                "lgd_assumption":     lgd,
-            })
-
-        # PFE profile (current snapshot)
-        n_usd = gross_notional
-        pfe_rows.append({
-            "counterparty_id":    cp_id,
-            "snapshot_date":      TODAY_STR,
-            "pfe_1m":    round(_pfe_tenor(n_usd, 0.007, 1/12), 3),
-            "pfe_3m":    round(_pfe_tenor(n_usd, 0.007, 3/12), 3),
-            "pfe_6m":    round(_pfe_tenor(n_usd, 0.007, 0.5),  3),
-            "pfe_1y":    round(_pfe_tenor(n_usd, 0.007, 1.0),  3),
-            "pfe_2y":    round(_pfe_tenor(n_usd, 0.007, 2.0),  3),
-            "pfe_3y":    round(_pfe_tenor(n_usd, 0.007, 3.0),  3),
-            "pfe_5y":    round(_pfe_tenor(n_usd, 0.007, 5.0),  3),
-            "pfe_7y":    round(_pfe_tenor(n_usd, 0.007, 7.0),  3),
-            "pfe_10y":   round(_pfe_tenor(n_usd, 0.007, 10.0), 3),
-            "pfe_peak":  round(_pfe_tenor(n_usd, 0.007, 5.0),  3),
-            "pfe_peak_tenor": "5Y",
-            "expected_exposure_avg": round(_pfe_tenor(n_usd, 0.007, 2.0) * 0.6, 3),
-        })
-
-        # SA-CCR (current snapshot)
-        # RC = max(net MtM, 0) / 1000 (convert M to B for consistency)
-        net_mtm_curr = mtm_by_cp.get(cp_id, {"pos":0,"neg":0})
-        rc   = max((net_mtm_curr["pos"] + net_mtm_curr["neg"]) / 1000, 0)
-        # PFE add-on ≈ 10% of gross notional (simplified)
-        pfe_addon = gross_notional * 0.10 / 1000
-        ead  = 1.4 * (rc + pfe_addon)
-        rw   = 0.50 if rating in IG_RATINGS else 1.00
-        rwa  = ead * rw
-        saccr_rows.append({
-            "counterparty_id":   cp_id,
-            "snapshot_date":     TODAY_STR,
-            "replacement_cost_usd": round(rc, 6),
-            "pfe_addon_usd":     round(pfe_addon, 6),
-            "ead_usd":           round(ead, 6),
-            "risk_weight":       rw,
-            "rwa_usd":           round(rwa, 6),
-        })
+        ns_db_id = ns_map[cp["id"]]["ns_id"]
+        jobs.append((cp, ns_db_id, mtm_by_cp.get(cp["id"]), coll_by_ns.get(ns_db_id, 0)))
+    for mtm_exp, cva, pfe, saccr in shard_map(_ccr_rows, jobs):
+        mtm_exp_rows.extend(mtm_exp)
+        cva_rows.extend(cva)
+        pfe_rows.append(pfe)
+        saccr_rows.append(saccr)
 
     conn.executemany("""
         INSERT OR IGNORE INTO mtm_exposure
@@ -0,0 +1,61 @@
+"""
+Deterministic random streams for the seed generators.
+
+Every draw comes from a stream keyed by (generator, entity) — e.g.
+stream("trades", cp_id) — derived from ROOT_SEED through numpy's SeedSequence
+spawn keys.  A counterparty's rows therefore depend only on its own key, not on
+which entities were generated before it or in which process, so per-entity
+work can be sharded across a process pool and still be bit-identical.
+
+    rng = stream("pd_history", cp_id)        # random.Random
+    rng = np_stream("market_data", "USD_10Y") # numpy Generator (Philox)
+
+Set BANK_SEED to draw a different (but equally reproducible) universe and
+SEED_WORKERS to shard per-entity generation over processes.
+"""
+import os
+import random
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ROOT_SEED = int(os.environ.get("BANK_SEED", "20251231"))
+WORKERS   = int(os.environ.get("SEED_WORKERS", "1"))
+
+
+def _word(part):
+    """Map a key component to a stable uint32 (ints as-is, strings by CRC32)."""
+    if isinstance(part, (int, np.integer)):
+        return int(part) & 0xFFFFFFFF
+    return zlib.crc32(str(part).encode())
+
+
+def seed_sequence(generator, *entity):
+    return np.random.SeedSequence(ROOT_SEED, spawn_key=(_word(generator), *map(_word, entity)))
+
+
+def np_stream(generator, *entity):
+    """Counter-based numpy Generator for (generator, entity)."""
+    return np.random.Generator(np.random.Philox(seed_sequence(generator, *entity)))
+
+
+def stream(generator, *entity):
+    """random.Random for (generator, entity), seeded from the same sequence."""
+    state = seed_sequence(generator, *entity).generate_state(4, np.uint64)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
+
+
+def shard_map(fn, items, workers=None):
+    """
+    [fn(x) for x in items], optionally over a process pool.  Output order
+    follows `items`, so callers can concatenate results deterministically.
+    fn must be a module-level function (picklable).
+    """
+    items = list(items)
+    workers = WORKERS if workers is None else workers
+    if workers <= 1 or len(items) < 2:
+        return [fn(x) for x in items]
+    chunk = max(1, len(items) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(fn, items, chunksize=chunk))
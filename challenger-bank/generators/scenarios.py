@@ -139,7 +139,10 @@ def insert_scenarios(conn):
     scenario_ids = {row["scenario_name"]: row["id"]
                     for row in conn.execute("SELECT id, scenario_name FROM scenarios").fetchall()}
 
-    positions = conn.execute("SELECT * FROM positions WHERE snapshot_date='2025-12-31'").fetchall()
+    positions = conn.execute("""
+        SELECT * FROM positions
+        WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM snapshots WHERE table_name='positions')
+    """).fetchall()
 
     results = []
     for sc in SCENARIOS:
@@ -4,7 +4,12 @@ Master seed script — run once to build the full synthetic dataset.
 Usage (from the challenger-bank/ directory):
     python -m generators.seed_all          # or
     python generators/seed_all.py
+    python -m generators.seed_all --force --workers 8
+
+Every generator draws from per-(generator, entity) streams (generators.rng),
+so the output is identical for any --workers value.
 """
+import argparse
 import os
 import sys
 import time
@@ -12,7 +17,7 @@ import time
 # Allow running as script from project root
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from db import init_db, get_db, DB_PATH
+from db import get_db, DB_PATH, current, staged
 from generators.counterparties import insert_counterparties, insert_credit_ratings
 from generators.market_data import insert_market_data
 from generators.financials import insert_financials
@@ -27,68 +32,91 @@ from generators.risk_calcs import (
     insert_country_risk,
 )
 from generators.scenarios import insert_scenarios
+from services.pnl_explain import backfill as backfill_pnl_explain
+from services.anomaly import score as score_anomalies
+from services.covenants import run as run_covenant_tests
+from services.exposure import recompute as recompute_exposure
+from generators import rng
+
+
+def seed(force=False, workers=None, progress=None):
+    """Build the dataset into a new snapshot; progress(label) is called at each step."""
+    def step(label):
+        print(label)
+        if progress:
+            progress(label.strip())
 
+    if workers is not None:
+        rng.WORKERS = workers
 
-def seed(force=False):
     if os.path.exists(DB_PATH) and not force:
         print(f"Database already exists at {DB_PATH}.")
-        print("Pass force=True or delete the file to re-seed.")
+        print("Pass force=True (--force) to build and publish a fresh snapshot.")
         return
 
-    if os.path.exists(DB_PATH) and force:
-        os.remove(DB_PATH)
-        print(f"Removed existing database.")
-
     t0 = time.time()
     print(f"\n{'='*60}")
     print("  Challenger Bank — Synthetic Dataset Generation")
     print(f"{'='*60}")
 
-    print("\n[1/10] Initialising schema …")
-    init_db()
+    # Build into a new snapshot file; DB_PATH switches to it only once complete,
+    # so a re-seed never takes the current database away from its readers.
+    step("\n[1/10] Initialising schema …")
+    with staged(copy=False) as conn:
+        step("[2/10] Counterparties + credit ratings …")
+        cp_rows = insert_counterparties(conn)
+        insert_credit_ratings(conn, cp_rows)
+
+        step("[3/10] Market data (5y daily × 31 assets) …")
+        insert_market_data(conn)
 
-    conn = get_db()
+        step("[4/10] Annual financials (5y × 50 entities) …")
+        insert_financials(conn)
 
-    print("[2/10] Counterparties + credit ratings …")
-    cp_rows = insert_counterparties(conn)
-    insert_credit_ratings(conn, cp_rows)
+        step("[5/10] Credit facilities + credit events …")
+        insert_credit_facilities(conn, cp_rows)
 
-    print("[3/10] Market data (5y daily × 31 assets) …")
-    insert_market_data(conn)
+        step("[6/10] Trade blotter + positions snapshot …")
+        insert_trades(conn, cp_rows)
 
-    print("[4/10] Annual financials (5y × 50 entities) …")
-    insert_financials(conn)
+        step("[7/10] PD history (60 months × 50 counterparties) …")
+        insert_pd_history(conn, cp_rows)
 
-    print("[5/10] Credit facilities + credit events …")
-    insert_credit_facilities(conn, cp_rows)
+        step("[8/10] VaR history + P&L attribution (60 months) …")
+        insert_var_history(conn)
+        insert_pnl_attribution(conn)
 
-    print("[6/10] Trade blotter + positions snapshot …")
-    insert_trades(conn, cp_rows)
+        step("[9/10] CCR: netting sets, collateral, MtM, PFE, CVA, SA-CCR …")
+        insert_netting_sets(conn, cp_rows)
+        insert_ccr_metrics(conn, cp_rows)
 
-    print("[7/10] PD history (60 months × 50 counterparties) …")
-    insert_pd_history(conn, cp_rows)
+        step("[9b/10] Country risk limits, exposures, transfer risk …")
+        insert_country_risk(conn, cp_rows)
 
-    print("[8/10] VaR history + P&L attribution (60 months) …")
-    insert_var_history(conn)
-    insert_pnl_attribution(conn)
+        step("[9c/10] Netting-set exposure + CSA collateral (historical repricing) …")
+        n_exposure = recompute_exposure(conn)
+        print(f"  Wrote {n_exposure:,} mtm_exposure rows.")
 
-    print("[9/10] CCR: netting sets, collateral, MtM, PFE, CVA, SA-CCR …")
-    insert_netting_sets(conn, cp_rows)
-    insert_ccr_metrics(conn, cp_rows)
+        step("[10/10] Scenarios + scenario results …")
+        insert_scenarios(conn)
 
-    print("[9b/10] Country risk limits, exposures, transfer risk …")
-    insert_country_risk(conn, cp_rows)
+        step("[10b/10] P&L explain over market data moves …")
+        n_explain = backfill_pnl_explain(conn)
+        print(f"  Inserted {n_explain:,} P&L explain rows.")
 
-    print("[10/10] Scenarios + scenario results …")
-    insert_scenarios(conn)
+        step("[10c/10] Covenant tests …")
+        result = run_covenant_tests(conn, full=True)
+        print(f"  Tested {result['tested']:,} facility-years, {result['events_opened']:,} breach events.")
 
-    conn.close()
+        step("[10d/10] Anomaly scores + alert flags …")
+        result = score_anomalies(conn, full=True)
+        print(f"  Scored {result['counterparties']:,} counterparties, {result['flagged']:,} flagged.")
 
     elapsed = time.time() - t0
-    size_mb = os.path.getsize(DB_PATH) / 1_048_576
+    size_mb = os.path.getsize(current()) / 1_048_576
     print(f"\n{'='*60}")
     print(f"  Seeding complete in {elapsed:.1f}s")
-    print(f"  Database: {DB_PATH}")
+    print(f"  Database: {DB_PATH} → {current()}")
     print(f"  Size:     {size_mb:.1f} MB")
     print(f"{'='*60}\n")
 
@@ -102,7 +130,7 @@ def seed(force=False):
         "netting_sets", "collateral", "mtm_exposure",
         "pfe_profiles", "cva_history", "sa_ccr",
         "country_exposures", "country_limits", "transfer_risk",
-        "scenarios", "scenario_results",
+        "scenarios", "scenario_results", "pnl_explain", "covenant_tests",
     ]
     print(f"  {'Table':<30} {'Rows':>8}")
     print(f"  {'-'*40}")
@@ -117,5 +145,8 @@ def seed(force=False):
 
 
 if __name__ == "__main__":
-    force = "--force" in sys.argv or "-f" in sys.argv
-    seed(force=force)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-f", "--force", action="store_true", help="build a fresh dataset into a new snapshot and publish it over the current one")
+    ap.add_argument("--workers", type=int, default=None, help="processes for per-counterparty generation")
+    args = ap.parse_args()
+    seed(force=args.force, workers=args.workers)
@@ -8,13 +8,13 @@ All monetary amounts in USD millions unless stated.
 """
 import json
 import math
-import random
 from datetime import date, timedelta
 from generators.counterparties import PD_BY_RATING, SPREAD_BY_RATING, RAW
-
-RNG = random.Random(21)
+from generators.rng import stream, shard_map
+from services import curves, options
 
 # End-2025 market snapshot (approximate) used for MtM
+MKT_DATE = date(2025, 12, 31)
 MKT = {
     "USD_10Y": 4.45,   # %
     "USD_5Y":  4.30,
@@ -35,8 +35,10 @@ MKT = {
     "CN_CSI":  3900,
 }
 
-# FX end-2025: local ccy per USD (for USD-equivalent notional)
-FX_TO_USD = {"USD": 1.0, "GBP": 1/1.27, "CNY": 1/7.15, "BRL": 1/5.10, "ZAR": 1/18.5}
+# Booking FX (USD per unit) at the MKT spots above.  Generators run in worker
+# processes without the database; reporting converts via fx_rates (services/fx.py).
+FX_TO_USD = {"USD": 1.0, "GBP": MKT["GBPUSD"], "CNY": 1 / MKT["USDCNY"],
+             "BRL": 1 / MKT["USDBRL"], "ZAR": 1 / MKT["USDZAR"]}
 
 # Which counterparties have trading relationships (most FIs + large corporates)
 # Determined by sector + size
@@ -63,18 +65,10 @@ CURRENCY_PAIRS = {
 # Floating indices by currency
 FLOAT_INDEX = {"USD": "SOFR", "GBP": "SONIA", "CNY": "SHIBOR", "BRL": "CDI", "ZAR": "JIBAR"}
 
-_trade_counter = [0]
-
-
-def _next_id():
-    _trade_counter[0] += 1
-    return f"CHB-{_trade_counter[0]:05d}"
-
-
-def _rand_date(yr1, yr2):
+def _rand_date(rng, yr1, yr2):
     s = date(yr1, 1, 1)
     e = date(yr2, 12, 31)
-    return s + timedelta(days=RNG.randint(0, (e - s).days))
+    return s + timedelta(days=rng.randint(0, (e - s).days))
 
 
 def _mat_from_trade(trade_date, tenor_days):
@@ -83,22 +77,32 @@ def _mat_from_trade(trade_date, tenor_days):
 
 # ── MtM approximations ────────────────────────────────────────────────────────
 
-def _irs_mtm(direction, notional_m, fixed_rate, ccy, tenor_y):
+_MKT_CURVES = {}
+
+
+def _mkt_curve(ccy):
+    """End-2025 discount curve from the MKT pillars, built once per currency."""
+    if ccy not in _MKT_CURVES:
+        quotes = {float(k.split("_")[1][:-1]): v for k, v in MKT.items()
+                  if k.startswith(ccy + "_") and k.endswith("Y")}
+        _MKT_CURVES[ccy] = curves.Curve.from_quotes(ccy, MKT_DATE.isoformat(), quotes)
+    return _MKT_CURVES[ccy]
+
+
+def _irs_mtm(direction, notional_m, fixed_rate, ccy, remaining_y):
     """
-    IRS: pay fixed vs float.
-    MtM ≈ (current_rate - fixed_rate) × DV01
-    DV01 (USD per bp per $1M notional) ≈ tenor_y × 100  (very rough)
+    IRS: pay fixed vs float (annual fixed leg, float leg at par).
+    MtM = (par rate − fixed rate) × annuity × notional, off the MKT curve
+    DV01 = annuity × notional / 1e4
     If direction = Pay (we pay fixed): profit when rates rise.
     """
-    key = f"{ccy}_10Y" if tenor_y >= 7 else (f"{ccy}_5Y" if tenor_y >= 3 else f"{ccy}_2Y")
-    curr_rate = MKT.get(key, 4.0)
-    dv01 = tenor_y * 90.0   # USD per bp for $1M notional
-    # P&L in USD M = rate_diff_bps × DV01_full / 1e6
-    # rate_diff_bps = (curr_rate - fixed_rate) * 100;  DV01_full = dv01 * notional_m
-    mtm = (curr_rate - fixed_rate) * dv01 * notional_m / 10000
+    curve = _mkt_curve(ccy)
+    annuity = float(curve.annuity(remaining_y)) if remaining_y > 0 else 0.0
+    par = float(curve.par_rate(remaining_y)) * 100 if remaining_y > 0 else fixed_rate
+    mtm = (par - fixed_rate) / 100 * annuity * notional_m
     if direction == "Receive":
         mtm = -mtm
-    return round(mtm, 3), round(dv01 * notional_m / 1e6, 4)   # MtM USD M, DV01 USD M/bp
+    return round(mtm, 3), round(annuity * notional_m / 1e4, 4)   # MtM USD M, DV01 USD M/bp
 
 
 def _fx_fwd_mtm(direction, notional_m, forward_rate, spot_ccy, quote_ccy):
@@ -138,12 +142,16 @@ def _cds_mtm(direction, notional_m, initial_spread_bps, curr_spread_bps):
     return round(mtm, 3), round(cs01 / 100, 3)
 
 
-def _equity_opt_mtm(direction, notional_m, delta, spot_return_pct):
-    """Equity option: approximate P&L via delta approximation."""
-    pnl = delta * spot_return_pct / 100 * notional_m
-    if direction == "Short":
-        pnl = -pnl
-    return round(pnl, 3)
+def _equity_opt_mtm(direction, notional_m, strike, spot, spot_return_pct, tau0_y, tau_y, is_call):
+    """
+    Equity option: Black–Scholes revaluation (flat vol, r = q = 0) from trade
+    date (spot / (1 + return)) to now, on notional / strike units.
+    Returns (MtM in notional ccy millions, current delta per unit), both signed.
+    """
+    units = notional_m / strike * (1 if direction == "Long" else -1)
+    now = options.price(spot, strike, tau_y, options.DEFAULT_VOL, is_call)
+    then = options.price(spot / (1 + spot_return_pct / 100), strike, tau0_y, options.DEFAULT_VOL, is_call)
+    return round(units * float(now.price - then.price), 3), round(float(now.delta) * (1 if units > 0 else -1), 2)
 
 
 def _bond_mtm(direction, notional_m, purchase_yield, curr_yield, duration_y):
@@ -158,23 +166,22 @@ def _bond_mtm(direction, notional_m, purchase_yield, curr_yield, duration_y):
 
 # ── Trade generators per product ─────────────────────────────────────────────
 
-def _make_irs(cp, n=1):
+def _make_irs(cp, n, rng):
     trades = []
     ccy  = cp["currency"] if cp["currency"] in ("USD","GBP") else "USD"
     for _ in range(n):
-        trade_date = _rand_date(2021, 2024)
-        tenor_y    = RNG.choice([2, 3, 5, 7, 10])
+        trade_date = _rand_date(rng, 2021, 2024)
+        tenor_y    = rng.choice([2, 3, 5, 7, 10])
         mat_date   = _mat_from_trade(trade_date, tenor_y * 365)
-        notional_m = round(RNG.uniform(50, 400), 0)
+        notional_m = round(rng.uniform(50, 400), 0)
         # Fixed rate near prevailing rate at trade date (rough)
         base_rate  = {"2021": 1.2, "2022": 2.8, "2023": 4.5, "2024": 4.2}.get(str(trade_date.year), 2.5)
-        fixed_rate = round(base_rate + RNG.uniform(-0.3, 0.5), 3)
-        direction  = RNG.choice(["Pay", "Receive"])
-        mtm, dv01  = _irs_mtm(direction, notional_m, fixed_rate, ccy, tenor_y)
+        fixed_rate = round(base_rate + rng.uniform(-0.3, 0.5), 3)
+        direction  = rng.choice(["Pay", "Receive"])
+        mtm, dv01  = _irs_mtm(direction, notional_m, fixed_rate, ccy, (mat_date - MKT_DATE).days / 365)
         notional_usd = notional_m * FX_TO_USD.get(ccy, 1)
         live = mat_date > date(2026, 1, 1)
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          "Rates",
             "product":       "IRS",
@@ -187,6 +194,7 @@ def _make_irs(cp, n=1):
             "fixed_rate":    fixed_rate,
             "floating_index":FLOAT_INDEX.get(ccy, "SOFR"),
             "strike":        None,
+            "option_type":   None,
             "delta":         None,
             "mark_to_market": mtm,
             "dv01":          dv01,
@@ -198,41 +206,41 @@ def _make_irs(cp, n=1):
     return trades
 
 
-def _make_fx_fwd(cp, n=1):
+def _make_fx_fwd(cp, n, rng):
     trades = []
     ccy  = cp["currency"]
     # Pair: local vs USD (or GBP vs USD for UK)
     for _ in range(n):
-        trade_date  = _rand_date(2022, 2025)
-        tenor_days  = RNG.randint(30, 360)
+        trade_date  = _rand_date(rng, 2022, 2025)
+        tenor_days  = rng.randint(30, 360)
         mat_date    = _mat_from_trade(trade_date, tenor_days)
-        notional_m  = round(RNG.uniform(10, 150), 0)   # millions
-        direction   = RNG.choice(["Long", "Short"])
+        notional_m  = round(rng.uniform(10, 150), 0)   # millions
+        direction   = rng.choice(["Long", "Short"])
         product     = "NDF" if ccy in ("CNY", "BRL", "ZAR") else "FX Forward"
 
         # Approximate forward rate at trade date
         if ccy == "GBP":
             fwd_key = "GBPUSD"
-            fwd     = round(MKT["GBPUSD"] + RNG.uniform(-0.08, 0.08), 4)
+            fwd     = round(MKT["GBPUSD"] + rng.uniform(-0.08, 0.08), 4)
             quote_ccy = "USD"
         elif ccy == "CNY":
             fwd_key = "USDCNY"
-            fwd     = round(MKT["USDCNY"] + RNG.uniform(-0.30, 0.30), 4)
+            fwd     = round(MKT["USDCNY"] + rng.uniform(-0.30, 0.30), 4)
             quote_ccy = "CNY"
             notional_m = notional_m * MKT["USDCNY"]   # CNY notional
         elif ccy == "BRL":
             fwd_key = "USDBRL"
-            fwd     = round(MKT["USDBRL"] + RNG.uniform(-0.50, 0.50), 4)
+            fwd     = round(MKT["USDBRL"] + rng.uniform(-0.50, 0.50), 4)
             quote_ccy = "BRL"
             notional_m = notional_m * MKT["USDBRL"]
         elif ccy == "ZAR":
             fwd_key = "USDZAR"
-            fwd     = round(MKT["USDZAR"] + RNG.uniform(-1.5, 1.5), 4)
+            fwd     = round(MKT["USDZAR"] + rng.uniform(-1.5, 1.5), 4)
             quote_ccy = "ZAR"
             notional_m = notional_m * MKT["USDZAR"]
         else:
             fwd_key = "GBPUSD"
-            fwd     = round(MKT["GBPUSD"] + RNG.uniform(-0.05, 0.05), 4)
+            fwd     = round(MKT["GBPUSD"] + rng.uniform(-0.05, 0.05), 4)
             quote_ccy = "USD"
 
         mtm = _fx_fwd_mtm(direction, notional_m,
@@ -242,7 +250,6 @@ def _make_fx_fwd(cp, n=1):
         notional_usd = notional_m * FX_TO_USD.get(ccy, 1)
         live = mat_date > date(2026, 1, 1)
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          "FX",
             "product":       product,
@@ -255,6 +262,7 @@ def _make_fx_fwd(cp, n=1):
             "fixed_rate":    round(fwd, 4),
             "floating_index":None,
             "strike":        None,
+            "option_type":   None,
             "delta":         None,
             "mark_to_market": mtm,
             "dv01":          None,
@@ -266,21 +274,20 @@ def _make_fx_fwd(cp, n=1):
     return trades
 
 
-def _make_cds(cp, n=1):
+def _make_cds(cp, n, rng):
     trades = []
     for _ in range(n):
-        trade_date  = _rand_date(2021, 2024)
-        tenor_y     = RNG.choice([3, 5])
+        trade_date  = _rand_date(rng, 2021, 2024)
+        tenor_y     = rng.choice([3, 5])
         mat_date    = _mat_from_trade(trade_date, tenor_y * 365)
-        notional_m  = round(RNG.uniform(10, 100), 0)
-        direction   = RNG.choice(["Buy", "Sell"])
+        notional_m  = round(rng.uniform(10, 100), 0)
+        direction   = rng.choice(["Buy", "Sell"])
         rating      = cp["internal_rating"]
-        init_spread = SPREAD_BY_RATING.get(rating, 200) + RNG.uniform(-20, 20)
-        curr_spread = SPREAD_BY_RATING.get(rating, 200) + RNG.uniform(-30, 30)
+        init_spread = SPREAD_BY_RATING.get(rating, 200) + rng.uniform(-20, 20)
+        curr_spread = SPREAD_BY_RATING.get(rating, 200) + rng.uniform(-30, 30)
         mtm, cs01   = _cds_mtm(direction, notional_m, init_spread, curr_spread)
         live = mat_date > date(2026, 1, 1)
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          "Credit",
             "product":       "CDS",
@@ -293,6 +300,7 @@ def _make_cds(cp, n=1):
             "fixed_rate":    round(init_spread, 1),
             "floating_index":None,
             "strike":        None,
+            "option_type":   None,
             "delta":         None,
             "mark_to_market": mtm,
             "dv01":          None,
@@ -304,25 +312,24 @@ def _make_cds(cp, n=1):
     return trades
 
 
-def _make_bond(cp, n=1):
+def _make_bond(cp, n, rng):
     trades = []
     ccy  = cp["currency"] if cp["currency"] in ("USD","GBP") else "USD"
     for _ in range(n):
-        is_gov = RNG.random() < 0.4
+        is_gov = rng.random() < 0.4
         desk   = "Fixed Income"
         product= "Government Bond" if is_gov else "Corporate Bond"
-        trade_date = _rand_date(2020, 2024)
-        mat_date   = _mat_from_trade(trade_date, RNG.randint(3*365, 10*365))
-        notional_m = round(RNG.uniform(10, 200), 0)
-        direction  = RNG.choice(["Long", "Short"])
-        purch_yld  = MKT[f"{ccy}_10Y"] + RNG.uniform(-1.5, 1.5) if not is_gov else MKT.get(f"{ccy}_10Y", 4.0) + RNG.uniform(-0.5, 0.5)
+        trade_date = _rand_date(rng, 2020, 2024)
+        mat_date   = _mat_from_trade(trade_date, rng.randint(3*365, 10*365))
+        notional_m = round(rng.uniform(10, 200), 0)
+        direction  = rng.choice(["Long", "Short"])
+        purch_yld  = MKT[f"{ccy}_10Y"] + rng.uniform(-1.5, 1.5) if not is_gov else MKT.get(f"{ccy}_10Y", 4.0) + rng.uniform(-0.5, 0.5)
         curr_yld   = MKT.get(f"{ccy}_10Y", 4.0)
-        duration_y = RNG.uniform(3.0, 8.5)
+        duration_y = rng.uniform(3.0, 8.5)
         mtm, dv01  = _bond_mtm(direction, notional_m, purch_yld, curr_yld, duration_y)
         notional_usd = notional_m * FX_TO_USD.get(ccy, 1)
         live = mat_date > date(2026, 1, 1)
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          desk,
             "product":       product,
@@ -335,6 +342,7 @@ def _make_bond(cp, n=1):
             "fixed_rate":    round(purch_yld, 3),
             "floating_index":None,
             "strike":        None,
+            "option_type":   None,
             "delta":         None,
             "mark_to_market": mtm,
             "dv01":          dv01,
@@ -346,25 +354,27 @@ def _make_bond(cp, n=1):
     return trades
 
 
-def _make_eq_option(cp, n=1):
+def _make_eq_option(cp, n, rng):
     trades = []
     ccy = cp["currency"] if cp["currency"] in ("USD","GBP","CNY") else "USD"
     eq_idx = {"USD":"US_SPX","GBP":"UK_FTSE","CNY":"CN_CSI"}.get(ccy,"US_SPX")
     for _ in range(n):
-        trade_date  = _rand_date(2022, 2025)
-        tenor_d     = RNG.randint(30, 365)
+        trade_date  = _rand_date(rng, 2022, 2025)
+        tenor_d     = rng.randint(30, 365)
         mat_date    = _mat_from_trade(trade_date, tenor_d)
-        notional_m  = round(RNG.uniform(5, 60), 0)
-        direction   = RNG.choice(["Long", "Short"])
-        delta       = round(RNG.uniform(0.20, 0.80), 2) * (1 if direction=="Long" else -1)
+        notional_m  = round(rng.uniform(5, 60), 0)
+        direction   = rng.choice(["Long", "Short"])
         # Spot return from trade date to now (approx)
-        spot_ret    = RNG.uniform(-15, 25)   # %
-        mtm         = _equity_opt_mtm(direction, notional_m, delta, spot_ret)
+        spot_ret    = rng.uniform(-15, 25)   # %
+        opt_type    = rng.choice(["Call", "Put"])
+        strike      = round(MKT.get(eq_idx, 5000) * rng.uniform(0.90, 1.10), 1)
+        tau_y       = max((mat_date - MKT_DATE).days, 0) / 365
+        mtm_local, delta = _equity_opt_mtm(direction, notional_m, strike, MKT.get(eq_idx, 5000),
+                                           spot_ret, tenor_d / 365, tau_y, opt_type == "Call")
+        mtm          = round(mtm_local * FX_TO_USD.get(ccy, 1), 3)
         notional_usd = notional_m * FX_TO_USD.get(ccy, 1)
         live = mat_date > date(2026, 1, 1)
-        opt_type    = RNG.choice(["Call", "Put"])
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          "Equity Derivatives",
             "product":       "Equity Option",
@@ -376,7 +386,8 @@ def _make_eq_option(cp, n=1):
             "maturity_date": mat_date.isoformat(),
             "fixed_rate":    None,
             "floating_index":eq_idx,
-            "strike":        round(MKT.get(eq_idx, 5000) * RNG.uniform(0.90, 1.10), 1),
+            "strike":        strike,
+            "option_type":   opt_type,
             "delta":         delta,
             "mark_to_market": mtm,
             "dv01":          None,
@@ -388,25 +399,24 @@ def _make_eq_option(cp, n=1):
     return trades
 
 
-def _make_commodity_fwd(cp, n=1):
+def _make_commodity_fwd(cp, n, rng):
     trades = []
     commodities = [("Oil", 75.0, 12.0), ("Gold", 2050.0, 180.0), ("Natural Gas", 3.5, 0.8)]
     for _ in range(n):
-        comm, base_price, vol = RNG.choice(commodities)
-        trade_date  = _rand_date(2022, 2025)
-        tenor_d     = RNG.randint(30, 365)
+        comm, base_price, vol = rng.choice(commodities)
+        trade_date  = _rand_date(rng, 2022, 2025)
+        tenor_d     = rng.randint(30, 365)
         mat_date    = _mat_from_trade(trade_date, tenor_d)
-        notional_m  = round(RNG.uniform(5, 80), 0)
-        direction   = RNG.choice(["Long", "Short"])
-        fwd_price   = round(base_price + RNG.uniform(-vol, vol), 2)
-        curr_price  = round(base_price + RNG.uniform(-vol, vol), 2)
+        notional_m  = round(rng.uniform(5, 80), 0)
+        direction   = rng.choice(["Long", "Short"])
+        fwd_price   = round(base_price + rng.uniform(-vol, vol), 2)
+        curr_price  = round(base_price + rng.uniform(-vol, vol), 2)
         mtm = (curr_price - fwd_price) / fwd_price * notional_m
         if direction == "Short":
             mtm = -mtm
         mtm = round(mtm, 3)
         live = mat_date > date(2026, 1, 1)
         trades.append({
-            "trade_id":      _next_id(),
             "counterparty_id": cp["id"],
             "desk":          "Commodities",
             "product":       "Commodity Forward",
@@ -419,6 +429,7 @@ def _make_commodity_fwd(cp, n=1):
             "fixed_rate":    fwd_price,
             "floating_index":comm,
             "strike":        None,
+            "option_type":   None,
             "delta":         None,
             "mark_to_market": mtm,
             "dv01":          None,
@@ -442,46 +453,57 @@ def _should_trade(raw):
     return raw["country_iso2"] in ("BR", "ZA", "CN")
 
 
+def _trades_for_cp(cp):
+    """All trades for one counterparty, drawn from its own stream."""
+    raw = RAW[cp["id"] - 1]
+    if not _should_trade(raw):
+        return []
+    rng    = stream("trades", cp["id"])
+    trades = []
+
+    ccy    = cp["currency"]
+    is_fi  = cp["is_financial_institution"]
+    sector = cp["sector"]
+
+    # IRS: rates-active counterparties
+    if is_fi or sector in ("Financial", "Energy", "Real Estate"):
+        n_irs = rng.randint(2, 5)
+        trades.extend(_make_irs(cp, n_irs, rng))
+
+    # FX forwards: nearly all (hedging)
+    n_fx = rng.randint(1, 4)
+    trades.extend(_make_fx_fwd(cp, n_fx, rng))
+
+    # CDS: FIs and credit desk clients
+    if is_fi or sector in ("Financial", "Energy", "TMT"):
+        n_cds = rng.randint(1, 3)
+        trades.extend(_make_cds(cp, n_cds, rng))
+
+    # Bonds: FIs, TMT, Healthcare, Industrials
+    if is_fi or sector in ("Financial", "TMT", "Healthcare", "Industrials", "Consumer"):
+        n_bond = rng.randint(1, 4)
+        trades.extend(_make_bond(cp, n_bond, rng))
+
+    # Equity options: FIs and large US/UK names
+    if (is_fi or sector in ("Financial","TMT","Healthcare")) and ccy in ("USD","GBP","CNY"):
+        n_eq = rng.randint(1, 3)
+        trades.extend(_make_eq_option(cp, n_eq, rng))
+
+    # Commodity forwards: Energy, Mining, Consumer (hedging)
+    if sector in ("Energy", "Mining", "Consumer", "Industrials"):
+        n_comm = rng.randint(1, 2)
+        trades.extend(_make_commodity_fwd(cp, n_comm, rng))
+
+    return trades
+
+
 def generate_trades(cp_rows):
     all_trades = []
-    for cp in cp_rows:
-        raw = RAW[cp["id"] - 1]
-        if not _should_trade(raw):
-            continue
-
-        ccy    = cp["currency"]
-        is_fi  = cp["is_financial_institution"]
-        sector = cp["sector"]
-
-        # IRS: rates-active counterparties
-        if is_fi or sector in ("Financial", "Energy", "Real Estate"):
-            n_irs = RNG.randint(2, 5)
-            all_trades.extend(_make_irs(cp, n_irs))
-
-        # FX forwards: nearly all (hedging)
-        n_fx = RNG.randint(1, 4)
-        all_trades.extend(_make_fx_fwd(cp, n_fx))
-
-        # CDS: FIs and credit desk clients
-        if is_fi or sector in ("Financial", "Energy", "TMT"):
-            n_cds = RNG.randint(1, 3)
-            all_trades.extend(_make_cds(cp, n_cds))
-
-        # Bonds: FIs, TMT, Healthcare, Industrials
-        if is_fi or sector in ("Financial", "TMT", "Healthcare", "Industrials", "Consumer"):
-            n_bond = RNG.randint(1, 4)
-            all_trades.extend(_make_bond(cp, n_bond))
-
-        # Equity options: FIs and large US/UK names
-        if (is_fi or sector in ("Financial","TMT","Healthcare")) and ccy in ("USD","GBP","CNY"):
-            n_eq = RNG.randint(1, 3)
-            all_trades.extend(_make_eq_option(cp, n_eq))
-
-        # Commodity forwards: Energy, Mining, Consumer (hedging)
-        if sector in ("Energy", "Mining", "Consumer", "Industrials"):
-            n_comm = RNG.randint(1, 2)
-            all_trades.extend(_make_commodity_fwd(cp, n_comm))
-
+    for trades in shard_map(_trades_for_cp, cp_rows):
+        all_trades.extend(trades)
+    # Ids are assigned after the merge so they follow counterparty order
+    for i, t in enumerate(all_trades, start=1):
+        t["trade_id"] = f"CHB-{i:05d}"
     return all_trades
 
 
@@ -491,12 +513,12 @@ def insert_trades(conn, cp_rows):
         INSERT OR IGNORE INTO trades
         (trade_id, counterparty_id, desk, product, direction, currency,
          notional, notional_usd, trade_date, maturity_date,
-         fixed_rate, floating_index, strike, delta,
+         fixed_rate, floating_index, strike, option_type, delta,
          mark_to_market, dv01, cs01, status, ai_summary, risk_tags)
         VALUES
         (:trade_id,:counterparty_id,:desk,:product,:direction,:currency,
          :notional,:notional_usd,:trade_date,:maturity_date,
-         :fixed_rate,:floating_index,:strike,:delta,
+         :fixed_rate,:floating_index,:strike,:option_type,:delta,
          :mark_to_market,:dv01,:cs01,:status,:ai_summary,:risk_tags)
     """, trades)
 
@@ -5,28 +5,48 @@ Run: uvicorn main:app --reload --port 3003
 """
 import os
 import json
-from contextlib import asynccontextmanager
+import asyncio
+import queue
+from datetime import date
+from contextlib import asynccontextmanager, suppress
 
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-
-from db import get_db, init_db, DB_PATH
-from generators.seed_all import seed
+from starlette.concurrency import run_in_threadpool
+
+from db import get_db, current, live_write, BuildInProgress, DB_PATH
+from services.downsample import downsample_rows, MODES as DOWNSAMPLE_MODES
+from services.fastjson import FastJSONResponse, rows_json
+from services import sql_profiler
+from services.snapshots import snapshot_for, registry_summary
+from services import stress
+from services import pnl_explain
+from services import backtest
+from services import expected_shortfall
+from services import search
+from services import similarity
+from services import covenants
+from services import exposure
+from services import pfe
+from services import options
+from services import curves
+from services import cashflows
+from services import importer
+from services import startup
+from services import kpi_stream
 
 
 # ── Lifespan ──────────────────────────────────────────────────────────────────
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db()
-    if not os.path.exists(DB_PATH) or os.path.getsize(DB_PATH) < 10_000:
-        print("Database empty — running seed …")
-        seed()
+    # Recovery, seeding and cache warm-up run in the background (services/startup.py)
+    startup.start()
     yield
 
 
@@ -37,8 +57,21 @@ app = FastAPI(
     description="Synthetic investment bank risk data API",
     version="0.2.0",
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
+# Per-request SQL timing → Server-Timing header + /debug/sql
+app.add_middleware(sql_profiler.SQLProfilerMiddleware)
+
+# "Warming up" responses until the background startup has the data ready
+app.add_middleware(startup.WarmupMiddleware)
+
+@app.exception_handler(BuildInProgress)
+async def build_in_progress(request: Request, exc: BuildInProgress):
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(startup.RETRY_AFTER_SECONDS)})
+
+
 # Static files (optional — create the directory if you want to serve assets)
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(static_dir, exist_ok=True)
@@ -94,6 +127,29 @@ def _one(conn, sql, params=()):
     return rows[0] if rows else None
 
 
+def _json(conn, sql, params=()):
+    """Rows serialised to JSON bytes inside SQLite; closes the connection."""
+    body = rows_json(conn, sql, params)
+    conn.close()
+    return FastJSONResponse(body)
+
+
+def _as_of(as_of):
+    """Validate an as_of query value (YYYY-MM-DD); None means latest."""
+    if as_of is None:
+        return None
+    try:
+        return date.fromisoformat(as_of).isoformat()
+    except ValueError:
+        raise HTTPException(400, "as_of must be an ISO date (YYYY-MM-DD)")
+
+
+def _downsample(key, rows, x_key, y_key, points, mode="lttb"):
+    if mode not in DOWNSAMPLE_MODES:
+        raise HTTPException(400, f"mode must be one of {', '.join(DOWNSAMPLE_MODES)}")
+    return downsample_rows(key, rows, x_key, y_key, points, mode)
+
+
 # ── HTML pages ────────────────────────────────────────────────────────────────
 
 @app.get("/", include_in_schema=False)
@@ -113,28 +169,25 @@ def dashboard(request: Request):
         "SELECT COALESCE(SUM(expected_loss),0) FROM credit_facilities WHERE status='Active'"
     ).fetchone()[0]
     total_drawn = conn.execute("""
-        SELECT COALESCE(SUM(f.drawn_amount * CASE c.currency
-            WHEN 'USD' THEN 1.0 WHEN 'GBP' THEN 1.27
-            WHEN 'CNY' THEN 0.140 WHEN 'BRL' THEN 0.196 WHEN 'ZAR' THEN 0.054
-            ELSE 1.0 END), 0)
-        FROM credit_facilities f JOIN counterparties c ON c.id = f.counterparty_id
-        WHERE f.status='Active'
+        SELECT COALESCE(SUM(to_usd(drawn_amount, currency, NULL)), 0)
+        FROM credit_facilities WHERE status='Active'
     """).fetchone()[0]
     active_fac = conn.execute("SELECT COUNT(*) FROM credit_facilities WHERE status='Active'").fetchone()[0]
     live_trades = conn.execute("SELECT COUNT(*) FROM trades WHERE status='Live'").fetchone()[0]
     cp_count = conn.execute("SELECT COUNT(*) FROM counterparties").fetchone()[0]
+    latest_var_date = snapshot_for(conn, "var_history")
     market_var = conn.execute(
-        "SELECT var_1d_99 FROM var_history WHERE desk IS NULL ORDER BY snapshot_date DESC LIMIT 1"
+        "SELECT var_1d_99 FROM var_history WHERE desk IS NULL AND snapshot_date=?", (latest_var_date,)
     ).fetchone()
     market_var = market_var[0] if market_var else 0
-    total_cva = conn.execute("""
-        SELECT COALESCE(SUM(cva_usd),0) FROM cva_history
-        WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM cva_history)
-    """).fetchone()[0]
-    saccr_rwa = conn.execute("""
-        SELECT COALESCE(SUM(rwa_usd),0) FROM sa_ccr
-        WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM sa_ccr)
-    """).fetchone()[0]
+    total_cva = conn.execute(
+        "SELECT COALESCE(SUM(cva_usd),0) FROM cva_history WHERE snapshot_date=?",
+        (snapshot_for(conn, "cva_history"),)
+    ).fetchone()[0]
+    saccr_rwa = conn.execute(
+        "SELECT COALESCE(SUM(rwa_usd),0) FROM sa_ccr WHERE snapshot_date=?",
+        (snapshot_for(conn, "sa_ccr"),)
+    ).fetchone()[0]
 
     s = {
         "credit_rwa_usd_bn":          round(credit_rwa, 2),
@@ -163,7 +216,6 @@ def dashboard(request: Request):
     """)
 
     # VaR by desk (chart)
-    latest_var_date = conn.execute("SELECT MAX(snapshot_date) FROM var_history").fetchone()[0]
     desk_var = _rows(conn, """
         SELECT desk, var_1d_99 FROM var_history
         WHERE snapshot_date=? AND desk IS NOT NULL ORDER BY var_1d_99 DESC
@@ -269,7 +321,7 @@ def credit_page(request: Request):
 def market_page(request: Request):
     conn = get_db()
 
-    latest_date = conn.execute("SELECT MAX(snapshot_date) FROM var_history").fetchone()[0]
+    latest_date = snapshot_for(conn, "var_history")
 
     pv = _one(conn, "SELECT * FROM var_history WHERE desk IS NULL AND snapshot_date=?", (latest_date,))
     portfolio_var = {
@@ -310,14 +362,15 @@ def market_page(request: Request):
                SUM(credit_pnl) AS credit, SUM(equity_pnl) AS equity,
                SUM(theta_pnl) AS theta, SUM(other_pnl) AS other
         FROM pnl_attribution
-        WHERE pnl_date >= (SELECT DATE(MAX(pnl_date),'-12 months') FROM pnl_attribution)
-    """)
+        WHERE pnl_date >= DATE(?, '-12 months')
+    """, (snapshot_for(conn, "pnl_attribution"),))
     factor_data = {
         "labels": ["Rates", "FX", "Credit", "Equity", "Theta", "Other"],
         "values": [round((fa or {}).get(k) or 0, 1) for k in ["rates","fx","credit","equity","theta","other"]],
     }
 
-    positions = _rows(conn, "SELECT * FROM positions ORDER BY desk, net_notional_usd DESC")
+    positions = _rows(conn, "SELECT * FROM positions WHERE snapshot_date=? ORDER BY desk, net_notional_usd DESC",
+                      (snapshot_for(conn, "positions"),))
     trades    = _rows(conn, """
         SELECT t.*, c.name AS counterparty_name
         FROM trades t JOIN counterparties c ON c.id=t.counterparty_id
@@ -346,10 +399,10 @@ def market_page(request: Request):
 def counterparty_page(request: Request):
     conn = get_db()
 
-    latest_cva = conn.execute("SELECT MAX(snapshot_date) FROM cva_history").fetchone()[0]
-    latest_sa  = "2025-12-31"
-    latest_pfe = "2025-12-31"
-    latest_me  = conn.execute("SELECT MAX(snapshot_date) FROM mtm_exposure").fetchone()[0]
+    latest_cva = snapshot_for(conn, "cva_history")
+    latest_sa  = snapshot_for(conn, "sa_ccr")
+    latest_pfe = snapshot_for(conn, "pfe_profiles")
+    latest_me  = snapshot_for(conn, "mtm_exposure")
 
     totals = {
         "total_cva":    round(conn.execute("SELECT COALESCE(SUM(cva_usd),0) FROM cva_history WHERE snapshot_date=?", (latest_cva,)).fetchone()[0], 2),
@@ -378,8 +431,10 @@ def counterparty_page(request: Request):
     ccr_rows = _rows(conn, """
         SELECT c.id, c.name, c.internal_rating, c.country_iso2,
                cv.cva_usd, cv.dva_usd,
-               me.gross_positive_mtm_usd, me.net_mtm_usd,
-               me.collateral_held_usd, me.current_exposure_usd,
+               COALESCE(me.gross_positive_mtm_usd, 0) AS gross_positive_mtm_usd,
+               COALESCE(me.net_mtm_usd, 0)             AS net_mtm_usd,
+               COALESCE(me.collateral_held_usd, 0)     AS collateral_held_usd,
+               COALESCE(me.current_exposure_usd, 0)    AS current_exposure_usd,
                sa.ead_usd, sa.rwa_usd, pf.pfe_peak,
                ns.agreement_type, ns.csa_in_place
         FROM counterparties c
@@ -415,9 +470,9 @@ def country_page(request: Request):
     # Exposure aggregation by country+type
     exposures = _rows(conn, """
         SELECT country_iso2, exposure_type, SUM(gross_exposure_usd) AS total
-        FROM country_exposures WHERE snapshot_date='2025-12-31'
+        FROM country_exposures WHERE snapshot_date=?
         GROUP BY country_iso2, exposure_type
-    """)
+    """, (snapshot_for(conn, "country_exposures"),))
     exp_map: dict = {}
     for e in exposures:
         c = e["country_iso2"]
@@ -445,9 +500,9 @@ def country_page(request: Request):
         SELECT tr.*, cl.country_name
         FROM transfer_risk tr
         JOIN country_limits cl ON cl.country_iso2=tr.country_iso2
-        WHERE tr.snapshot_date=(SELECT MAX(snapshot_date) FROM transfer_risk)
+        WHERE tr.snapshot_date=?
         ORDER BY tr.transfer_risk_score DESC
-    """)
+    """, (snapshot_for(conn, "transfer_risk"),))
 
     # Counterparty exposure table
     cp_exposures = _rows(conn, """
@@ -524,7 +579,7 @@ def scenarios_page(request: Request):
 
 
 @app.get("/counterparty/{cp_id}", include_in_schema=False)
-def counterparty_detail(request: Request, cp_id: int):
+def counterparty_detail(request: Request, cp_id: int, points: int = Query(None, ge=3)):
     conn = get_db()
 
     cp = _one(conn, """
@@ -583,8 +638,8 @@ def counterparty_detail(request: Request, cp_id: int):
 
     # PFE profile
     pfe_row = _one(conn,
-        "SELECT * FROM pfe_profiles WHERE counterparty_id=? AND snapshot_date='2025-12-31'",
-        (cp_id,))
+        "SELECT * FROM pfe_profiles WHERE counterparty_id=? AND snapshot_date=?",
+        (cp_id, snapshot_for(conn, "pfe_profiles")))
     pfe_profile = pfe_row
     pfe_values = []
     if pfe_row:
@@ -597,6 +652,7 @@ def counterparty_detail(request: Request, cp_id: int):
     pd_hist = _rows(conn,
         "SELECT snapshot_date, pd_1y FROM pd_history WHERE counterparty_id=? ORDER BY snapshot_date",
         (cp_id,))
+    pd_hist = _downsample(("pd_history", cp_id), pd_hist, "snapshot_date", "pd_1y", points)
 
     # Chart data
     fin_years   = [f["fiscal_year"] for f in financials]
@@ -632,7 +688,8 @@ def counterparty_detail(request: Request, cp_id: int):
 # ── JSON API ──────────────────────────────────────────────────────────────────
 
 @app.get("/api/summary")
-def get_summary():
+def get_summary(as_of: str = Query(None)):
+    as_of = _as_of(as_of)
     conn = get_db()
     credit_rwa = conn.execute(
         "SELECT COALESCE(SUM(rwa),0) FROM credit_facilities WHERE status='Active'"
@@ -641,32 +698,28 @@ def get_summary():
         "SELECT COALESCE(SUM(expected_loss),0) FROM credit_facilities WHERE status='Active'"
     ).fetchone()[0]
     total_drawn_usd = conn.execute("""
-        SELECT COALESCE(SUM(f.drawn_amount * CASE c.currency
-            WHEN 'USD' THEN 1.0 WHEN 'GBP' THEN 1.27
-            WHEN 'CNY' THEN 0.140 WHEN 'BRL' THEN 0.196 WHEN 'ZAR' THEN 0.054
-            ELSE 1.0 END), 0)
-        FROM credit_facilities f
-        JOIN counterparties c ON c.id = f.counterparty_id
-        WHERE f.status = 'Active'
-    """).fetchone()[0]
-    market_var = conn.execute("""
-        SELECT var_1d_99 FROM var_history WHERE desk IS NULL
-        ORDER BY snapshot_date DESC LIMIT 1
-    """).fetchone()
+        SELECT COALESCE(SUM(to_usd(drawn_amount, currency, ?)), 0)
+        FROM credit_facilities WHERE status = 'Active'
+    """, (as_of,)).fetchone()[0]
+    market_var = conn.execute(
+        "SELECT var_1d_99 FROM var_history WHERE desk IS NULL AND snapshot_date=?",
+        (snapshot_for(conn, "var_history", as_of),)
+    ).fetchone()
     market_var = market_var[0] if market_var else 0
-    total_cva = conn.execute("""
-        SELECT COALESCE(SUM(cva_usd),0) FROM cva_history
-        WHERE snapshot_date = (SELECT MAX(snapshot_date) FROM cva_history)
-    """).fetchone()[0]
-    saccr_rwa = conn.execute("""
-        SELECT COALESCE(SUM(rwa_usd),0) FROM sa_ccr
-        WHERE snapshot_date = (SELECT MAX(snapshot_date) FROM sa_ccr)
-    """).fetchone()[0]
+    total_cva = conn.execute(
+        "SELECT COALESCE(SUM(cva_usd),0) FROM cva_history WHERE snapshot_date=?",
+        (snapshot_for(conn, "cva_history", as_of),)
+    ).fetchone()[0]
+    saccr_rwa = conn.execute(
+        "SELECT COALESCE(SUM(rwa_usd),0) FROM sa_ccr WHERE snapshot_date=?",
+        (snapshot_for(conn, "sa_ccr", as_of),)
+    ).fetchone()[0]
     fac_count  = conn.execute("SELECT COUNT(*) FROM credit_facilities WHERE status='Active'").fetchone()[0]
     trade_count = conn.execute("SELECT COUNT(*) FROM trades WHERE status='Live'").fetchone()[0]
     cp_count   = conn.execute("SELECT COUNT(*) FROM counterparties").fetchone()[0]
     conn.close()
     return {
+        "as_of":                      as_of,
         "counterparty_count":         cp_count,
         "active_facilities":          fac_count,
         "live_trades":                trade_count,
@@ -679,6 +732,29 @@ def get_summary():
     }
 
 
+@app.get("/api/stream/kpis")
+async def stream_kpis(request: Request):
+    return StreamingResponse(kpi_stream.events(request), media_type="text/event-stream",
+                             headers=kpi_stream.SSE_HEADERS)
+
+
+@app.get("/api/search")
+def get_search(
+    q:      str = Query(..., min_length=1),
+    kind:   str = Query(None),
+    limit:  int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+):
+    if kind and kind not in search.KINDS:
+        raise HTTPException(400, f"kind must be one of {', '.join(search.KINDS)}")
+    conn = get_db()
+    hits = search.search(conn, q, kind, limit, offset)
+    conn.close()
+    for h in hits:
+        h["risk_tags"] = json.loads(h.pop("tags") or "[]")
+    return {"q": q, "match": search.match_expression(q), "results": hits}
+
+
 @app.get("/api/counterparties")
 def get_counterparties(
     country: str = Query(None),
@@ -692,16 +768,12 @@ def get_counterparties(
     if sector:  sql += " AND sector = ?";        params.append(sector)
     if rating:  sql += " AND internal_rating = ?"; params.append(rating)
     sql += " ORDER BY country_iso2, name"
-    rows = _rows(conn, sql, params)
-    for r in rows:
-        r["risk_tags"]   = json.loads(r.get("risk_tags") or "[]")
-        r["alert_flags"] = json.loads(r.get("alert_flags") or "[]")
-    conn.close()
-    return rows
+    return _json(conn, sql, params)
 
 
 @app.get("/api/counterparties/{cp_id}")
-def get_counterparty(cp_id: int):
+def get_counterparty(cp_id: int, as_of: str = Query(None)):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
     rows = _rows(conn, "SELECT * FROM counterparties WHERE id=?", (cp_id,))
     if not rows:
@@ -713,27 +785,45 @@ def get_counterparty(cp_id: int):
     cp["rating_history"] = _rows(conn, "SELECT * FROM credit_ratings WHERE counterparty_id=? ORDER BY rating_date", (cp_id,))
     cp["facilities"]  = _rows(conn, "SELECT * FROM credit_facilities WHERE counterparty_id=?", (cp_id,))
     cp["trades"]      = _rows(conn, "SELECT * FROM trades WHERE counterparty_id=? AND status='Live'", (cp_id,))
-    cp["pd_history"]  = _rows(conn, "SELECT * FROM pd_history WHERE counterparty_id=? ORDER BY snapshot_date DESC LIMIT 12", (cp_id,))
-    cva = _rows(conn, "SELECT * FROM cva_history WHERE counterparty_id=? ORDER BY snapshot_date DESC LIMIT 1", (cp_id,))
+    cp["pd_history"]  = _rows(conn, "SELECT * FROM pd_history WHERE counterparty_id=? AND snapshot_date<=? ORDER BY snapshot_date DESC LIMIT 12", (cp_id, as_of))
+    cva = _rows(conn, "SELECT * FROM cva_history WHERE counterparty_id=? AND snapshot_date<=? ORDER BY snapshot_date DESC LIMIT 1", (cp_id, as_of))
     cp["latest_cva"]  = cva[0] if cva else None
-    pfe = _rows(conn, "SELECT * FROM pfe_profiles WHERE counterparty_id=? ORDER BY snapshot_date DESC LIMIT 1", (cp_id,))
+    pfe = _rows(conn, "SELECT * FROM pfe_profiles WHERE counterparty_id=? AND snapshot_date<=? ORDER BY snapshot_date DESC LIMIT 1", (cp_id, as_of))
     cp["pfe_profile"] = pfe[0] if pfe else None
     conn.close()
     return cp
 
 
+@app.get("/api/counterparties/{cp_id}/similar")
+def get_similar_counterparties(
+    cp_id: int,
+    k:     int  = Query(10, ge=1, le=100),
+    exact: bool = Query(False),
+):
+    conn = get_db()
+    hits = similarity.similar(conn, current(), cp_id, k, exact=exact)
+    if hits is None:
+        conn.close()
+        raise HTTPException(404, "Counterparty not found")
+    ph = ",".join("?" * len(hits))
+    info = {r["id"]: r for r in _rows(conn, f"""
+        SELECT id, name, country_iso2, sector, sub_sector, internal_rating, rating_outlook
+        FROM counterparties WHERE id IN ({ph})
+    """, [i for i, _ in hits])}
+    conn.close()
+    return [{**info[i], "similarity": round(sim, 4)} for i, sim in hits if i in info]
+
+
 @app.get("/api/credit/facilities")
 def get_facilities(status: str = Query("Active")):
     conn = get_db()
-    rows = _rows(conn, """
+    return _json(conn, """
         SELECT f.*, c.name AS counterparty_name, c.country_iso2,
                c.internal_rating, c.sector
         FROM credit_facilities f
         JOIN counterparties c ON c.id = f.counterparty_id
         WHERE f.status = ? ORDER BY f.ead DESC
     """, (status,))
-    conn.close()
-    return rows
 
 
 @app.get("/api/credit/portfolio")
@@ -765,100 +855,235 @@ def get_credit_portfolio():
 
 
 @app.get("/api/credit/events")
-def get_credit_events():
+def get_credit_events(as_of: str = Query(None)):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
-    rows = _rows(conn, """
+    return _json(conn, """
         SELECT e.*, c.name AS counterparty_name, c.internal_rating
         FROM credit_events e JOIN counterparties c ON c.id = e.counterparty_id
+        WHERE e.event_date <= ?
         ORDER BY e.event_date DESC
-    """)
+    """, (as_of,))
+
+
+@app.get("/api/credit/covenants")
+def get_covenant_tests(status: str = Query(None), as_of: str = Query(None)):
+    if status and status not in ("Pass", "Watch", "Breach"):
+        raise HTTPException(400, "status must be one of Pass, Watch, Breach")
+    conn = get_db()
+    rows = covenants.latest_tests(conn, status, _as_of(as_of))
     conn.close()
     return rows
 
 
 @app.get("/api/market/var")
-def get_var_history(desk: str = Query(None), months: int = Query(12)):
+def get_var_history(
+    desk:   str = Query(None),
+    months: int = Query(12),
+    points: int = Query(None, ge=3),
+    mode:   str = Query("lttb"),
+    as_of:  str = Query(None),
+):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
     if desk:
-        rows = _rows(conn, "SELECT * FROM var_history WHERE desk=? ORDER BY snapshot_date DESC LIMIT ?", (desk, months))
+        rows = _rows(conn, "SELECT * FROM var_history WHERE desk=? AND snapshot_date<=? ORDER BY snapshot_date DESC LIMIT ?", (desk, as_of, months))
     else:
-        rows = _rows(conn, "SELECT * FROM var_history WHERE desk IS NULL ORDER BY snapshot_date DESC LIMIT ?", (months,))
+        rows = _rows(conn, "SELECT * FROM var_history WHERE desk IS NULL AND snapshot_date<=? ORDER BY snapshot_date DESC LIMIT ?", (as_of, months))
     conn.close()
-    return rows
+    if points:
+        rows = _downsample(("var_history", desk, months), rows[::-1],
+                           "snapshot_date", "var_1d_99", points, mode)[::-1]
+    return FastJSONResponse(rows)
 
 
 @app.get("/api/market/var/latest")
-def get_var_latest():
+def get_var_latest(as_of: str = Query(None)):
     conn = get_db()
-    rows = _rows(conn, """
-        SELECT * FROM var_history
-        WHERE snapshot_date = (SELECT MAX(snapshot_date) FROM var_history)
+    return _json(conn, """
+        SELECT * FROM var_history WHERE snapshot_date=?
         ORDER BY COALESCE(desk,'ZZZZ')
-    """)
-    conn.close()
-    return rows
+    """, (snapshot_for(conn, "var_history", _as_of(as_of)),))
 
 
 @app.get("/api/market/pnl")
-def get_pnl(desk: str = Query(None), months: int = Query(12)):
+def get_pnl(desk: str = Query(None), months: int = Query(12), as_of: str = Query(None)):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
     if desk:
-        rows = _rows(conn, "SELECT * FROM pnl_attribution WHERE desk=? ORDER BY pnl_date DESC LIMIT ?", (desk, months))
-    else:
-        rows = _rows(conn, """
-            SELECT pnl_date, SUM(daily_pnl) AS daily_pnl,
-                   SUM(rates_pnl) AS rates_pnl, SUM(fx_pnl) AS fx_pnl,
-                   SUM(credit_pnl) AS credit_pnl, SUM(equity_pnl) AS equity_pnl,
-                   SUM(theta_pnl) AS theta_pnl, SUM(other_pnl) AS other_pnl
-            FROM pnl_attribution GROUP BY pnl_date ORDER BY pnl_date DESC LIMIT ?
-        """, (months,))
+        return _json(conn, "SELECT * FROM pnl_attribution WHERE desk=? AND pnl_date<=? ORDER BY pnl_date DESC LIMIT ?", (desk, as_of, months))
+    return _json(conn, """
+        SELECT pnl_date, SUM(daily_pnl) AS daily_pnl,
+               SUM(rates_pnl) AS rates_pnl, SUM(fx_pnl) AS fx_pnl,
+               SUM(credit_pnl) AS credit_pnl, SUM(equity_pnl) AS equity_pnl,
+               SUM(theta_pnl) AS theta_pnl, SUM(other_pnl) AS other_pnl
+        FROM pnl_attribution WHERE pnl_date<=?
+        GROUP BY pnl_date ORDER BY pnl_date DESC LIMIT ?
+    """, (as_of, months))
+
+
+@app.get("/api/market/pnl/explain")
+def get_pnl_explain(
+    desk:  str = Query(None),
+    days:  int = Query(60, ge=1, le=5000),
+    as_of: str = Query(None),
+):
+    as_of = _as_of(as_of) or "9999-12-31"
+    conn = get_db()
+    if desk:
+        return _json(conn, """
+            SELECT * FROM pnl_explain WHERE desk=? AND pnl_date<=?
+            ORDER BY pnl_date DESC LIMIT ?
+        """, (desk, as_of, days))
+    return _json(conn, """
+        SELECT pnl_date, SUM(rates_pnl) AS rates_pnl, SUM(fx_pnl) AS fx_pnl,
+               SUM(credit_pnl) AS credit_pnl, SUM(equity_pnl) AS equity_pnl,
+               SUM(gamma_pnl) AS gamma_pnl, SUM(theta_pnl) AS theta_pnl,
+               SUM(explained_pnl) AS explained_pnl, SUM(actual_pnl) AS actual_pnl,
+               SUM(unexplained_pnl) AS unexplained_pnl, SUM(trade_count) AS trade_count
+        FROM pnl_explain
+        WHERE pnl_date IN (SELECT snapshot_date FROM snapshots
+                           WHERE table_name='pnl_explain' AND snapshot_date<=?
+                           ORDER BY snapshot_date DESC LIMIT ?)
+        GROUP BY pnl_date ORDER BY pnl_date DESC
+    """, (as_of, days))
+
+
+@app.get("/api/market/pnl/explain/{pnl_date}")
+def get_pnl_explain_day(pnl_date: str, level: str = Query("trade")):
+    if level not in ("trade", "factor", "desk"):
+        raise HTTPException(400, "level must be one of trade, factor, desk")
+    pnl_date = _as_of(pnl_date)
+    conn = get_db()
+    ex = pnl_explain.compute(conn, start=pnl_date, end=pnl_date)
     conn.close()
-    return rows
+    if ex is None or ex.dates[-1] != pnl_date:
+        raise HTTPException(404, f"No market data move for {pnl_date}")
+    if level == "factor":
+        return ex.by_factor()
+    if level == "desk":
+        return ex.by_desk()
+    return ex.by_trade(-1)
+
+
+@app.get("/api/market/backtest")
+def get_var_backtest(
+    desk:   str  = Query(None),
+    var:    str  = Query("reported"),
+    window: int  = Query(backtest.WINDOW, ge=20, le=1000),
+    series: bool = Query(False),
+    as_of:  str  = Query(None),
+):
+    if var not in backtest.VAR_SOURCES:
+        raise HTTPException(400, f"var must be one of {', '.join(backtest.VAR_SOURCES)}")
+    as_of = _as_of(as_of)
+    conn = get_db()
+    bt = backtest.run(conn, var, window, as_of)
+    conn.close()
+    if bt is None:
+        raise HTTPException(404, "No VaR forecasts overlap the P&L history")
+    if desk is not None and desk not in bt.desks:
+        raise HTTPException(404, f"No P&L history for desk {desk}")
+    rows = bt.summary()
+    result = {
+        "as_of":      bt.dates[-1],
+        "var_source": bt.var_source,
+        "confidence": backtest.CONFIDENCE,
+        "window":     bt.window,
+        "desks":      [r for r in rows if desk is None or r["desk"] == desk],
+    }
+    if series:
+        result["series"] = bt.series(desk)
+    return result
 
 
-@app.get("/api/market/positions")
-def get_positions():
+@app.get("/api/market/es")
+def get_liquidity_es(desk: str = Query(None), as_of: str = Query(None)):
     conn = get_db()
-    rows = _rows(conn, "SELECT * FROM positions ORDER BY desk, product")
+    rows = expected_shortfall.run(conn, _as_of(as_of))
     conn.close()
+    if rows is None:
+        raise HTTPException(404, "Not enough market history for a 12-month ES window")
+    if desk is not None:
+        rows = [r for r in rows if r["desk"] == desk]
+        if not rows:
+            raise HTTPException(404, f"No live trades for desk {desk}")
     return rows
 
 
+@app.get("/api/market/curves")
+def get_curves(ccy: str = Query(None), as_of: str = Query(None)):
+    conn = get_db()
+    built = curves.curves(conn, _as_of(as_of))
+    conn.close()
+    if ccy is not None:
+        if ccy not in built:
+            raise HTTPException(404, f"No curve for {ccy}")
+        return built[ccy].to_dict()
+    return [c.to_dict() for _, c in sorted(built.items())]
+
+
+@app.get("/api/market/options")
+def get_option_greeks(desk: str = Query(None)):
+    conn = get_db()
+    result = options.book_greeks(conn)
+    result["vol_surface"] = options.surface(conn).to_dict()
+    conn.close()
+    if desk is not None:
+        result["trades"] = [t for t in result["trades"] if t["desk"] == desk]
+    return result
+
+
+@app.get("/api/market/positions")
+def get_positions(as_of: str = Query(None)):
+    conn = get_db()
+    return _json(conn, "SELECT * FROM positions WHERE snapshot_date=? ORDER BY desk, product",
+                 (snapshot_for(conn, "positions", _as_of(as_of)),))
+
+
 @app.get("/api/market/trades")
 def get_trades(desk: str = Query(None), status: str = Query("Live")):
     conn = get_db()
     if desk:
-        rows = _rows(conn, """
+        return _json(conn, """
             SELECT t.*, c.name AS counterparty_name, c.internal_rating
             FROM trades t JOIN counterparties c ON c.id = t.counterparty_id
             WHERE t.desk=? AND t.status=? ORDER BY ABS(t.mark_to_market) DESC
         """, (desk, status))
-    else:
-        rows = _rows(conn, """
-            SELECT t.*, c.name AS counterparty_name, c.internal_rating
-            FROM trades t JOIN counterparties c ON c.id = t.counterparty_id
-            WHERE t.status=? ORDER BY ABS(t.mark_to_market) DESC LIMIT 200
-        """, (status,))
-    conn.close()
-    return rows
+    return _json(conn, """
+        SELECT t.*, c.name AS counterparty_name, c.internal_rating
+        FROM trades t JOIN counterparties c ON c.id = t.counterparty_id
+        WHERE t.status=? ORDER BY ABS(t.mark_to_market) DESC LIMIT 200
+    """, (status,))
 
 
 @app.get("/api/market/data/{asset_id}")
-def get_market_data(asset_id: str, days: int = Query(252)):
+def get_market_data(
+    asset_id: str,
+    days:   int = Query(252),
+    points: int = Query(None, ge=3),
+    mode:   str = Query("lttb"),
+    as_of:  str = Query(None),
+):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
     rows = _rows(conn, """
-        SELECT price_date, value FROM market_data WHERE asset_id=?
+        SELECT price_date, value FROM market_data WHERE asset_id=? AND price_date<=?
         ORDER BY price_date DESC LIMIT ?
-    """, (asset_id.upper(), days))
+    """, (asset_id.upper(), as_of, days))
     conn.close()
-    return {"asset_id": asset_id.upper(), "data": list(reversed(rows))}
+    data = list(reversed(rows))
+    if points:
+        data = _downsample(("market_data", asset_id.upper(), days), data,
+                           "price_date", "value", points, mode)
+    return FastJSONResponse({"asset_id": asset_id.upper(), "data": data})
 
 
 @app.get("/api/ccr/summary")
-def get_ccr_summary():
+def get_ccr_summary(as_of: str = Query(None)):
+    as_of = _as_of(as_of)
     conn = get_db()
-    latest = conn.execute("SELECT MAX(snapshot_date) FROM cva_history").fetchone()[0]
-    rows = _rows(conn, """
+    return _json(conn, """
         SELECT c.id, c.name, c.internal_rating, c.country_iso2,
                cv.cva_usd, cv.dva_usd, cv.bilateral_cva_usd,
                sa.ead_usd, sa.rwa_usd, pf.pfe_peak
@@ -867,68 +1092,198 @@ def get_ccr_summary():
         LEFT JOIN sa_ccr sa       ON sa.counterparty_id=c.id AND sa.snapshot_date=?
         LEFT JOIN pfe_profiles pf ON pf.counterparty_id=c.id AND pf.snapshot_date=?
         WHERE cv.cva_usd IS NOT NULL ORDER BY cv.cva_usd ASC
-    """, (latest, "2025-12-31", "2025-12-31"))
-    conn.close()
-    return rows
+    """, (snapshot_for(conn, "cva_history", as_of),
+          snapshot_for(conn, "sa_ccr", as_of),
+          snapshot_for(conn, "pfe_profiles", as_of)))
 
 
 @app.get("/api/ccr/cva/{cp_id}")
-def get_cva_history(cp_id: int, months: int = Query(12)):
+def get_cva_history(cp_id: int, months: int = Query(12), as_of: str = Query(None)):
+    as_of = _as_of(as_of) or "9999-12-31"
     conn = get_db()
-    rows = _rows(conn, """
-        SELECT * FROM cva_history WHERE counterparty_id=?
+    return _json(conn, """
+        SELECT * FROM cva_history WHERE counterparty_id=? AND snapshot_date<=?
         ORDER BY snapshot_date DESC LIMIT ?
-    """, (cp_id, months))
-    conn.close()
-    return rows
+    """, (cp_id, as_of, months))
 
 
 @app.get("/api/ccr/exposure")
-def get_mtm_exposure():
+def get_mtm_exposure(as_of: str = Query(None)):
     conn = get_db()
-    latest = conn.execute("SELECT MAX(snapshot_date) FROM mtm_exposure").fetchone()[0]
-    rows = _rows(conn, """
+    latest = snapshot_for(conn, "mtm_exposure", _as_of(as_of))
+    return _json(conn, """
         SELECT c.name AS counterparty_name, c.internal_rating,
                e.net_mtm_usd, e.collateral_held_usd,
                e.current_exposure_usd, e.gross_positive_mtm_usd
         FROM mtm_exposure e JOIN counterparties c ON c.id = e.counterparty_id
         WHERE e.snapshot_date=? ORDER BY e.current_exposure_usd DESC
     """, (latest,))
+
+
+@app.get("/api/ccr/netting-sets")
+def get_netting_set_exposure(as_of: str = Query(None), counterparty_id: int = Query(None)):
+    as_of = _as_of(as_of)
+    conn = get_db()
+    hist = exposure.compute(conn)
     conn.close()
-    return rows
+    t = hist.index(as_of) if hist is not None else None
+    if t is None:
+        raise HTTPException(404, "No market history on or before as_of")
+    rows = hist.rows(t)
+    if counterparty_id is not None:
+        rows = [r for r in rows if r["counterparty_id"] == counterparty_id]
+    rows.sort(key=lambda r: -r["current_exposure_usd"])
+    return {"as_of": str(hist.dates[t]), "netting_sets": rows}
+
+
+@app.get("/api/ccr/pfe/simulated")
+def get_simulated_pfe(
+    counterparty_id: int   = Query(None),
+    paths:           int   = Query(pfe.N_PATHS, ge=100, le=20_000),
+    horizon_days:    int   = Query(pfe.HORIZON_DAYS, ge=pfe.STEP_DAYS, le=1250),
+    mpor_days:       int   = Query(pfe.MPOR_DAYS, ge=0, le=60),
+    quantile:        float = Query(pfe.QUANTILE, gt=0.5, lt=1.0),
+):
+    conn = get_db()
+    result = pfe.simulate(conn, paths, horizon_days, mpor_days, quantile=quantile)
+    conn.close()
+    if result is None:
+        raise HTTPException(404, "No netting sets or market history to simulate")
+    if counterparty_id is not None:
+        sets = [r for r in result["netting_sets"] if r["counterparty_id"] == counterparty_id]
+        if not sets:
+            raise HTTPException(404, f"No live netting set for counterparty {counterparty_id}")
+        result = {**result, "netting_sets": sets}
+    return result
 
 
 @app.get("/api/country/limits")
-def get_country_limits():
+def get_country_limits(as_of: str = Query(None)):
     conn = get_db()
-    rows = _rows(conn, """
+    return _json(conn, """
         SELECT cl.*, tr.transfer_risk_score, tr.convertibility_risk,
                tr.political_risk_score, tr.capital_controls
         FROM country_limits cl
-        LEFT JOIN transfer_risk tr ON tr.country_iso2=cl.country_iso2
+        LEFT JOIN transfer_risk tr ON tr.country_iso2=cl.country_iso2 AND tr.snapshot_date=?
         ORDER BY cl.utilisation_pct DESC
-    """)
-    conn.close()
-    return rows
+    """, (snapshot_for(conn, "transfer_risk", _as_of(as_of)),))
 
 
 @app.get("/api/country/exposures")
-def get_country_exposures():
+def get_country_exposures(as_of: str = Query(None)):
     conn = get_db()
-    rows = _rows(conn, """
-        SELECT * FROM country_exposures WHERE snapshot_date='2025-12-31'
+    return _json(conn, """
+        SELECT * FROM country_exposures WHERE snapshot_date=?
         ORDER BY country_iso2, exposure_type
-    """)
+    """, (snapshot_for(conn, "country_exposures", _as_of(as_of)),))
+
+
+@app.get("/api/cashflows/gap")
+def get_cashflow_gap(
+    report: str = Query("liquidity"),
+    source: str = Query(None),
+    ccy:    str = Query(None),
+):
+    if report not in cashflows.GAP_REPORTS:
+        raise HTTPException(400, f"report must be one of {', '.join(cashflows.GAP_REPORTS)}")
+    if source is not None and source not in cashflows.SOURCES:
+        raise HTTPException(400, f"source must be one of {', '.join(cashflows.SOURCES)}")
+    conn = get_db()
+    result = cashflows.gap_report(conn, report, [source] if source else None, ccy)
     conn.close()
-    return rows
+    if result is None:
+        raise HTTPException(404, "No market data to project cashflows from")
+    return result
+
+
+@app.get("/api/cashflows/{source}/{instrument_id}")
+def get_instrument_cashflows(source: str, instrument_id: int):
+    if source not in cashflows.SOURCES:
+        raise HTTPException(404, f"Unknown cashflow source {source}")
+    conn = get_db()
+    result = cashflows.instrument(conn, source, instrument_id)
+    conn.close()
+    if result is None:
+        raise HTTPException(404, f"No projected cashflows for {source} {instrument_id}")
+    return result
 
 
 @app.get("/api/scenarios")
 def get_scenarios():
     conn = get_db()
-    rows = _rows(conn, "SELECT * FROM scenarios ORDER BY id")
+    return _json(conn, "SELECT * FROM scenarios ORDER BY id")
+
+
+def _reverse_stress(conn, loss, horizon, lookback):
+    result = stress.reverse_stress(stress.book_kernel(conn),
+                                   stress.covariance(conn, horizon, lookback), loss)
+    if result is None:
+        conn.close()
+        raise HTTPException(422, f"No shock in the factor space produces a {loss:,.0f}M USD loss")
+    result["horizon_days"] = horizon
+    return result
+
+
+@app.get("/api/scenarios/reverse")
+def get_reverse_stress(
+    loss:     float = Query(..., gt=0, description="book loss threshold, USD millions"),
+    horizon:  int   = Query(stress.DEFAULT_HORIZON, ge=1, le=250),
+    lookback: int   = Query(stress.DEFAULT_LOOKBACK, ge=60),
+):
+    conn = get_db()
+    result = _reverse_stress(conn, loss, horizon, lookback)
     conn.close()
-    return rows
+    return result
+
+
+@app.post("/api/scenarios/reverse")
+def save_reverse_stress(
+    loss:     float = Query(..., gt=0),
+    horizon:  int   = Query(stress.DEFAULT_HORIZON, ge=1, le=250),
+    lookback: int   = Query(stress.DEFAULT_LOOKBACK, ge=60),
+    name:     str   = Query(None),
+):
+    conn = get_db()
+    result = _reverse_stress(conn, loss, horizon, lookback)
+    try:
+        with live_write():
+            result["scenario_id"] = stress.save_scenario(conn, result, name, horizon)
+    except stress.ScenarioNameTaken as e:
+        raise HTTPException(409, str(e))
+    finally:
+        conn.close()
+    return result
+
+
+@app.get("/api/scenarios/grid")
+def get_scenario_grid(
+    x:           str   = Query("usd_rates_shock_bps"),
+    x_min:       float = Query(-300),
+    x_max:       float = Query(300),
+    x_steps:     int   = Query(25, ge=2, le=201),
+    y:           str   = Query("us_equity_shock_pct"),
+    y_min:       float = Query(-50),
+    y_max:       float = Query(20),
+    y_steps:     int   = Query(25, ge=2, le=201),
+    scenario_id: int   = Query(None, description="named scenario supplying the other factor shocks"),
+):
+    for f in (x, y):
+        if f not in stress.FACTOR_COLUMNS:
+            raise HTTPException(400, f"factor must be one of {', '.join(stress.FACTOR_COLUMNS)}")
+    if x == y:
+        raise HTTPException(400, "x and y must be different factors")
+    conn = get_db()
+    base = None
+    if scenario_id is not None:
+        sc = _one(conn, f"SELECT {', '.join(stress.FACTOR_COLUMNS)} FROM scenarios WHERE id=?", (scenario_id,))
+        if sc is None:
+            conn.close()
+            raise HTTPException(404, "Scenario not found")
+        base = tuple(sc[c] or 0.0 for c in stress.FACTOR_COLUMNS)
+    kernel = stress.book_kernel(conn)
+    conn.close()
+    result = stress.grid(kernel, x, (x_min, x_max, x_steps), y, (y_min, y_max, y_steps), base)
+    return {"scenario_id": scenario_id, **result}
 
 
 @app.get("/api/scenarios/{scenario_id}/results")
@@ -944,9 +1299,56 @@ def get_scenario_results(scenario_id: int):
     return {"scenario": sc[0], "results": results}
 
 
+@app.post("/api/import/{kind}")
+async def import_rows(kind: str, request: Request, format: str = Query(None)):
+    if kind not in importer.KINDS:
+        raise HTTPException(404, f"kind must be one of {', '.join(importer.KINDS)}")
+    fmt = format or importer.sniff(request.headers.get("content-type"))
+    if fmt not in importer.FORMATS:
+        raise HTTPException(415, "Send text/csv or application/x-ndjson, or pass format=csv|ndjson")
+    chunks = queue.Queue(maxsize=8)          # bounded: the upload streams at the loader's pace
+    job = asyncio.get_running_loop().run_in_executor(None, importer.consume, chunks, kind, fmt)
+    try:
+        async for data in request.stream():
+            if data:
+                await run_in_threadpool(chunks.put, data)
+    except BaseException:                    # client went away: abandon, don't load a truncated body
+        await run_in_threadpool(chunks.put, importer.ABORT)
+        with suppress(Exception):
+            await job
+        raise
+    await run_in_threadpool(chunks.put, None)
+    try:
+        return await job
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.get("/api/snapshots")
+def get_snapshots():
+    conn = get_db()
+    rows = registry_summary(conn)
+    conn.close()
+    return rows
+
+
 @app.get("/health")
 def health():
-    return {"status": "ok", "db": DB_PATH}
+    return {"status": "ok", "db": DB_PATH, "snapshot": current()}
+
+
+@app.get("/health/ready")
+def health_ready():
+    report = startup.status()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+@app.get("/debug/sql", include_in_schema=False)
+def debug_sql(reset: bool = Query(False)):
+    report = sql_profiler.report()
+    if reset:
+        sql_profiler.reset()
+    return report
 
 
 if __name__ == "__main__":
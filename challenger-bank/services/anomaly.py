@@ -0,0 +1,360 @@
+"""
+Batch anomaly scoring for counterparties, financials and credit facilities.
+
+Three signals, each computed for the whole universe with array operations:
+
+  peers      robust z-scores (median / 1.4826·MAD) of year-on-year changes in
+             leverage, interest coverage and EBITDA margin against the same
+             sector and fiscal year.  Groups with fewer than MIN_PEERS
+             members fall back to the whole year.
+  isolation  an isolation forest over counterparty-level features.  Trees are
+             grown level by level for all nodes at once on a subsample, and
+             every counterparty is routed with the same splits.  The score
+             is 2^(−E[h] / c(ψ)), and a seeded RNG keeps it stable between runs.
+  pd         jumps in pd_history: the latest monthly log-PD change and the
+             3-month spread change, each z-scored against the counterparty's
+             own history.  An absolute ratio / bps trigger also applies.
+
+Scores are squashed to 0–1: |z| ≤ 2 maps to 0 and |z| ≥ 6 to 1.  A financials
+row scores its own ratio changes, and a facility scores its spread against
+rating peers and its utilisation against facility-type peers.  A
+counterparty takes the max of its latest financials, isolation and PD
+components.  The engine owns the flags in ENGINE_FLAGS.  It rewrites them
+in alert_flags on every run and leaves other flags alone.
+
+Incremental runs fingerprint each counterparty's inputs (anomaly_state).
+Peer statistics and the forest are fitted on the full universe, which costs
+a few array passes.  Bulk writes happen only for counterparties whose inputs
+changed.
+
+Usage (from the challenger-bank/ directory):
+    python -m services.anomaly            # nightly: rescore changed counterparties
+    python -m services.anomaly --full     # rescore everything in a staged copy
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+MIN_PEERS = 3
+Z_FLOOR, Z_CAP = 2.0, 6.0
+Z_FLAG = 3.5                     # Iglewicz–Hoaglin outlier cut-off
+ISO_TREES, ISO_SAMPLE, ISO_SEED = 100, 256, 20251231
+ISO_FLAG = 0.62
+PD_RATIO_FLAG = 2.0              # PD doubled over 3 months
+SPREAD_JUMP_BPS = 50.0
+PD_LOOKBACK = 24                 # monthly snapshots used for jump statistics
+
+RATIOS = ("net_debt_ebitda", "interest_coverage", "ebitda_margin")
+# flag raised when the change is adverse: leverage up, coverage / margin down
+RATIO_FLAGS = {"net_debt_ebitda": ("leverage-spike", 1),
+               "interest_coverage": ("coverage-drop", -1),
+               "ebitda_margin": ("margin-compression", -1)}
+ENGINE_FLAGS = {f for f, _ in RATIO_FLAGS.values()} | {"isolation-outlier", "pd-jump", "spread-jump"}
+
+
+# ── Vectorized statistics ─────────────────────────────────────────────────────
+
+def group_median(x, groups):
+    """Median of x within each element's group (NaNs ignored), per element."""
+    out = np.full(len(x), np.nan)
+    ok = ~np.isnan(x)
+    if not ok.any():
+        return out
+    xv, gv = x[ok], groups[ok]
+    order = np.lexsort((xv, gv))
+    xs, gs = xv[order], gv[order]
+    uniq, start, count = np.unique(gs, return_index=True, return_counts=True)
+    med = (xs[start + (count - 1) // 2] + xs[start + count // 2]) / 2
+    pos = np.clip(np.searchsorted(uniq, groups), 0, len(uniq) - 1)
+    hit = uniq[pos] == groups
+    out[hit] = med[pos[hit]]
+    return out
+
+
+def group_count(x, groups):
+    """Non-NaN members of each element's group, per element."""
+    ok = ~np.isnan(x)
+    uniq, inv = np.unique(groups, return_inverse=True)
+    return np.bincount(inv, weights=ok, minlength=len(uniq))[inv]
+
+
+def robust_z(x, groups, fallback_groups=None):
+    """(x − group median) / (1.4826 · group MAD), with a fallback grouping for thin groups."""
+    med = group_median(x, groups)
+    scale = 1.4826 * group_median(np.abs(x - med), groups)
+    if fallback_groups is not None:
+        f_med = group_median(x, fallback_groups)
+        f_scale = 1.4826 * group_median(np.abs(x - f_med), fallback_groups)
+        thin = (group_count(x, groups) < MIN_PEERS) | ~(scale > 0)
+        med, scale = np.where(thin, f_med, med), np.where(thin, f_scale, scale)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (x - med) / scale
+    return np.where(np.isfinite(z), z, 0.0)
+
+
+def squash(z):
+    """|z| → 0–1 anomaly score (0 below Z_FLOOR, 1 from Z_CAP)."""
+    return np.clip((np.abs(z) - Z_FLOOR) / (Z_CAP - Z_FLOOR), 0.0, 1.0)
+
+
+def _c(n):
+    """Average unsuccessful-search path length in a BST of n points."""
+    n = np.asarray(n, dtype=float)
+    h = np.log(np.maximum(n - 1, 1)) + 0.5772156649
+    return np.where(n > 2, 2 * h - 2 * (n - 1) / np.maximum(n, 1), np.where(n == 2, 1.0, 0.0))
+
+
+def isolation_scores(X, trees=ISO_TREES, sample=ISO_SAMPLE, seed=ISO_SEED):
+    """Isolation-forest anomaly scores (0–1, ~0.5 typical) for the rows of X."""
+    n, d = X.shape
+    if n < 3:
+        return np.full(n, 0.5)
+    rng = np.random.default_rng(seed)
+    psi = min(sample, n)
+    limit = int(math.ceil(math.log2(psi)))
+    rows = np.arange(n)
+    depth = np.zeros(n)
+    for _ in range(trees):
+        s_idx = rng.choice(n, psi, replace=False)
+        s_node = np.zeros(psi, dtype=np.int64)      # node ids at the current level are < 2**level
+        p_node = np.zeros(n, dtype=np.int64)
+        path = np.full(n, np.nan)
+        for level in range(limit + 1):
+            width = 1 << level
+            size = np.bincount(s_node, minlength=width)[p_node]
+            stop = np.isnan(path) & ((size <= 1) | (level == limit))
+            path[stop] = level + _c(size[stop])
+            if level == limit or not np.isnan(path).any():
+                break
+            # one random feature and uniform split per node, within its sample range
+            feat = rng.integers(0, d, width)
+            vals = X[s_idx, feat[s_node]]
+            lo = np.full(width, np.inf)
+            hi = np.full(width, -np.inf)
+            np.minimum.at(lo, s_node, vals)
+            np.maximum.at(hi, s_node, vals)
+            split = lo + rng.random(width) * np.where(hi > lo, hi - lo, 0.0)
+            s_node = 2 * s_node + (vals >= split[s_node])
+            p_node = 2 * p_node + (X[rows, feat[p_node]] >= split[p_node])
+        depth += path
+    return 2.0 ** (-(depth / trees) / _c(psi))
+
+
+# ── Data ──────────────────────────────────────────────────────────────────────
+
+FINGERPRINT_SQL = """
+    SELECT c.id,
+           c.internal_rating || '|' || c.sector
+           || '|' || (SELECT COUNT(*) || ':' || COALESCE(MAX(fiscal_year), '') || ':'
+                             || TOTAL(net_debt_ebitda) || ':' || TOTAL(interest_coverage) || ':'
+                             || TOTAL(ebitda_margin)
+                      FROM financials WHERE counterparty_id = c.id)
+           || '|' || COALESCE((SELECT MAX(snapshot_date) FROM pd_history WHERE counterparty_id = c.id), '')
+           || '|' || (SELECT COUNT(*) || ':' || TOTAL(drawn_amount) || ':' || TOTAL(limit_amount) || ':'
+                             || TOTAL(credit_spread_bps)
+                      FROM credit_facilities WHERE counterparty_id = c.id)
+    FROM counterparties c
+"""
+
+
+def _codes(values):
+    uniq = sorted(set(values))
+    idx = {v: i for i, v in enumerate(uniq)}
+    return np.array([idx[v] for v in values], dtype=np.int64)
+
+
+def _financial_scores(conn, sector_of):
+    rows = conn.execute(f"""
+        SELECT id, counterparty_id, fiscal_year, {', '.join(RATIOS)}
+        FROM financials ORDER BY counterparty_id, fiscal_year
+    """).fetchall()
+    if not rows:
+        return None
+    a = np.array([[np.nan if v is None else v for v in r] for r in rows], dtype=float)
+    ids, cp, year = a[:, 0].astype(np.int64), a[:, 1].astype(np.int64), a[:, 2].astype(np.int64)
+    vals = a[:, 3:]
+    vals[:, RATIOS.index("interest_coverage")] = np.clip(vals[:, RATIOS.index("interest_coverage")], -5, 50)
+    same_cp = np.r_[False, cp[1:] == cp[:-1]]
+    change = np.where(same_cp[:, None], vals - np.roll(vals, 1, axis=0), np.nan)
+    sector = np.array([sector_of.get(c, -1) for c in cp])
+    groups = sector * 10_000 + year
+    z = np.column_stack([robust_z(change[:, j], groups, year) for j in range(len(RATIOS))])
+    z[np.isnan(change)] = 0.0
+    return {"id": ids, "cp": cp, "year": year, "z": z, "level": vals, "change": change,
+            "score": squash(np.abs(z).max(axis=1))}
+
+
+def _pd_scores(conn, cp_ids):
+    """Latest PD / spread jump z-scores, flags and the latest log PD per counterparty."""
+    dates = [r[0] for r in conn.execute(
+        "SELECT snapshot_date FROM snapshots WHERE table_name='pd_history' "
+        "ORDER BY snapshot_date DESC LIMIT ?", (PD_LOOKBACK + 1,)).fetchall()][::-1]
+    n = len(cp_ids)
+    out = {"pd_z": np.zeros(n), "spread_z": np.zeros(n), "pd_flag": np.zeros(n, bool),
+           "spread_flag": np.zeros(n, bool), "log_pd": np.zeros(n), "pd_chg3": np.zeros(n)}
+    if len(dates) < 5:
+        return out
+    row = {c: i for i, c in enumerate(cp_ids)}
+    col = {d: j for j, d in enumerate(dates)}
+    pd_m = np.full((n, len(dates)), np.nan)
+    sp_m = np.full((n, len(dates)), np.nan)
+    for c, d, p, s in conn.execute(
+            "SELECT counterparty_id, snapshot_date, pd_1y, credit_spread_bps FROM pd_history "
+            "WHERE snapshot_date >= ?", (dates[0],)):
+        if c in row:
+            pd_m[row[c], col[d]], sp_m[row[c], col[d]] = p, s
+    log_pd = np.log(np.maximum(pd_m, 1e-6))
+    d_pd = np.diff(log_pd, axis=1)                        # monthly log-PD moves
+    d_sp = sp_m[:, 3:] - sp_m[:, :-3]                     # 3-month spread moves
+    with np.errstate(all="ignore"):
+        for key, moves in (("pd_z", d_pd), ("spread_z", d_sp)):
+            hist = moves[:, :-1]
+            med = np.nanmedian(hist, axis=1)
+            mad = 1.4826 * np.nanmedian(np.abs(hist - med[:, None]), axis=1)
+            z = (moves[:, -1] - med) / np.where(mad > 0, mad, np.nan)
+            out[key] = np.where(np.isfinite(z), z, 0.0)
+        pd_ratio = pd_m[:, -1] / pd_m[:, -4]
+    out["pd_flag"] = (out["pd_z"] > Z_FLAG) | (np.nan_to_num(pd_ratio) >= PD_RATIO_FLAG)
+    out["spread_flag"] = (out["spread_z"] > Z_FLAG) | (np.nan_to_num(d_sp[:, -1]) >= SPREAD_JUMP_BPS)
+    out["log_pd"] = np.nan_to_num(log_pd[:, -1])
+    out["pd_chg3"] = np.nan_to_num(log_pd[:, -1] - log_pd[:, -4])
+    return out
+
+
+def _facility_scores(conn, rating_of):
+    rows = conn.execute("""
+        SELECT id, counterparty_id, facility_type, credit_spread_bps,
+               CASE WHEN limit_amount > 0 THEN drawn_amount / limit_amount END
+        FROM credit_facilities
+    """).fetchall()
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    cp = np.array([r[1] for r in rows], dtype=np.int64)
+    ftype = _codes([r[2] for r in rows])
+    rating = np.array([rating_of.get(r[1], -1) for r in rows])
+    spread = np.array([np.nan if r[3] is None else r[3] for r in rows], dtype=float)
+    util = np.array([np.nan if r[4] is None else r[4] for r in rows], dtype=float)
+    everyone = np.zeros(len(rows), dtype=np.int64)
+    z = np.maximum(np.abs(robust_z(spread, rating, everyone)), np.abs(robust_z(util, ftype, everyone)))
+    return ids, cp, squash(z)
+
+
+# ── Engine ────────────────────────────────────────────────────────────────────
+
+def score(conn, full=False):
+    """
+    Rescore counterparties whose inputs changed since the last run (all of
+    them with full=True) and write the results back.  Returns run statistics.
+    """
+    t0 = time.perf_counter()
+    fps = dict(conn.execute(FINGERPRINT_SQL).fetchall())
+    prev = dict(conn.execute("SELECT counterparty_id, input_fingerprint FROM anomaly_state").fetchall())
+    changed = {c for c, fp in fps.items() if full or prev.get(c) != fp}
+    stats = {"counterparties": 0, "financials": 0, "facilities": 0, "flagged": 0}
+    if not changed:
+        stats["seconds"] = round(time.perf_counter() - t0, 3)
+        return stats
+
+    cps = conn.execute(
+        "SELECT id, sector, internal_rating, alert_flags FROM counterparties ORDER BY id").fetchall()
+    cp_ids = np.array([r[0] for r in cps], dtype=np.int64)
+    sector_of = dict(zip(cp_ids.tolist(), _codes([r[1] for r in cps]).tolist()))
+    rating_of = dict(zip(cp_ids.tolist(), _codes([r[2] for r in cps]).tolist()))
+    row_of = {c: i for i, c in enumerate(cp_ids.tolist())}
+    n = len(cp_ids)
+
+    fin = _financial_scores(conn, sector_of)
+    pdj = _pd_scores(conn, cp_ids.tolist())
+
+    # latest financials row per counterparty
+    fin_score = np.zeros(n)
+    fin_z = np.zeros((n, len(RATIOS)))
+    features = np.zeros((n, 2 * len(RATIOS)))
+    if fin is not None:
+        last = np.r_[fin["cp"][1:] != fin["cp"][:-1], True]
+        rows = np.array([row_of.get(c, -1) for c in fin["cp"][last]])
+        ok = rows >= 0
+        fin_score[rows[ok]] = fin["score"][last][ok]
+        fin_z[rows[ok]] = fin["z"][last][ok]
+        features[rows[ok]] = np.hstack([fin["level"][last], np.nan_to_num(fin["change"][last])])[ok]
+
+    # isolation forest on globally robust-scaled features
+    X = np.column_stack([features, pdj["log_pd"], pdj["pd_chg3"]])
+    everyone = np.zeros(n, dtype=np.int64)
+    X = np.column_stack([robust_z(X[:, j], everyone) for j in range(X.shape[1])])
+    iso = isolation_scores(np.clip(X, -10, 10))
+    iso_score = np.clip((iso - 0.5) / 0.25, 0.0, 1.0)
+    pd_score = squash(np.maximum(np.maximum(pdj["pd_z"], pdj["spread_z"]), 0.0))
+    cp_score = np.maximum.reduce([fin_score, iso_score, pd_score])
+
+    # ── write back for changed counterparties only
+    now = datetime.now().isoformat(timespec="seconds")
+    cp_updates, state = [], []
+    for i, (cid, _, _, flags_json) in enumerate(cps):
+        if cid not in changed:
+            continue
+        flags = [f for f in json.loads(flags_json or "[]") if f not in ENGINE_FLAGS]
+        for j, ratio in enumerate(RATIOS):
+            name, sign = RATIO_FLAGS[ratio]
+            if sign * fin_z[i, j] > Z_FLAG:
+                flags.append(name)
+        if iso[i] >= ISO_FLAG:
+            flags.append("isolation-outlier")
+        if pdj["pd_flag"][i]:
+            flags.append("pd-jump")
+        if pdj["spread_flag"][i]:
+            flags.append("spread-jump")
+        stats["flagged"] += any(f in ENGINE_FLAGS for f in flags)
+        s = round(float(cp_score[i]), 4)
+        cp_updates.append((s, json.dumps(flags), cid))
+        state.append((cid, fps[cid], s, now))
+    conn.executemany("UPDATE counterparties SET anomaly_score=?, alert_flags=? WHERE id=?", cp_updates)
+
+    if fin is not None:
+        mask = np.isin(fin["cp"], list(changed))
+        conn.executemany("UPDATE financials SET anomaly_score=? WHERE id=?",
+                         zip(np.round(fin["score"][mask], 4).tolist(), fin["id"][mask].tolist()))
+        stats["financials"] = int(mask.sum())
+
+    f_ids, f_cp, f_score = _facility_scores(conn, rating_of)
+    mask = np.isin(f_cp, list(changed))
+    conn.executemany("UPDATE credit_facilities SET anomaly_score=? WHERE id=?",
+                     zip(np.round(f_score[mask], 4).tolist(), f_ids[mask].tolist()))
+    stats["facilities"] = int(mask.sum())
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO anomaly_state (counterparty_id, input_fingerprint, anomaly_score, scored_at)
+        VALUES (?, ?, ?, ?)
+    """, state)
+    conn.commit()
+    stats["counterparties"] = len(cp_updates)
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    return stats
+
+
+if __name__ == "__main__":
+    from db import get_db, init_db, live_write, staged
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--full", action="store_true", help="rescore every counterparty")
+    args = ap.parse_args()
+
+    init_db()
+    if args.full:
+        with staged() as conn:          # rescore in a copy, swapped in when done
+            result = score(conn, full=True)
+    else:
+        conn = get_db()
+        with live_write(wait=True):
+            result = score(conn)
+        conn.close()
+    print("  " + "  ".join(f"{k}={v}" for k, v in result.items()))
@@ -0,0 +1,271 @@
+"""
+VaR backtesting against daily desk P&L.
+
+Each day's 1-day 99% VaR forecast — the latest var_history snapshot strictly
+before the P&L date ("reported"), or a 250-day historical-simulation VaR of
+the desk's own hypothetical P&L up to the previous day ("model") — is lined up
+with two P&L series from pnl_explain:
+
+    hypothetical = full revaluation of the static book on the day's market
+                   moves, excluding carry/theta
+    actual       = the same revaluation including carry (actual_pnl)
+
+An exception is a loss beyond VaR.  Exceptions, observations and exception
+transitions are held as (desks × days) arrays and windowed with cumulative
+sums, so rolling 250-day counts, Basel traffic-light zones, Kupiec POF and
+Christoffersen independence / conditional-coverage statistics come out for
+every desk and date in one pass.  desk None is the portfolio total.
+
+Amounts are USD millions.
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from services.options import norm_cdf
+
+CONFIDENCE = 0.99
+WINDOW = 250
+GREEN_CDF, RED_CDF = 0.95, 0.9999            # Basel cumulative-probability zone cut-offs
+PLUS_FACTOR = {5: 0.40, 6: 0.50, 7: 0.65, 8: 0.75, 9: 0.85}   # yellow zone, 250 obs
+PNL_TYPES = ("hypothetical", "actual")
+VAR_SOURCES = ("reported", "model")
+
+_cache = OrderedDict()
+_CACHE_MAX = 16
+
+
+# ── Statistics ────────────────────────────────────────────────────────────────
+
+def _xlogy(n, p):
+    """n·ln(p) with 0·ln(0) = 0, elementwise."""
+    return np.where(n > 0, n * np.log(np.where(n > 0, p, 1.0)), 0.0)
+
+
+def _chi2_sf(lr, dof):
+    """Survival function of χ²(1) / χ²(2)."""
+    if dof == 1:
+        return 2 * (1 - norm_cdf(np.sqrt(lr)))
+    return np.exp(-lr / 2)
+
+
+def kupiec_pof(x, n, p=1 - CONFIDENCE):
+    """Kupiec proportion-of-failures LR for x exceptions in n days, with p-value."""
+    x, n = np.asarray(x, float), np.asarray(n, float)
+    rate = np.where(n > 0, x / np.maximum(n, 1), 0.0)
+    lr = -2 * (_xlogy(n - x, 1 - p) + _xlogy(x, p) - _xlogy(n - x, 1 - rate) - _xlogy(x, rate))
+    lr = np.maximum(lr, 0.0)
+    return lr, _chi2_sf(lr, 1)
+
+
+def christoffersen(n00, n01, n10, n11):
+    """Christoffersen independence LR from exception transition counts, with p-value."""
+    n00, n01, n10, n11 = (np.asarray(a, float) for a in (n00, n01, n10, n11))
+    pi01 = n01 / np.maximum(n00 + n01, 1)
+    pi11 = n11 / np.maximum(n10 + n11, 1)
+    pi = (n01 + n11) / np.maximum(n00 + n01 + n10 + n11, 1)
+    lr = -2 * (_xlogy(n00 + n10, 1 - pi) + _xlogy(n01 + n11, pi)
+               - _xlogy(n00, 1 - pi01) - _xlogy(n01, pi01)
+               - _xlogy(n10, 1 - pi11) - _xlogy(n11, pi11))
+    lr = np.maximum(lr, 0.0)
+    return lr, _chi2_sf(lr, 1)
+
+
+def _binom_cdf_table(n_max, p):
+    """cdf[n, k] = P(Binomial(n, p) ≤ k) for n, k ≤ n_max."""
+    pmf = np.zeros((n_max + 1, n_max + 1))
+    pmf[0, 0] = 1.0
+    for n in range(1, n_max + 1):
+        pmf[n] = pmf[n - 1] * (1 - p)
+        pmf[n, 1:] += pmf[n - 1, :-1] * p
+    return np.cumsum(pmf, axis=1)
+
+
+def traffic_light(x, n, p=1 - CONFIDENCE):
+    """
+    Basel zone (0 green, 1 yellow, 2 red) for x exceptions in n observations.
+    With no observations there is no evidence against the model, so n=0 is green.
+    """
+    x, n = np.asarray(x, int), np.asarray(n, int)
+    cdf = _binom_cdf_table(int(n.max(initial=0)), p)[n, np.minimum(x, n)]
+    return np.where((n == 0) | (cdf < GREEN_CDF), 0, np.where(cdf < RED_CDF, 1, 2))
+
+
+ZONES = ("green", "yellow", "red")
+
+
+def _rolling(a, window):
+    """Trailing-window sums along the last axis (partial windows at the start)."""
+    cs = np.cumsum(a, axis=-1)
+    out = cs.copy()
+    out[..., window:] -= cs[..., :-window]
+    return out
+
+
+# ── Data ──────────────────────────────────────────────────────────────────────
+
+def _load(conn, as_of):
+    """(dates, desks, hypothetical D×T, actual D×T, reported VaR D×T)."""
+    rows = conn.execute("""
+        SELECT pnl_date, desk, actual_pnl - theta_pnl, actual_pnl FROM pnl_explain
+        WHERE pnl_date <= COALESCE(?, '9999-12-31') ORDER BY pnl_date
+    """, (as_of,)).fetchall()
+    dates = sorted({r[0] for r in rows})
+    desks = sorted({r[1] for r in rows})
+    d_idx = {d: i for i, d in enumerate(dates)}
+    k_idx = {k: i for i, k in enumerate(desks)}
+    hyp = np.zeros((len(desks) + 1, len(dates)))
+    act = np.zeros_like(hyp)
+    for d, desk, h, a in rows:
+        hyp[k_idx[desk], d_idx[d]] = h
+        act[k_idx[desk], d_idx[d]] = a
+    hyp[-1], act[-1] = hyp[:-1].sum(axis=0), act[:-1].sum(axis=0)
+    desks.append(None)
+
+    # Reported VaR: latest snapshot strictly before each P&L date
+    var_rows = conn.execute("""
+        SELECT snapshot_date, desk, var_1d_99 FROM var_history
+        WHERE snapshot_date <= COALESCE(?, '9999-12-31') ORDER BY snapshot_date
+    """, (as_of,)).fetchall()
+    snaps = sorted({r[0] for r in var_rows})
+    s_idx = {s: i for i, s in enumerate(snaps)}
+    k_idx[None] = len(desks) - 1
+    snap_var = np.full((len(desks), len(snaps)), np.nan)
+    for s, desk, v in var_rows:
+        if desk in k_idx:
+            snap_var[k_idx[desk], s_idx[s]] = v
+    pos = np.searchsorted(np.array(snaps), np.array(dates), side="left") - 1
+    reported = np.full_like(hyp, np.nan)
+    if snaps:
+        has = pos >= 0
+        reported[:, has] = snap_var[:, pos[has]]
+    return dates, desks, hyp, act, reported
+
+
+def model_var(pnl, window=WINDOW, confidence=CONFIDENCE):
+    """
+    Historical-simulation VaR per desk and day from the previous `window`
+    days of P&L (NaN until a full window exists).
+    """
+    d, t = pnl.shape
+    var = np.full((d, t), np.nan)
+    if t <= window:
+        return var
+    windows = np.lib.stride_tricks.sliding_window_view(pnl[:, :-1], window, axis=1)
+    k = int(math.floor((1 - confidence) * window))      # 2 → third-worst of 250
+    var[:, window:] = -np.partition(windows, k, axis=-1)[..., k]
+    return var
+
+
+# ── Backtest ──────────────────────────────────────────────────────────────────
+
+class Backtest:
+    """Aligned VaR / P&L arrays and their rolling backtest statistics."""
+
+    def __init__(self, dates, desks, var, pnl, var_source, window):
+        self.dates, self.desks, self.var, self.pnl = dates, desks, var, pnl
+        self.var_source, self.window = var_source, window
+        valid = ~np.isnan(var)
+        self.obs = _rolling(valid.astype(int), window)
+        self.exceptions, self.counts = {}, {}
+        self.kupiec, self.independence, self.zone = {}, {}, {}
+        for kind in PNL_TYPES:
+            exc = valid & (-pnl[kind] > var)
+            x = _rolling(exc.astype(int), window)
+            # transitions (I[t-1] → I[t]) with both days observed, aligned on t
+            both = np.zeros_like(valid)
+            both[:, 1:] = valid[:, 1:] & valid[:, :-1]
+            prev = np.zeros_like(exc)
+            prev[:, 1:] = exc[:, :-1]
+            n = {(i, j): _rolling((both & (prev == i) & (exc == j)).astype(int), window - 1)
+                 for i in (0, 1) for j in (0, 1)}
+            self.exceptions[kind] = exc
+            self.counts[kind] = x
+            self.kupiec[kind] = kupiec_pof(x, self.obs)
+            self.independence[kind] = christoffersen(n[0, 0], n[0, 1], n[1, 0], n[1, 1])
+            self.zone[kind] = traffic_light(x, self.obs)
+
+    def _stats(self, kind, k, t):
+        x, n = int(self.counts[kind][k, t]), int(self.obs[k, t])
+        pof, pof_p = (float(a[k, t]) for a in self.kupiec[kind])
+        ind, ind_p = (float(a[k, t]) for a in self.independence[kind])
+        basel = n == WINDOW          # plus factors are defined for 250 observations
+        zone = int(self.zone[kind][k, t])
+        return {
+            "exceptions":         x,
+            "zone":               ZONES[zone],
+            "plus_factor":        (PLUS_FACTOR.get(x, 1.0 if zone == 2 else 0.0) if basel else None),
+            "kupiec_lr":          round(pof, 4),
+            "kupiec_p":           round(pof_p, 4),
+            "christoffersen_lr":  round(ind, 4),
+            "christoffersen_p":   round(ind_p, 4),
+            "cc_lr":              round(pof + ind, 4),
+            "cc_p":               round(float(_chi2_sf(pof + ind, 2)), 4),
+        }
+
+    def summary(self, t=-1):
+        """Per-desk statistics over the window ending at date index t."""
+        out = []
+        for k, desk in enumerate(self.desks):
+            exc_all = {kind: self.exceptions[kind][k] for kind in PNL_TYPES}
+            n_all = int((~np.isnan(self.var[k])).sum())
+            row = {
+                "desk":          desk,
+                "date":          self.dates[t],
+                "observations":  int(self.obs[k, t]),
+                "var_1d_99":     (None if np.isnan(self.var[k, t]) else round(float(self.var[k, t]), 4)),
+                "sample_observations": n_all,
+            }
+            for kind in PNL_TYPES:
+                row[kind] = self._stats(kind, k, t)
+                row[kind]["sample_exceptions"] = int(exc_all[kind].sum())
+            out.append(row)
+        return out
+
+    def series(self, desk):
+        """Day-by-day VaR, P&L, exception flags and rolling statistics for one desk."""
+        k = self.desks.index(desk)
+        keep = np.flatnonzero(~np.isnan(self.var[k]))
+        return [{
+            "date":               self.dates[t],
+            "var_1d_99":          round(float(self.var[k, t]), 4),
+            "hypothetical_pnl":   round(float(self.pnl["hypothetical"][k, t]), 6),
+            "actual_pnl":         round(float(self.pnl["actual"][k, t]), 6),
+            "hypothetical_exception": bool(self.exceptions["hypothetical"][k, t]),
+            "actual_exception":   bool(self.exceptions["actual"][k, t]),
+            "observations":       int(self.obs[k, t]),
+            "hypothetical_exceptions": int(self.counts["hypothetical"][k, t]),
+            "actual_exceptions":  int(self.counts["actual"][k, t]),
+            "zone":               ZONES[int(self.zone["hypothetical"][k, t])],
+        } for t in keep]
+
+
+def run(conn, var_source="reported", window=WINDOW, as_of=None):
+    """Backtest every desk over all pnl_explain dates up to as_of (cached per data version)."""
+    if var_source not in VAR_SOURCES:
+        raise ValueError(f"var_source must be one of {', '.join(VAR_SOURCES)}")
+    version = conn.execute("""
+        SELECT (SELECT MAX(id) FROM pnl_explain), (SELECT COUNT(*) FROM pnl_explain),
+               (SELECT MAX(id) FROM var_history)
+    """).fetchone()
+    key = (var_source, window, as_of, tuple(version))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    dates, desks, hyp, act, reported = _load(conn, as_of)
+    if not dates:
+        return None
+    var = reported if var_source == "reported" else model_var(hyp, window)
+    live = np.flatnonzero(~np.isnan(var).all(axis=0))
+    if not len(live):
+        return None
+    first = live[0]
+    bt = Backtest(dates[first:], desks, var[:, first:],
+                  {"hypothetical": hyp[:, first:], "actual": act[:, first:]},
+                  var_source, window)
+    _cache[key] = bt
+    while len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+    return bt
@@ -0,0 +1,394 @@
+"""
+Projected cashflows for trades and credit facilities, and gap reports.
+
+Schedules are projected from the latest market date, on that date's curves
+(services.curves) and FX, for live rates trades and active facilities:
+
+    IRS             net fixed vs floating settlement, annual on both legs
+    Bond            fixed_rate coupons, semi-annual, and redemption at par
+    XCS             local fixed vs USD floating coupons, quarterly, and the
+                    initial / final notional exchanges
+    Term Loan A     quarterly interest, straight-line amortisation
+    Term Loan B     quarterly interest, 1% a year amortisation, bullet
+    RCF             quarterly interest on the drawn amount, bullet
+    Trade Finance   interest and principal at maturity
+
+Floating coupons are the curve forward over each accrual period plus the
+credit spread; the period already running projects from the market date.
+Amounts are USD millions, signed from the bank's side (+ receive / asset).
+
+A Schedules holds one set of instruments in columnar form: `ids` and
+`offsets` per instrument, and flat `dates`, `amounts`, `kinds` and `ccys`
+per flow, so instrument i owns flows offsets[i]:offsets[i+1].  A Book keeps
+two of them: the cashflows, and the repricing profile (each leg's
+rate-sensitive notional at its next reset, or at maturity if fixed).
+Generation works on padded instrument × period arrays, CHUNK instruments at
+a time, with one curve call per currency.
+
+book() is cached per database and source.  Later calls regenerate only the
+instruments whose rows were added or changed; a new market date rebuilds.
+gap() buckets flows into BANDS for the liquidity- and repricing-gap reports.
+"""
+import numpy as np
+
+from db import current
+from services import curves, fx
+from services.snapshots import snapshot_for
+
+CASH_KINDS = ("interest", "principal", "exchange")
+REPRICE_KINDS = ("fixed", "floating")
+INTEREST, PRINCIPAL, EXCHANGE = range(3)
+FIXED, FLOATING = range(2)
+
+# (label, upper bound in days from the market date); the last band is open
+BANDS = (("0-1M", 30), ("1-3M", 91), ("3-6M", 182), ("6-12M", 365), ("1-2Y", 730),
+         ("2-3Y", 1095), ("3-5Y", 1826), ("5-7Y", 2556), ("7-10Y", 3652),
+         ("10-15Y", 5479), ("15-20Y", 7305), (">20Y", None))
+GAP_REPORTS = {"liquidity": ("inflows", "outflows"), "repricing": ("assets", "liabilities")}
+
+CHUNK = 50_000
+TLB_AMORT = 0.01
+CURRENCIES = list(curves.CURRENCIES)      # per-flow ccy codes; unseen currencies are appended
+
+_book_cache = {}
+
+
+def _codes(ccys):
+    for c in sorted(set(ccys.tolist()) - set(CURRENCIES)):
+        CURRENCIES.append(c)
+    index = {c: i for i, c in enumerate(CURRENCIES)}
+    return np.array([index[c] for c in ccys.tolist()], dtype=np.int16)
+
+
+# ── Columnar schedules ────────────────────────────────────────────────────────
+
+class Schedules:
+    """Flows per instrument: ids / offsets per instrument, flat per-flow arrays."""
+
+    def __init__(self, ids, offsets, dates, amounts, kinds, ccys):
+        self.ids, self.offsets = ids, offsets
+        self.dates, self.amounts, self.kinds, self.ccys = dates, amounts, kinds, ccys
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, np.int64), np.zeros(1, np.int64), np.zeros(0, "datetime64[D]"),
+                   np.zeros(0), np.zeros(0, np.int8), np.zeros(0, np.int16))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_flows(self):
+        return int(self.offsets[-1])
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def _flow_index(self, idx):
+        counts = self.counts[idx]
+        starts = self.offsets[:-1][idx]
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def take(self, idx):
+        """The instruments at positions idx, in that order."""
+        idx = np.asarray(idx, dtype=np.int64)
+        f = self._flow_index(idx)
+        return Schedules(self.ids[idx], np.r_[0, np.cumsum(self.counts[idx])],
+                         self.dates[f], self.amounts[f], self.kinds[f], self.ccys[f])
+
+    @classmethod
+    def concat(cls, parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.empty()
+        return cls(np.concatenate([p.ids for p in parts]),
+                   np.r_[0, np.cumsum(np.concatenate([p.counts for p in parts]))],
+                   *(np.concatenate([getattr(p, f) for p in parts])
+                     for f in ("dates", "amounts", "kinds", "ccys")))
+
+    def sorted(self):
+        return self.take(np.argsort(self.ids, kind="stable"))
+
+    def flows(self, instrument_id):
+        """Slice of one instrument's flows, or None if it is not in the set."""
+        i = np.searchsorted(self.ids, instrument_id)
+        if i == len(self.ids) or self.ids[i] != instrument_id:
+            return None
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+
+def _assemble(ids, pieces, as_of):
+    """
+    Schedules from (days, amounts, kind, ccy codes) pieces, each N × k with a
+    per-row ccy; zero amounts and dates on or before as_of are dropped.
+    """
+    n = len(ids)
+    days = np.concatenate([np.broadcast_to(p[0], p[1].shape) for p in pieces], axis=1)
+    amounts = np.concatenate([p[1] for p in pieces], axis=1)
+    kinds = np.concatenate([np.full(p[1].shape, p[2], np.int8) for p in pieces], axis=1)
+    ccys = np.concatenate([np.broadcast_to(p[3][:, None], p[1].shape) for p in pieces], axis=1)
+    live = (days > 0) & np.isfinite(days) & (amounts != 0) & np.isfinite(amounts)
+    order = np.argsort(np.where(live, days, np.inf), axis=1, kind="stable")
+    days, amounts, kinds, ccys, live = (np.take_along_axis(a, order, axis=1)
+                                        for a in (days, amounts, kinds, ccys, live))
+    counts = live.sum(axis=1)
+    return Schedules(np.asarray(ids, dtype=np.int64).reshape(n), np.r_[0, np.cumsum(counts)],
+                     np.datetime64(as_of, "D") + np.rint(days[live]).astype(np.int64),
+                     amounts[live], kinds[live], ccys[live])
+
+
+# ── Schedule builders ─────────────────────────────────────────────────────────
+# Each takes a dict of column arrays (days measured from the market date) and
+# the curve map, and returns (cash pieces, repricing pieces) for _assemble.
+
+def _periods(end, start, period):
+    """Payment days (N × K, oldest first), accrual start days and live mask."""
+    k = max(int(np.ceil(np.max(end, initial=0.0) / period)), 1)
+    pay = end[:, None] - np.arange(k - 1, -1, -1) * period
+    prev = np.maximum(pay - period, start[:, None])
+    return pay, prev, pay > 0
+
+
+def _floating(cm, ccy, prev, pay):
+    return curves.forward(cm, ccy, np.maximum(prev, 0) / 365, pay / 365)
+
+
+def _next_reset(pay, live):
+    return np.where(live, pay, np.inf).min(axis=1, initial=np.inf)[:, None]
+
+
+def _irs(c, cm):
+    s, n = c["sign"][:, None], c["notional"][:, None]
+    pay, prev, live = _periods(c["end"], c["start"], 365.0)
+    net = s * n * (_floating(cm, c["ccy"], prev, pay) - c["fixed"][:, None]) * (pay - prev) / 365
+    cash = [(pay, np.where(live, net, 0.0), INTEREST, c["code"])]
+    reprice = [(_next_reset(pay, live), s * n, FLOATING, c["code"]),
+               (c["end"][:, None], -s * n, FIXED, c["code"])]
+    return cash, reprice
+
+
+def _bond(c, cm):
+    s, n = c["sign"][:, None], c["notional"][:, None]
+    pay, prev, live = _periods(c["end"], c["start"], 182.5)
+    coupon = s * n * c["fixed"][:, None] * (pay - prev) / 365
+    cash = [(pay, np.where(live, coupon, 0.0), INTEREST, c["code"]),
+            (c["end"][:, None], s * n, PRINCIPAL, c["code"])]
+    return cash, [(c["end"][:, None], s * n, FIXED, c["code"])]
+
+
+def _xcs(c, cm):
+    """Pay = pay the local fixed leg and receive USD floating on notional_usd."""
+    s, n, nu = c["sign"][:, None], c["notional"][:, None], c["usd_leg"][:, None]
+    usd = np.full(len(s), CURRENCIES.index("USD"), np.int16)
+    pay, prev, live = _periods(c["end"], c["start"], 91.25)
+    acc = (pay - prev) / 365
+    usd_fwd = _floating(cm, np.full(len(s), "USD"), prev, pay)
+    start, end = c["start"][:, None], c["end"][:, None]
+    cash = [(pay, np.where(live, -s * n * c["fixed"][:, None] * acc, 0.0), INTEREST, c["code"]),
+            (pay, np.where(live, s * nu * usd_fwd * acc, 0.0), INTEREST, usd),
+            (start, s * n, EXCHANGE, c["code"]), (start, -s * nu, EXCHANGE, usd),
+            (end, -s * n, EXCHANGE, c["code"]), (end, s * nu, EXCHANGE, usd)]
+    reprice = [(end, -s * n, FIXED, c["code"]), (_next_reset(pay, live), s * nu, FLOATING, usd)]
+    return cash, reprice
+
+
+def _loan(amort):
+    """Quarterly floating-rate loan; amort(live counts) is the fraction repaid per period."""
+    def build(c, cm):
+        d = c["notional"][:, None]
+        pay, prev, live = _periods(c["end"], c["start"], 91.25)
+        n_live = live.sum(axis=1, keepdims=True)
+        to_go = pay.shape[1] - 1 - np.arange(pay.shape[1])        # periods after this one
+        a = amort(np.maximum(n_live, 1))
+        balance = d * np.clip(1 - a * (n_live - 1 - to_go), 0, 1)
+        principal = np.where(to_go == 0, balance, d * a)
+        rate = _floating(cm, c["ccy"], prev, pay) + c["spread"][:, None]
+        cash = [(pay, np.where(live, balance * rate * (pay - prev) / 365, 0.0), INTEREST, c["code"]),
+                (pay, np.where(live, principal, 0.0), PRINCIPAL, c["code"])]
+        return cash, [(_next_reset(pay, live), d, FLOATING, c["code"])]
+    return build
+
+
+def _trade_finance(c, cm):
+    d, end, start = c["notional"][:, None], c["end"][:, None], c["start"][:, None]
+    rate = _floating(cm, c["ccy"], start, end) + c["spread"][:, None]
+    cash = [(end, d * rate * (end - start) / 365, INTEREST, c["code"]),
+            (end, d, PRINCIPAL, c["code"])]
+    return cash, [(end, d, FIXED, c["code"])]
+
+
+_TRADES_SQL = """
+    SELECT id, product, direction, currency, notional, notional_usd,
+           trade_date, maturity_date, fixed_rate
+    FROM trades
+    WHERE status='Live' AND product IN ('IRS', 'XCS', 'Government Bond', 'Corporate Bond')
+    ORDER BY id
+"""
+_FACILITIES_SQL = """
+    SELECT id, facility_type, currency, drawn_amount, ead, credit_spread_bps,
+           origination_date, maturity_date
+    FROM credit_facilities WHERE status='Active' ORDER BY id
+"""
+
+
+def _trade_columns(rows):
+    (ids, product, direction, ccy, notional, notional_usd,
+     start, end, fixed) = (np.array(col) for col in zip(*rows))
+    notional, notional_usd = notional.astype(float), notional_usd.astype(float)
+    group = np.where(np.isin(product, ("Government Bond", "Corporate Bond")), "Bond", product)
+    return {
+        "id": ids.astype(np.int64), "group": group, "ccy": ccy,
+        "sign": np.where(np.isin(direction, ("Pay", "Long")), 1.0, -1.0),
+        "notional": notional,                                   # millions local
+        "fallback_fx": np.divide(notional_usd, notional, out=np.ones_like(notional), where=notional != 0),
+        "usd_leg": notional_usd,
+        "fixed": np.array([f if f is not None else np.nan for f in fixed], dtype=float) / 100,
+        "start": start, "end": end,
+    }
+
+
+def _facility_columns(rows):
+    ids, ftype, ccy, drawn, ead, spread, start, end = (np.array(col) for col in zip(*rows))
+    drawn = drawn.astype(float)
+    ead = np.array([e if e is not None else np.nan for e in ead], dtype=float)
+    return {
+        "id": ids.astype(np.int64), "group": ftype, "ccy": ccy,
+        "notional": drawn * 1000,                               # billions → millions
+        "fallback_fx": np.where((drawn > 0) & np.isfinite(ead), ead / np.where(drawn > 0, drawn, 1), 1.0),
+        "spread": spread.astype(float) / 1e4,
+        "start": start, "end": end,
+    }
+
+
+SOURCES = {
+    "trades": (_TRADES_SQL, _trade_columns,
+               {"IRS": _irs, "Bond": _bond, "XCS": _xcs}, None),
+    "facilities": (_FACILITIES_SQL, _facility_columns,
+                   {"Term Loan A": _loan(lambda n: 1 / n),
+                    "Term Loan B": _loan(lambda n: TLB_AMORT / 4),
+                    "RCF": _loan(lambda n: 0.0),
+                    "Trade Finance": _trade_finance}, "RCF"),
+}
+
+
+def generate(source, rows, as_of, curve_map, rates):
+    """(cashflows, repricing) Schedules for `rows` of the source's query, sorted by id."""
+    _, columns, builders, default = SOURCES[source]
+    if not rows:
+        return Schedules.empty(), Schedules.empty()
+    c = columns(rows)
+    base = np.datetime64(as_of, "D")
+    for k in ("start", "end"):
+        c[k] = (c[k].astype("datetime64[D]") - base).astype(float)
+    usd_per = {ccy: rates.rate(ccy, as_of) for ccy in set(c["ccy"].tolist())}
+    rate = np.array([usd_per[x] or np.nan for x in c["ccy"]], dtype=float)
+    c["notional"] = c["notional"] * np.where(np.isfinite(rate), rate, c.pop("fallback_fx"))
+    c["code"] = _codes(c["ccy"])
+    if default is not None:
+        c["group"] = np.where(np.isin(c["group"], list(builders)), c["group"], default)
+    cash, reprice = [], []
+    for group, build in builders.items():
+        idx = np.flatnonzero(c["group"] == group)
+        for lo in range(0, len(idx), CHUNK):
+            part = {k: v[idx[lo:lo + CHUNK]] for k, v in c.items()}
+            cash_pieces, reprice_pieces = build(part, curve_map)
+            cash.append(_assemble(part["id"], cash_pieces, as_of))
+            reprice.append(_assemble(part["id"], reprice_pieces, as_of))
+    return Schedules.concat(cash).sorted(), Schedules.concat(reprice).sorted()
+
+
+# ── Cached books and gap reports ──────────────────────────────────────────────
+
+class Book:
+    def __init__(self, source, as_of, keys, cash, repricing):
+        self.source, self.as_of, self.keys = source, as_of, keys
+        self.cash, self.repricing = cash, repricing
+
+
+def _row_keys(rows):
+    ids = np.fromiter((r[0] for r in rows), np.int64, len(rows))
+    keys = np.fromiter((hash(tuple(r)[1:]) for r in rows), np.int64, len(rows))
+    return ids, keys
+
+
+def book(conn, source, path=None):
+    """
+    Book for `source` on the latest market date, or None without market data.
+    Only rows added or changed since the cached book are regenerated.
+    """
+    path = path or current()
+    as_of = snapshot_for(conn, "market_data")
+    if as_of is None:
+        return None
+    rows = conn.execute(SOURCES[source][0]).fetchall()
+    ids, keys = _row_keys(rows)
+    cached = _book_cache.get((path, source))
+    if cached is None or cached.as_of != as_of:
+        cash, repricing = generate(source, rows, as_of, curves.curves(conn, as_of), fx.load(path))
+        cached = _book_cache[(path, source)] = Book(source, as_of, keys, cash, repricing)
+        return cached
+    old = cached.cash.ids
+    pos = np.minimum(np.searchsorted(old, ids), max(len(old) - 1, 0))
+    same = (old[pos] == ids) & (cached.keys[pos] == keys) if len(old) else np.zeros(len(ids), bool)
+    if same.all() and len(ids) == len(old):
+        return cached
+    changed = [rows[i] for i in np.flatnonzero(~same)]
+    cash, repricing = generate(source, changed, as_of, curves.curves(conn, as_of), fx.load(path))
+    keep = pos[same]
+    cached = _book_cache[(path, source)] = Book(
+        source, as_of, keys,
+        Schedules.concat([cached.cash.take(keep), cash]).sorted(),
+        Schedules.concat([cached.repricing.take(keep), repricing]).sorted())
+    return cached
+
+
+def gap(schedules, as_of, report="liquidity", ccy=None):
+    """
+    Flows bucketed into BANDS: positive and negative totals, net gap and
+    cumulative gap per band (USD millions), optionally for one currency.
+    """
+    pos_label, neg_label = GAP_REPORTS[report]
+    days = (schedules.dates - np.datetime64(as_of, "D")).astype(np.int64)
+    amounts = schedules.amounts
+    if ccy is not None:
+        mask = schedules.ccys == (CURRENCIES.index(ccy) if ccy in CURRENCIES else -1)
+        days, amounts = days[mask], amounts[mask]
+    bounds = np.array([b for _, b in BANDS[:-1]])
+    band = np.searchsorted(bounds, days, side="left")
+    pos = np.bincount(band, np.maximum(amounts, 0), len(BANDS))
+    neg = np.bincount(band, np.minimum(amounts, 0), len(BANDS))
+    net = pos + neg
+    return [{"band": label, pos_label: round(float(p), 3), neg_label: round(float(n), 3),
+             "gap": round(float(g), 3), "cumulative_gap": round(float(cg), 3)}
+            for (label, _), p, n, g, cg in zip(BANDS, pos, neg, net, np.cumsum(net))]
+
+
+def gap_report(conn, report="liquidity", sources=None, ccy=None):
+    """Gap report over the books of `sources` (default all), or None without market data."""
+    books = [book(conn, s) for s in (sources or SOURCES)]
+    if not books or books[0] is None:
+        return None
+    attr = "cash" if report == "liquidity" else "repricing"
+    merged = Schedules.concat([getattr(b, attr) for b in books])
+    return {
+        "as_of":       books[0].as_of,
+        "report":      report,
+        "currency":    ccy,
+        "instruments": sum(len(getattr(b, attr)) for b in books),
+        "flows":       merged.n_flows,
+        "bands":       gap(merged, books[0].as_of, report, ccy),
+    }
+
+
+def instrument(conn, source, instrument_id):
+    """One instrument's projected cashflows and repricing legs, or None."""
+    b = book(conn, source)
+    if b is None or b.cash.flows(instrument_id) is None:
+        return None
+    out = {"source": source, "id": instrument_id, "as_of": b.as_of}
+    for key, sched, kinds in (("cashflows", b.cash, CASH_KINDS), ("repricing", b.repricing, REPRICE_KINDS)):
+        f = sched.flows(instrument_id)
+        out[key] = [{"date": str(d), "kind": kinds[k], "currency": CURRENCIES[c], "amount_usd_m": round(float(a), 4)}
+                    for d, a, k, c in zip(sched.dates[f], sched.amounts[f], sched.kinds[f], sched.ccys[f])]
+    return out
@@ -0,0 +1,149 @@
+"""
+Covenant monitoring for the loan book.
+
+Every facility with a leverage or coverage covenant is tested against its
+counterparty's financials for each fiscal year the facility was live.  One
+set-based UPSERT joins credit_facilities to financials and computes headroom
+and status in SQL.  Only (facility, year) pairs whose inputs are new or
+changed are selected, so a new year of financials re-tests just the affected
+facilities.
+
+    leverage_headroom = (leverage_max − net_debt_ebitda) / leverage_max
+    coverage_headroom = (interest_coverage − coverage_min) / coverage_min
+    status            = Breach if either headroom < 0, Watch below WATCH_HEADROOM
+
+Breaches are written to credit_events with INSERT OR IGNORE on a unique
+(facility_id, event_type, event_date) index, so re-runs never duplicate
+them.  An open breach is resolved at the first test on or after it that
+passes, which covers later cures and restated financials.
+
+Financials are annual, so a test runs per fiscal year (test date 31 Dec)
+rather than per quarter.
+
+Usage (from the challenger-bank/ directory):
+    python -m services.covenants           # test new / changed financials
+    python -m services.covenants --full    # re-test the whole book in a staged copy
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+WATCH_HEADROOM = 0.10
+EVENT_TYPE = "Covenant Breach"
+
+_TEST_SQL = """
+    INSERT INTO covenant_tests
+        (facility_id, fiscal_year, counterparty_id, test_date,
+         leverage, leverage_max, leverage_headroom,
+         coverage, coverage_min, coverage_headroom, status, tested_at)
+    SELECT facility_id, fiscal_year, counterparty_id, test_date,
+           leverage, leverage_max, lev_hr, coverage, coverage_min, cov_hr,
+           CASE WHEN MIN(COALESCE(lev_hr, 1e9), COALESCE(cov_hr, 1e9)) < 0 THEN 'Breach'
+                WHEN MIN(COALESCE(lev_hr, 1e9), COALESCE(cov_hr, 1e9)) < :watch THEN 'Watch'
+                ELSE 'Pass' END,
+           datetime('now')
+    FROM (
+        SELECT f.id AS facility_id, fin.fiscal_year, f.counterparty_id,
+               fin.fiscal_year || '-12-31' AS test_date,
+               fin.net_debt_ebitda AS leverage, f.covenant_leverage_max AS leverage_max,
+               (f.covenant_leverage_max - fin.net_debt_ebitda) / f.covenant_leverage_max AS lev_hr,
+               fin.interest_coverage AS coverage, f.covenant_coverage_min AS coverage_min,
+               (fin.interest_coverage - f.covenant_coverage_min) / f.covenant_coverage_min AS cov_hr
+        FROM credit_facilities f
+        JOIN financials fin ON fin.counterparty_id = f.counterparty_id
+        LEFT JOIN covenant_tests t ON t.facility_id = f.id AND t.fiscal_year = fin.fiscal_year
+        WHERE (f.covenant_leverage_max IS NOT NULL OR f.covenant_coverage_min IS NOT NULL)
+          AND fin.fiscal_year BETWEEN CAST(substr(f.origination_date, 1, 4) AS INTEGER)
+                                  AND CAST(substr(f.maturity_date, 1, 4) AS INTEGER)
+          AND (:full OR t.facility_id IS NULL
+               OR t.leverage IS NOT fin.net_debt_ebitda
+               OR t.coverage IS NOT fin.interest_coverage
+               OR t.leverage_max IS NOT f.covenant_leverage_max
+               OR t.coverage_min IS NOT f.covenant_coverage_min)
+    ) WHERE true
+    ON CONFLICT(facility_id, fiscal_year) DO UPDATE SET
+        leverage = excluded.leverage, leverage_max = excluded.leverage_max,
+        leverage_headroom = excluded.leverage_headroom,
+        coverage = excluded.coverage, coverage_min = excluded.coverage_min,
+        coverage_headroom = excluded.coverage_headroom,
+        status = excluded.status, tested_at = excluded.tested_at
+"""
+
+_EVENT_SQL = """
+    INSERT OR IGNORE INTO credit_events
+        (counterparty_id, facility_id, event_date, event_type, description)
+    SELECT t.counterparty_id, t.facility_id, t.test_date, :etype,
+           'FY' || t.fiscal_year || ' covenant test: '
+           || CASE WHEN t.leverage_headroom < 0
+                   THEN 'net debt/EBITDA ' || printf('%.2fx', t.leverage)
+                        || ' vs max ' || printf('%.2fx', t.leverage_max) ELSE '' END
+           || CASE WHEN t.leverage_headroom < 0 AND t.coverage_headroom < 0 THEN '; ' ELSE '' END
+           || CASE WHEN t.coverage_headroom < 0
+                   THEN 'interest coverage ' || printf('%.2fx', t.coverage)
+                        || ' vs min ' || printf('%.2fx', t.coverage_min) ELSE '' END
+    FROM covenant_tests t
+    WHERE t.status = 'Breach'
+"""
+
+_RESOLVE_SQL = """
+    UPDATE credit_events SET
+        resolved_date = (SELECT MIN(t.test_date) FROM covenant_tests t
+                         WHERE t.facility_id = credit_events.facility_id
+                           AND t.test_date >= credit_events.event_date AND t.status <> 'Breach'),
+        resolution = 'Covenant test passed'
+    WHERE event_type = :etype AND facility_id IS NOT NULL AND resolved_date IS NULL
+      AND EXISTS (SELECT 1 FROM covenant_tests t
+                  WHERE t.facility_id = credit_events.facility_id
+                    AND t.test_date >= credit_events.event_date AND t.status <> 'Breach')
+"""
+
+
+def run(conn, full=False):
+    """Test new/changed (facility, fiscal year) pairs, raise and cure breach events."""
+    t0 = time.perf_counter()
+    tested = conn.execute(_TEST_SQL, {"watch": WATCH_HEADROOM, "full": int(full)}).rowcount
+    opened = conn.execute(_EVENT_SQL, {"etype": EVENT_TYPE}).rowcount if tested else 0
+    resolved = conn.execute(_RESOLVE_SQL, {"etype": EVENT_TYPE}).rowcount if tested else 0
+    conn.commit()
+    return {"tested": tested, "events_opened": opened, "events_resolved": resolved,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def latest_tests(conn, status=None, as_of=None):
+    """Most recent test per facility on or before as_of, worst headroom first."""
+    sql = """
+        SELECT t.*, f.facility_name, f.facility_type, c.name AS counterparty_name, c.internal_rating,
+               MIN(COALESCE(t.leverage_headroom, 1e9), COALESCE(t.coverage_headroom, 1e9)) AS min_headroom
+        FROM covenant_tests t
+        JOIN credit_facilities f ON f.id = t.facility_id
+        JOIN counterparties c ON c.id = t.counterparty_id
+        WHERE t.fiscal_year = (SELECT MAX(fiscal_year) FROM covenant_tests
+                               WHERE facility_id = t.facility_id
+                                 AND test_date <= COALESCE(:as_of, '9999-12-31'))
+    """
+    if status:
+        sql += " AND t.status = :status"
+    sql += " ORDER BY min_headroom"
+    return [dict(r) for r in conn.execute(sql, {"as_of": as_of, "status": status}).fetchall()]
+
+
+if __name__ == "__main__":
+    from db import get_db, init_db, live_write, staged
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--full", action="store_true", help="re-test every facility and year")
+    args = ap.parse_args()
+
+    init_db()
+    if args.full:
+        with staged() as conn:          # re-test in a copy, swapped in when done
+            result = run(conn, full=True)
+    else:
+        conn = get_db()
+        with live_write(wait=True):
+            result = run(conn)
+        conn.close()
+    print("  " + "  ".join(f"{k}={v}" for k, v in result.items()))
@@ -0,0 +1,168 @@
+"""
+Zero / discount curves per currency and date, and vectorized discounting.
+
+market_data quotes 2Y, 5Y and 10Y yields per currency (some currencies only
+the 10Y).  Each pillar is read as an annually compounded zero rate and
+converted to continuous compounding.  Log discount factors are interpolated
+linearly in time through (0, 0) and the pillars (log-linear discount
+factors, i.e. piecewise-flat forwards).  Beyond the last pillar the last
+forward is held flat; before the first, its zero rate.
+
+    df(t)          discount factors for an array of year fractions
+    zero(t)        continuously compounded zero rates
+    forward(t1,t2) continuously compounded forwards between two arrays
+    annuity(t, f)  Σ accrual · df over a regular schedule ending at each t
+
+Curves are cached per (currency, date, pillar quotes).  Pricing a book costs
+one curve build per currency and date plus array work, however many trades
+there are.  Curve.from_quotes builds one from a dict without the database
+(the trade generators use this).  Times are ACT/365 year fractions.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from services.snapshots import snapshot_for
+
+CURRENCIES = ("USD", "GBP", "CNY", "BRL", "ZAR")
+PILLARS = {"2Y": 2.0, "5Y": 5.0, "10Y": 10.0}
+RATE_ASSETS = {f"{ccy}_{tenor}": (ccy, tenor) for ccy in CURRENCIES for tenor in PILLARS}
+
+_curve_cache = OrderedDict()
+_CACHE_MAX = 256
+
+
+class Curve:
+    """Log-linear discount curve on pillar times (years) and continuous zero rates."""
+
+    def __init__(self, currency, curve_date, times, zeros):
+        order = np.argsort(times)
+        self.currency = currency
+        self.curve_date = curve_date
+        self.times = np.asarray(times, dtype=float)[order]
+        self.zeros = np.asarray(zeros, dtype=float)[order]
+        self._t = np.r_[0.0, self.times]
+        self._log_df = np.r_[0.0, -self.zeros * self.times]
+        # forward beyond the last pillar (its own zero rate for a single-pillar curve)
+        self._tail_fwd = ((self._log_df[-2] - self._log_df[-1]) / (self._t[-1] - self._t[-2])
+                          if len(self.times) > 1 else self.zeros[-1])
+
+    @classmethod
+    def from_quotes(cls, currency, curve_date, quotes):
+        """From {tenor years: annually compounded yield in %}."""
+        t = np.array(sorted(quotes), dtype=float)
+        y = np.array([quotes[k] for k in sorted(quotes)], dtype=float) / 100
+        return cls(currency, curve_date, t, np.log1p(y))
+
+    def log_df(self, t):
+        t = np.maximum(np.asarray(t, dtype=float), 0.0)
+        inner = np.interp(t, self._t, self._log_df)
+        # interp already gives -z₀·t before the first pillar (line through the origin)
+        return np.where(t > self._t[-1], self._log_df[-1] - self._tail_fwd * (t - self._t[-1]), inner)
+
+    def df(self, t):
+        return np.exp(self.log_df(t))
+
+    def zero(self, t):
+        t = np.asarray(t, dtype=float)
+        safe = np.where(t > 1e-8, t, 1e-8)
+        return -self.log_df(safe) / safe
+
+    def forward(self, t1, t2):
+        t1, t2 = np.asarray(t1, dtype=float), np.asarray(t2, dtype=float)
+        span = np.where(t2 - t1 > 1e-8, t2 - t1, 1e-8)
+        return (self.log_df(t1) - self.log_df(t2)) / span
+
+    def shifted(self, bp):
+        """Parallel shift of the zero curve by bp basis points."""
+        return Curve(self.currency, self.curve_date, self.times, self.zeros + bp / 1e4)
+
+    def annuity(self, t_end, freq=1):
+        """Σ accrual × df for regular schedules ending at each t_end (short first period)."""
+        times, accrual = schedule(t_end, freq)
+        return (accrual * self.df(times)).sum(axis=-1)
+
+    def par_rate(self, t_end, freq=1):
+        """Par swap rate (decimal) for spot-starting swaps maturing at each t_end."""
+        a = self.annuity(t_end, freq)
+        return np.where(a > 0, (1 - self.df(t_end)) / np.where(a > 0, a, 1), 0.0)
+
+    def to_dict(self, grid=(0.25, 0.5, 1, 2, 3, 5, 7, 10, 15, 20, 30)):
+        g = np.asarray(grid, dtype=float)
+        return {
+            "currency":   self.currency,
+            "curve_date": self.curve_date,
+            "pillars":    {f"{t:g}Y": round(float(np.expm1(z) * 100), 4) for t, z in zip(self.times, self.zeros)},
+            "grid_years": g.tolist(),
+            "zero_pct":   np.round(self.zero(g) * 100, 4).tolist(),
+            "df":         np.round(self.df(g), 6).tolist(),
+            "fwd_1y_pct": np.round(self.forward(g, g + 1) * 100, 4).tolist(),
+        }
+
+
+def schedule(t_end, freq=1):
+    """
+    Payment times and accruals (… × K, zero-padded) for regular schedules
+    rolled back from each t_end at `freq` per year; the first period is a stub.
+    """
+    t_end = np.asarray(t_end, dtype=float)
+    k = max(int(np.ceil(np.max(t_end, initial=0.0) * freq)), 1)
+    times = t_end[..., None] - np.arange(k) / freq
+    live = times > 1e-8
+    prev = np.maximum(times - 1 / freq, 0.0)
+    accrual = np.where(live, times - prev, 0.0)
+    return np.where(live, times, 0.0), accrual
+
+
+def curves(conn, as_of=None):
+    """{currency: Curve} on the latest market date ≤ as_of, each cached per date and quotes."""
+    d = snapshot_for(conn, "market_data", as_of)
+    if d is None:
+        return {}
+    ph = ",".join("?" * len(RATE_ASSETS))
+    quotes = {}
+    for asset_id, value in conn.execute(f"""
+        SELECT asset_id, value FROM market_data
+        WHERE price_date = ? AND asset_id IN ({ph})
+    """, (d, *RATE_ASSETS)).fetchall():
+        ccy, tenor = RATE_ASSETS[asset_id]
+        quotes.setdefault(ccy, {})[PILLARS[tenor]] = value
+    out = {}
+    for ccy, q in quotes.items():
+        key = (ccy, d, tuple(sorted(q.items())))
+        if key in _curve_cache:
+            _curve_cache.move_to_end(key)
+        else:
+            _curve_cache[key] = Curve.from_quotes(ccy, d, q)
+            while len(_curve_cache) > _CACHE_MAX:
+                _curve_cache.popitem(last=False)
+        out[ccy] = _curve_cache[key]
+    return out
+
+
+def curve(conn, currency, as_of=None):
+    return curves(conn, as_of).get(currency)
+
+
+def _by_currency(curve_map, currencies, fn, default, *ts):
+    currencies = np.asarray(currencies)
+    ts = [np.asarray(t, dtype=float) for t in ts]
+    out = np.zeros(np.broadcast_shapes(*(t.shape for t in ts)))
+    for ccy in np.unique(currencies):
+        c = curve_map.get(ccy) or curve_map[default]
+        rows = currencies == ccy
+        out[rows] = fn(c, *(np.broadcast_to(t, out.shape)[rows] for t in ts))
+    return out
+
+
+def discount(curve_map, currencies, t, default="USD"):
+    """
+    Discount factors for cashflow times t (N or N × K) in the currencies of
+    each row (length N): one vectorized df() call per distinct currency.
+    """
+    return _by_currency(curve_map, currencies, Curve.df, default, t)
+
+
+def forward(curve_map, currencies, t1, t2, default="USD"):
+    """Forward rates between t1 and t2 (N or N × K), per row currency like discount()."""
+    return _by_currency(curve_map, currencies, Curve.forward, default, t1, t2)
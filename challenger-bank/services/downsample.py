@@ -0,0 +1,106 @@
+"""
+Server-side downsampling for chart time series.
+
+Charts are a few hundred pixels wide, so multi-year daily series are reduced
+to ~N points before they leave the server.
+
+  lttb    Largest-Triangle-Three-Buckets — keeps the visual shape and peaks
+  minmax  min + max per bucket — cheapest, guarantees every extreme survives
+
+Selected indices are cached per (series key, N, mode, as-of) where as-of is
+the last x value of the series, so a new data point invalidates the entry.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+_CACHE: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_CACHE_MAX = 512
+
+MODES = ("lttb", "minmax")
+
+
+def _as_x(xs):
+    """ISO date strings → day ordinals; numeric input passes through."""
+    if len(xs) and isinstance(xs[0], str):
+        return np.asarray([x[:10] for x in xs], dtype="datetime64[D]").astype(np.float64)
+    return np.asarray(xs, dtype=np.float64)
+
+
+def lttb_indices(x, y, n):
+    """
+    Indices of the n points LTTB keeps (first and last always included).
+    Bucket edges and next-bucket averages are computed in one pass;
+    only the per-bucket argmax depends on the previously chosen point.
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    # n-2 interior buckets over points 1 … size-2
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Average of each bucket (used as the "next" vertex of the triangle)
+    counts = np.maximum(ends - starts, 1)
+    avg_x = np.add.reduceat(x[:size - 1], starts) / counts
+    avg_y = np.add.reduceat(y[:size - 1], starts) / counts
+    nxt_x = np.append(avg_x[1:], x[-1])
+    nxt_y = np.append(avg_y[1:], y[-1])
+
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for b in range(n - 2):
+        s, e = starts[b], ends[b]
+        bx, by = x[s:e], y[s:e]
+        area = np.abs((x[a] - nxt_x[b]) * (by - y[a]) - (x[a] - bx) * (nxt_y[b] - y[a]))
+        a = s + int(np.argmax(area))
+        out[b + 1] = a
+    return out
+
+
+def minmax_indices(y, n):
+    """Indices of the min and max of (n-2)/2 equal-width buckets plus both ends."""
+    size = len(y)
+    if n >= size or n < 4:
+        return np.arange(size)
+
+    n_buckets = (n - 2) // 2
+    edges = np.linspace(0, size, n_buckets + 1).astype(np.int64)
+    # Pad buckets to equal width with NaN so argmin/argmax run as one 2-D op
+    width = int(np.max(np.diff(edges)))
+    pos = edges[:-1, None] + np.arange(width)[None, :]
+    valid = pos < edges[1:, None]
+    grid = np.where(valid, y[np.minimum(pos, size - 1)], np.nan)
+    lo = edges[:-1] + np.nanargmin(grid, axis=1)
+    hi = edges[:-1] + np.nanargmax(grid, axis=1)
+    idx = np.unique(np.concatenate([lo, hi, [0, size - 1]]))
+    return idx
+
+
+def downsample_rows(key, rows, x_key, y_key, points, mode="lttb"):
+    """
+    Return the subset of rows (dicts, ordered by x) to plot at `points` width.
+    `key` identifies the series, e.g. ("market_data", "USD_10Y", 1250).
+    """
+    if not points or len(rows) <= points:
+        return rows
+    if mode not in MODES:
+        raise ValueError(f"Unknown downsampling mode: {mode}")
+
+    as_of = rows[-1][x_key]
+    cache_key = (key, points, mode, as_of, len(rows))
+    idx = _CACHE.get(cache_key)
+    if idx is None:
+        y = np.asarray([r[y_key] or 0.0 for r in rows], dtype=np.float64)
+        if mode == "lttb":
+            idx = lttb_indices(_as_x([r[x_key] for r in rows]), y, points)
+        else:
+            idx = minmax_indices(y, points)
+        _CACHE[cache_key] = idx
+        if len(_CACHE) > _CACHE_MAX:
+            _CACHE.popitem(last=False)
+    else:
+        _CACHE.move_to_end(cache_key)
+    return [rows[i] for i in idx]
@@ -0,0 +1,313 @@
+"""
+Netting-set exposure by historical repricing.
+
+Trade values on every market date are rebuilt backwards from today's blotter
+mark: V(d) = MtM_today − Σ full-revaluation P&L after d, using the P&L
+explain kernel (services.pnl_explain).  A trade counts only between its trade
+and maturity dates.  Commodity forwards have no scenario factor and carry
+their current mark.  Trade values are netted per netting set with one grouped
+sum over the dates × trades matrix.
+
+Collateral follows the CSA in netting_sets, with daily margining:
+
+    required = max(net − threshold_received, 0) − max(−net − threshold_posted, 0)
+    balance  = required when |required − balance| ≥ MTA, else unchanged
+
+The balance is held in value terms after haircut (HAIRCUTS by collateral
+type).  Collateral we post is exposed at its full notional.
+
+    current exposure = max(net MtM − received eligible value + posted notional, 0)
+
+Sets without a CSA hold no collateral.  The MTA rule depends on the previous
+balance, so the margin scan steps through dates, vectorised over netting sets.
+Amounts are USD millions.
+
+Usage (from the challenger-bank/ directory):
+    python -m services.exposure            # rewrite month-end mtm_exposure + collateral (staged copy)
+"""
+import argparse
+import calendar
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from services import pnl_explain
+from services.pnl_explain import _group_sum
+from services.snapshots import snapshot_for
+from generators.risk_calcs import COLLATERAL_HAIRCUTS as HAIRCUTS
+
+POSTED_TYPE = "Cash"
+
+_cache = OrderedDict()
+_CACHE_MAX = 4
+
+
+def _cache_put(key, value):
+    _cache[key] = value
+    _cache.move_to_end(key)
+    while len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+    return value
+
+
+class ExposureHistory:
+    """Dates × netting-set arrays of netted MtM, collateral and exposure."""
+
+    def __init__(self, dates, sets, gross_pos, gross_neg, trade_count, balance):
+        self.dates       = dates
+        self.sets        = sets
+        self.gross_pos   = gross_pos                 # D × S
+        self.gross_neg   = gross_neg                 # D × S
+        self.net         = gross_pos + gross_neg
+        self.trade_count = trade_count               # D × S
+        self.received = np.maximum(balance, 0.0)             # eligible value held
+        self.posted = np.maximum(-balance, 0.0) / (1 - HAIRCUTS[POSTED_TYPE])
+        self.collateral = self.received - self.posted
+        self.exposure = np.maximum(self.net - self.collateral, 0.0)
+
+    def index(self, as_of=None):
+        """Index of the last market date on or before as_of (None if before history)."""
+        i = int(np.searchsorted(self.dates, as_of or "9999-12-31", side="right")) - 1
+        return i if i >= 0 else None
+
+    def rows(self, t):
+        """One row per netting set on date index t (zeros for sets without live trades)."""
+        out = []
+        for k, s in enumerate(self.sets):
+            out.append({
+                "counterparty_id":        s["counterparty_id"],
+                "netting_set_id":         s["id"],
+                "netting_set":            s["netting_set_id"],
+                "csa_in_place":           s["csa_in_place"],
+                "threshold_received_usd": s["threshold_received_usd"],
+                "threshold_posted_usd":   s["threshold_posted_usd"],
+                "mta_usd":                s["mta_usd"],
+                "collateral_type":        s["collateral_type"],
+                "haircut":                s["haircut"],
+                "trade_count":            int(self.trade_count[t, k]),
+                "gross_positive_mtm_usd": round(float(self.gross_pos[t, k]), 3),
+                "gross_negative_mtm_usd": round(float(self.gross_neg[t, k]), 3),
+                "net_mtm_usd":            round(float(self.net[t, k]), 3),
+                "collateral_received_usd": round(float(self.received[t, k]), 3),
+                "collateral_posted_usd":  round(float(self.posted[t, k]), 3),
+                "collateral_held_usd":    round(float(self.collateral[t, k]), 3),
+                "current_exposure_usd":   round(float(self.exposure[t, k]), 3),
+            })
+        return out
+
+
+def _load_sets(conn):
+    sets = [dict(r) for r in conn.execute("""
+        SELECT ns.id, ns.counterparty_id, ns.netting_set_id, ns.csa_in_place,
+               ns.threshold_received_usd, ns.threshold_posted_usd, ns.mta_usd,
+               (SELECT collateral_type FROM collateral
+                WHERE netting_set_id = ns.id AND direction = 'Received'
+                ORDER BY snapshot_date LIMIT 1) AS collateral_type
+        FROM netting_sets ns ORDER BY ns.id
+    """).fetchall()]
+    for s in sets:
+        s["collateral_type"] = s["collateral_type"] if s["collateral_type"] in HAIRCUTS else "Cash"
+        s["haircut"] = HAIRCUTS[s["collateral_type"]]
+    return sets
+
+
+def trade_values(conn):
+    """(market dates, trades, D × N trade values, D × N live mask) for the whole blotter."""
+    trades = [dict(r) for r in conn.execute("""
+        SELECT id, trade_id, counterparty_id, product, trade_date, maturity_date,
+               COALESCE(mark_to_market, 0) AS mtm
+        FROM trades ORDER BY id
+    """).fetchall()]
+    ex = pnl_explain.compute(conn)
+    if ex is None:
+        return None
+    # explain P&L day s runs from level date s to s+1; level dates = first + ex.dates
+    first = conn.execute("SELECT MAX(price_date) FROM market_data WHERE price_date < ?",
+                         (ex.dates[0],)).fetchone()[0]
+    dates = [first] + list(ex.dates)
+    mtm = np.array([t["mtm"] for t in trades])
+    values = np.tile(mtm, (len(dates), 1))
+    priced = np.array([t["product"] != "Commodity Forward" for t in trades])
+    after = np.cumsum(ex.actual[::-1], axis=0)[::-1]                # P&L after each level date
+    values[:-1, priced] -= after
+    d = np.array(dates, dtype="datetime64[D]")
+    start = np.array([t["trade_date"] for t in trades], dtype="datetime64[D]")
+    mat = np.array([t["maturity_date"] for t in trades], dtype="datetime64[D]")
+    live = (start[None, :] <= d[:, None]) & (mat[None, :] > d[:, None])
+    return dates, trades, np.where(live, values, 0.0), live
+
+
+def margin_balance(net, sets, start=None):
+    """
+    D × S collateral balance (eligible value; + received, − posted) under each
+    CSA, starting from `start` (default: none held).
+    """
+    csa = np.array([bool(s["csa_in_place"]) for s in sets])
+    th_rcv = np.array([s["threshold_received_usd"] or 0.0 for s in sets])
+    th_post = np.array([s["threshold_posted_usd"] or 0.0 for s in sets])
+    mta = np.array([s["mta_usd"] or 0.0 for s in sets])
+    required = np.where(csa, np.maximum(net - th_rcv, 0) - np.maximum(-net - th_post, 0), 0.0)
+    balance = np.zeros_like(required)
+    b = np.where(csa, start, 0.0) if start is not None else np.zeros(len(sets))
+    for t in range(len(required)):
+        call = np.abs(required[t] - b) >= np.maximum(mta, 1e-9)
+        b = np.where(call, required[t], b)
+        balance[t] = b
+    return balance
+
+
+def compute(conn):
+    """ExposureHistory over every market date, cached until the blotter or CSAs change."""
+    fp = (tuple(conn.execute("""
+              SELECT COUNT(*), COALESCE(MAX(id), 0), ROUND(TOTAL(mark_to_market), 4) FROM trades
+          """).fetchone()),
+          tuple(conn.execute("""
+              SELECT COUNT(*), TOTAL(csa_in_place), TOTAL(threshold_received_usd),
+                     TOTAL(threshold_posted_usd), TOTAL(mta_usd) FROM netting_sets
+          """).fetchone()),
+          conn.execute("SELECT MAX(price_date) FROM market_data").fetchone()[0])
+    if fp in _cache:
+        _cache.move_to_end(fp)
+        return _cache[fp]
+    tv = trade_values(conn)
+    sets = _load_sets(conn)
+    if tv is None or not sets:
+        return None
+    dates, trades, values, live = tv
+    set_of_cp = {s["counterparty_id"]: k for k, s in enumerate(sets)}
+    in_set = np.array([t["counterparty_id"] in set_of_cp for t in trades])
+    groups = np.array([set_of_cp[t["counterparty_id"]] for t in trades if t["counterparty_id"] in set_of_cp],
+                      dtype=int)
+    values, live = values[:, in_set], live[:, in_set]
+    n = len(sets)
+    gross_pos = _group_sum(np.maximum(values, 0.0), groups, n)
+    gross_neg = _group_sum(np.minimum(values, 0.0), groups, n)
+    count = _group_sum(live.astype(float), groups, n)
+    balance = margin_balance(gross_pos + gross_neg, sets)
+    return _cache_put(fp, ExposureHistory(np.array(dates), sets, gross_pos, gross_neg, count, balance))
+
+
+def month_ends(dates):
+    """Calendar month-ends covered by the market history, plus the latest date if mid-month."""
+    first, last = dates[0], dates[-1]
+    y, m = int(first[:4]), int(first[5:7])
+    out = []
+    while True:
+        end = f"{y:04d}-{m:02d}-{calendar.monthrange(y, m)[1]:02d}"
+        if end > last:
+            break
+        out.append(end)
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    if not out or out[-1] != last:
+        out.append(last)
+    return out
+
+
+def recompute(conn, snapshot_dates=None):
+    """
+    Replace mtm_exposure and collateral for snapshot_dates (default: every
+    month-end), valued at the last market date on or before each one.
+    Returns the number of mtm_exposure rows written.
+    """
+    hist = compute(conn)
+    if hist is None:
+        return 0
+    exp_rows = []
+    for snap in snapshot_dates or month_ends(hist.dates):
+        t = hist.index(snap)
+        if t is not None:
+            exp_rows += [{**r, "snapshot_date": snap} for r in hist.rows(t)]
+    return _store(conn, exp_rows)
+
+
+def update_snapshot(conn, snapshot_date=None):
+    """
+    Re-net one snapshot (default: the latest) from current trade marks and
+    step each CSA once from the previous snapshot's collateral balance.  This
+    is set-based with no historical repricing, for use after blotter loads.
+    Returns the number of mtm_exposure rows written.
+    """
+    snap = snapshot_date or snapshot_for(conn, "mtm_exposure") or snapshot_for(conn, "market_data")
+    sets = _load_sets(conn)
+    if snap is None or not sets:
+        return 0
+    pos = {s["id"]: k for k, s in enumerate(sets)}
+    gross_pos, gross_neg, count, prev = (np.zeros((1, len(sets))) for _ in range(4))
+    for ns_id, p, n, c in conn.execute("""
+        SELECT ns.id, TOTAL(MAX(t.mark_to_market, 0)), TOTAL(MIN(t.mark_to_market, 0)), COUNT(*)
+        FROM netting_sets ns JOIN trades t ON t.counterparty_id = ns.counterparty_id
+        WHERE t.trade_date <= :snap AND t.maturity_date > :snap
+        GROUP BY ns.id
+    """, {"snap": snap}):
+        gross_pos[0, pos[ns_id]], gross_neg[0, pos[ns_id]], count[0, pos[ns_id]] = p, n, c
+    for ns_id, b in conn.execute("""
+        SELECT netting_set_id,
+               TOTAL(CASE direction WHEN 'Received' THEN eligible_value_usd ELSE -eligible_value_usd END)
+        FROM collateral
+        WHERE snapshot_date = (SELECT MAX(snapshot_date) FROM collateral WHERE snapshot_date < :snap)
+        GROUP BY netting_set_id
+    """, {"snap": snap}):
+        if ns_id in pos:
+            prev[0, pos[ns_id]] = b
+    balance = margin_balance(gross_pos + gross_neg, sets, start=prev[0])
+    hist = ExposureHistory(np.array([snap]), sets, gross_pos, gross_neg, count, balance)
+    return _store(conn, [{**r, "snapshot_date": snap} for r in hist.rows(0)])
+
+
+def _store(conn, exp_rows):
+    """Replace mtm_exposure and collateral for the snapshots in exp_rows."""
+    coll_rows = []
+    for r in exp_rows:
+        snap = r["snapshot_date"]
+        if r["collateral_received_usd"] > 0:
+            coll_rows.append({
+                "netting_set_id": r["netting_set_id"], "snapshot_date": snap,
+                "collateral_type": r["collateral_type"], "haircut": r["haircut"],
+                "notional_usd": round(r["collateral_received_usd"] / (1 - r["haircut"]), 3),
+                "eligible_value_usd": r["collateral_received_usd"], "direction": "Received",
+            })
+        if r["collateral_posted_usd"] > 0:
+            coll_rows.append({
+                "netting_set_id": r["netting_set_id"], "snapshot_date": snap,
+                "collateral_type": POSTED_TYPE, "haircut": HAIRCUTS[POSTED_TYPE],
+                "notional_usd": r["collateral_posted_usd"],
+                "eligible_value_usd": round(r["collateral_posted_usd"] * (1 - HAIRCUTS[POSTED_TYPE]), 3),
+                "direction": "Posted",
+            })
+    snaps = sorted({r["snapshot_date"] for r in exp_rows})
+    for table in ("mtm_exposure", "collateral"):
+        conn.executemany(f"DELETE FROM {table} WHERE snapshot_date = ?", [(d,) for d in snaps])
+    conn.executemany("""
+        INSERT INTO mtm_exposure
+            (counterparty_id, netting_set_id, snapshot_date, gross_positive_mtm_usd,
+             gross_negative_mtm_usd, net_mtm_usd, collateral_held_usd, current_exposure_usd)
+        VALUES (:counterparty_id, :netting_set_id, :snapshot_date, :gross_positive_mtm_usd,
+                :gross_negative_mtm_usd, :net_mtm_usd, :collateral_held_usd, :current_exposure_usd)
+    """, exp_rows)
+    conn.executemany("""
+        INSERT INTO collateral
+            (netting_set_id, snapshot_date, collateral_type, currency,
+             notional_usd, haircut, eligible_value_usd, direction)
+        VALUES (:netting_set_id, :snapshot_date, :collateral_type, 'USD',
+                :notional_usd, :haircut, :eligible_value_usd, :direction)
+    """, coll_rows)
+    conn.commit()
+    return len(exp_rows)
+
+
+if __name__ == "__main__":
+    from db import init_db, staged
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.parse_args()
+
+    init_db()
+    t0 = time.perf_counter()
+    with staged() as conn:              # reprice into a copy, swapped in when done
+        n = recompute(conn)
+    print(f"  rows={n}  seconds={time.perf_counter() - t0:.3f}")
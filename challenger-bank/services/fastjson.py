@@ -0,0 +1,105 @@
+"""
+Fast JSON path for the data API.
+
+  rows_json(conn, sql)   SQLite builds each row's JSON object itself
+                         (json_object over the query), so Python only joins
+                         byte strings — no per-row dict, no jsonable_encoder.
+                         TEXT columns that hold JSON (risk_tags, alert_flags)
+                         are embedded as arrays via json(), i.e. pre-decoded.
+  FastJSONResponse       orjson-encoded response (stdlib json fallback) that
+                         compresses bodies above MIN_COMPRESS_BYTES when the
+                         client accepts it — brotli if installed, else gzip.
+"""
+import gzip
+import json
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:          # pragma: no cover — orjson is in requirements.txt
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Columns stored as JSON text; emitted as JSON values rather than strings
+JSON_COLUMNS = {"risk_tags", "alert_flags"}
+
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL   = 5
+BROTLI_LEVEL = 4
+
+# SQLite caps function arguments at 127 by default → 63 key/value pairs
+_MAX_JSON_OBJECT_COLS = 63
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+def _quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _columns(conn, sql, params):
+    cur = conn.execute(f"SELECT * FROM ({sql}) LIMIT 0", params)
+    return [d[0] for d in cur.description]
+
+
+def rows_json(conn, sql, params=(), json_cols=JSON_COLUMNS) -> bytes:
+    """Serialise the result of `sql` to a JSON array of objects, in query order."""
+    cols = _columns(conn, sql, params)
+    if len(cols) > _MAX_JSON_OBJECT_COLS or len(set(cols)) != len(cols):
+        # Too wide for json_object, or ambiguous names — fall back to orjson
+        cur = conn.execute(sql, params)
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for c in json_cols & r.keys():
+                r[c] = json.loads(r[c] or "[]")
+        return dumps(rows)
+
+    pairs = []
+    for c in cols:
+        ident = _quote_ident(c)
+        value = f"json(COALESCE(NULLIF({ident}, ''), '[]'))" if c in json_cols else ident
+        pairs.append(f"'{c}', {value}")
+    cur = conn.execute(f"SELECT json_object({', '.join(pairs)}) FROM ({sql})", params)
+    return b"[" + ",".join(r[0] for r in cur).encode() + b"]"
+
+
+def _pick_encoding(accept):
+    accept = accept.lower()
+    if brotli is not None and "br" in accept:
+        return "br"
+    if "gzip" in accept:
+        return "gzip"
+    return None
+
+
+class FastJSONResponse(Response):
+    """JSON response that accepts pre-encoded bytes and compresses large bodies."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return dumps(content)
+
+    async def __call__(self, scope, receive, send):
+        if len(self.body) >= MIN_COMPRESS_BYTES and "content-encoding" not in self.headers:
+            encoding = _pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding == "br":
+                self.body = brotli.compress(self.body, quality=BROTLI_LEVEL)
+            elif encoding == "gzip":
+                self.body = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+            if encoding:
+                self.headers["content-encoding"] = encoding
+                self.headers["content-length"] = str(len(self.body))
+                self.headers.add_vary_header("Accept-Encoding")
+        await super().__call__(scope, receive, send)
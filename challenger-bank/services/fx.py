@@ -0,0 +1,107 @@
+"""
+FX rates and SQL conversion functions.
+
+fx_rates (db.py) holds USD per unit of each currency on every market date.
+Triggers keep it in step with the FX series in market_data: GBPUSD as
+quoted, USDxxx inverted.  register() adds these deterministic functions to a
+connection, so conversions run inside aggregates in a single SQL pass:
+
+    to_usd(amount, ccy, date)           amount in ccy → USD
+    from_usd(amount, ccy, date)         USD → ccy
+    fx_convert(amount, from, to, date)  ccy → ccy via USD
+
+Each uses the last rate on or before `date` (NULL = latest), the first rate
+for earlier dates, and returns NULL for unknown currencies.  Rates load from
+a short-lived read-only connection the first time a function runs on a
+connection.  They are shared per (database, fx_rates fingerprint), and each
+(ccy, date) lookup is memoised, so an aggregate does one bisect per distinct
+pair.
+"""
+import sqlite3
+import threading
+from bisect import bisect_right
+
+BASE = "USD"
+
+_lock = threading.Lock()
+_rates_cache = {}
+
+
+class FxRates:
+    """USD-per-unit rate history per currency with as-of lookup."""
+
+    def __init__(self, rows):
+        self._dates, self._rates = {}, {}
+        for ccy, d, r in rows:
+            self._dates.setdefault(ccy, []).append(d)
+            self._rates.setdefault(ccy, []).append(r)
+        self._memo = {}
+
+    @property
+    def currencies(self):
+        return [BASE] + sorted(self._dates)
+
+    def rate(self, ccy, on=None):
+        """USD per unit of ccy on the last rate date ≤ on (None → latest)."""
+        if ccy == BASE:
+            return 1.0
+        key = (ccy, on)
+        if key in self._memo:
+            return self._memo[key]
+        dates = self._dates.get(ccy)
+        if not dates:
+            r = None
+        elif on is None:
+            r = self._rates[ccy][-1]
+        else:
+            r = self._rates[ccy][max(bisect_right(dates, on) - 1, 0)]
+        self._memo[key] = r
+        return r
+
+    def to_usd(self, amount, ccy, on=None):
+        r = self.rate(ccy, on)
+        return None if amount is None or r is None else amount * r
+
+    def from_usd(self, amount, ccy, on=None):
+        r = self.rate(ccy, on)
+        return None if amount is None or not r else amount / r
+
+    def convert(self, amount, src, dst, on=None):
+        return self.from_usd(self.to_usd(amount, src, on), dst, on)
+
+
+def load(path):
+    """FxRates for the database at `path`, reloaded only when fx_rates changes."""
+    ro = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        # the rate total moves when a quote is corrected in place, which count and max date do not
+        fp = ro.execute("SELECT COUNT(*), MAX(rate_date), TOTAL(usd_per_unit) FROM fx_rates").fetchone()
+        with _lock:
+            cached = _rates_cache.get(path)
+            if cached and cached[0] == fp:
+                return cached[1]
+        rates = FxRates(ro.execute(
+            "SELECT currency, rate_date, usd_per_unit FROM fx_rates ORDER BY currency, rate_date"))
+    except sqlite3.OperationalError:           # no database or table yet
+        return FxRates([])
+    finally:
+        ro.close()
+    with _lock:
+        _rates_cache[path] = (fp, rates)
+    return rates
+
+
+def register(conn, path):
+    """Add to_usd / from_usd / fx_convert to conn; rates load on first use."""
+    state = {}
+
+    def rates():
+        if "rates" not in state:
+            state["rates"] = load(path)
+        return state["rates"]
+
+    conn.create_function("to_usd", 3, lambda a, c, d: rates().to_usd(a, c, d), deterministic=True)
+    conn.create_function("from_usd", 3, lambda a, c, d: rates().from_usd(a, c, d), deterministic=True)
+    conn.create_function("fx_convert", 4, lambda a, s, t, d: rates().convert(a, s, t, d),
+                         deterministic=True)
+    return conn
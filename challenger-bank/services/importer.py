@@ -0,0 +1,398 @@
+"""
+Streaming bulk import of trades, credit facilities and market data.
+
+The request body (CSV with a header row, or NDJSON) is fed in arbitrary byte
+chunks to an Importer.  Records are decoded incrementally and buffered up to
+CHUNK_ROWS.  Each batch is then validated column-wise with numpy (required
+fields, numeric and date parsing, enums, ranges, date order, known
+counterparties and currencies) and its valid rows are written with one
+executemany in a single transaction.  Memory stays bounded by the batch size
+whatever the upload size.  CSV records must each sit on one line.
+
+Rejected rows are reported with their record number, column and reason (the
+first MAX_ERRORS of them).  Trades upsert on trade_id, market data on
+(asset_id, price_date), and facilities are appended.  Missing USD amounts are
+filled in SQL with to_usd() (services/fx.py).
+
+Once the upload is complete, one incremental recompute runs for what the
+import touched: the positions snapshot and the latest netting-set exposure
+snapshot for trades, covenant tests for facilities, and stored P&L explain
+extended over new market dates (an empty explain is left to the startup
+precompute).
+
+consume() drives an Importer from a queue of byte chunks, so the web route
+can stream the body from the event loop while one worker thread owns the
+SQLite connection.  If the upload breaks off (ABORT instead of the None end
+marker), the partial last record is dropped and no recompute runs; batches
+already committed stay.
+"""
+import codecs
+import csv
+import time
+
+import numpy as np
+import orjson
+
+from db import get_db, live_write
+from services import covenants, exposure, pnl_explain
+from services.snapshots import snapshot_for
+
+CHUNK_ROWS = 50_000
+MAX_ERRORS = 1_000
+FORMATS = ("csv", "ndjson")
+ABORT = object()                 # queue marker: the upload broke off before its end
+
+
+class UploadAborted(Exception):
+    pass
+
+# column → (type, required); types: text, real, int, date
+SPECS = {
+    "trades": {
+        "table": "trades",
+        "conflict": "trade_id",
+        "columns": {
+            "trade_id": ("text", True), "counterparty_id": ("int", True),
+            "desk": ("text", True), "product": ("text", True), "direction": ("text", True),
+            "currency": ("text", True), "notional": ("real", True), "notional_usd": ("real", False),
+            "trade_date": ("date", True), "maturity_date": ("date", True),
+            "fixed_rate": ("real", False), "floating_index": ("text", False), "strike": ("real", False),
+            "option_type": ("text", False), "delta": ("real", False), "mark_to_market": ("real", True), "dv01": ("real", False),
+            "cs01": ("real", False), "status": ("text", False), "ai_summary": ("text", False),
+            "risk_tags": ("text", False),
+        },
+        "enums": {"direction": {"Pay", "Receive", "Long", "Short", "Buy", "Sell"},
+                  "option_type": {"Call", "Put"}, "status": {"Live", "Matured"}},
+        "positive": ("notional",),
+        "order": ("trade_date", "maturity_date"),
+        "fill": {"notional_usd": "to_usd(:notional, :currency, :trade_date)", "status": "'Live'"},
+    },
+    "facilities": {
+        "table": "credit_facilities",
+        "conflict": None,
+        "columns": {
+            "counterparty_id": ("int", True), "facility_name": ("text", True),
+            "facility_type": ("text", True), "currency": ("text", True),
+            "limit_amount": ("real", True), "drawn_amount": ("real", True),
+            "undrawn_amount": ("real", False), "base_rate": ("text", True),
+            "credit_spread_bps": ("real", True), "origination_date": ("date", True),
+            "maturity_date": ("date", True), "seniority": ("text", True),
+            "collateral_type": ("text", False), "covenant_leverage_max": ("real", False),
+            "covenant_coverage_min": ("real", False), "status": ("text", False),
+            "pd": ("real", False), "lgd": ("real", False), "ead": ("real", False),
+            "expected_loss": ("real", False), "rwa": ("real", False), "risk_weight": ("real", False),
+            "ai_summary": ("text", False), "risk_tags": ("text", False),
+        },
+        "enums": {"status": {"Active", "Repaid", "Defaulted"}},
+        "positive": ("limit_amount",),
+        "order": ("origination_date", "maturity_date"),
+        "fill": {
+            "undrawn_amount": ":limit_amount - :drawn_amount",
+            "status": "'Active'",
+            "ead": "to_usd(:drawn_amount, :currency, NULL)",
+            "expected_loss": ":pd * :lgd * to_usd(:drawn_amount, :currency, NULL)",
+            "rwa": ":risk_weight * to_usd(:drawn_amount, :currency, NULL)",
+        },
+    },
+    "market_data": {
+        "table": "market_data",
+        "conflict": "asset_id, price_date",
+        "columns": {
+            "asset_id": ("text", True), "asset_type": ("text", True), "currency": ("text", False),
+            "price_date": ("date", True), "value": ("real", True),
+        },
+        "enums": {"asset_type": {"Rate", "FX", "Equity", "CreditSpread"}},
+        "positive": (),
+        "order": None,
+        "fill": {},
+    },
+}
+KINDS = tuple(SPECS)
+
+
+def sniff(content_type):
+    """Upload format from a Content-Type header (None if unrecognised)."""
+    ct = (content_type or "").split(";")[0].strip().lower()
+    if ct in ("text/csv", "application/csv"):
+        return "csv"
+    if ct in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines"):
+        return "ndjson"
+    return None
+
+
+def _insert_sql(spec):
+    cols = list(spec["columns"])
+    values = [f"COALESCE(:{c}, {spec['fill'][c]})" if c in spec["fill"] else f":{c}" for c in cols]
+    sql = f"INSERT INTO {spec['table']} ({', '.join(cols)}) VALUES ({', '.join(values)})"
+    if spec["conflict"]:
+        keys = {k.strip() for k in spec["conflict"].split(",")}
+        sets = ", ".join(f"{c} = excluded.{c}" for c in cols if c not in keys)
+        sql += f" ON CONFLICT({spec['conflict']}) DO UPDATE SET {sets}"
+    return sql
+
+
+def _parse_column(values, kind):
+    """(parsed object array, missing mask, unparseable mask) for one column of raw values."""
+    raw = np.array(values, dtype=object)
+    missing = np.array([v is None or v == "" for v in values], dtype=bool)
+    if kind == "text":
+        return np.where(missing, None, raw.astype(str)), missing, np.zeros(len(raw), bool)
+    filled = np.where(missing, "0" if kind != "date" else "1970-01-01", raw)
+    try:
+        if kind == "date":
+            parsed = filled.astype(str).astype("datetime64[D]")
+        else:
+            parsed = filled.astype(float)
+        bad = np.zeros(len(raw), bool)
+    except (ValueError, TypeError):                     # locate the offending cells
+        parsed = np.empty(len(raw), dtype="datetime64[D]" if kind == "date" else float)
+        bad = np.zeros(len(raw), bool)
+        for i, v in enumerate(filled):
+            try:
+                parsed[i] = np.datetime64(str(v), "D") if kind == "date" else float(v)
+            except (ValueError, TypeError):
+                bad[i] = True
+    if kind != "date":
+        bad |= ~np.isfinite(parsed)
+    if kind == "int":
+        bad |= ~bad & (parsed != np.round(parsed))
+    bad &= ~missing
+    if kind == "date":
+        out = parsed.astype(str).astype(object)
+    elif kind == "int":
+        out = np.where(bad, 0, parsed).astype(np.int64).astype(object)
+    else:
+        out = parsed.astype(object)
+    out[missing | bad] = None
+    return out, missing, bad
+
+
+class Importer:
+    """Incremental parser + batch loader for one upload."""
+
+    def __init__(self, conn, kind, fmt):
+        self.conn, self.kind, self.fmt = conn, kind, fmt
+        self.spec = SPECS[kind]
+        self.sql = _insert_sql(self.spec)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._tail = ""
+        self._header = None
+        self._records = []
+        self._first_record = 1
+        self.record_count = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+        self.ignored_columns = []
+        self.batches = []
+        self._counterparties = {r[0] for r in conn.execute("SELECT id FROM counterparties")}
+        self._currencies = {"USD"} | {r[0] for r in conn.execute("SELECT DISTINCT currency FROM fx_rates")}
+        self._t0 = time.perf_counter()
+
+    # ── Parsing ──────────────────────────────────────────────────────────────
+    def feed(self, data):
+        text = self._tail + self._decoder.decode(data)
+        lines = text.split("\n")
+        self._tail = lines.pop()
+        self._take(lines)
+
+    def _take(self, lines):
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line.strip():
+                continue
+            if self.fmt == "csv" and self._header is None:
+                self._set_header(next(csv.reader([line])))
+                continue
+            self._records.append(line)
+            if len(self._records) >= CHUNK_ROWS:
+                self._flush()
+
+    def _set_header(self, header):
+        header = [h.strip() for h in header]
+        missing = [c for c, (_, req) in self.spec["columns"].items()
+                   if req and c not in header and c not in self.spec["fill"]]
+        if missing:
+            raise ValueError(f"missing required column(s): {', '.join(missing)}")
+        self.ignored_columns = [h for h in header if h not in self.spec["columns"]]
+        self._header = header
+
+    def _columns(self, lines):
+        """Raw column lists for a batch of record lines."""
+        names = list(self.spec["columns"])
+        cols = {c: [None] * len(lines) for c in names}
+        parse_bad = np.zeros(len(lines), bool)
+        if self.fmt == "csv":
+            pos = {h: i for i, h in enumerate(self._header)}
+            for i, rec in enumerate(csv.reader(lines)):
+                if len(rec) != len(self._header):
+                    parse_bad[i] = True
+                    continue
+                for c in names:
+                    if c in pos:
+                        cols[c][i] = rec[pos[c]]
+        else:
+            for i, line in enumerate(lines):
+                try:
+                    obj = orjson.loads(line)
+                    if not isinstance(obj, dict):
+                        raise ValueError
+                except ValueError:
+                    parse_bad[i] = True
+                    continue
+                for c in names:
+                    v = obj.get(c)
+                    cols[c][i] = v if v is None or isinstance(v, str) else str(v)
+                if not self.ignored_columns:
+                    self.ignored_columns = sorted(set(obj) - set(names))
+        return cols, parse_bad
+
+    # ── Validation + load ────────────────────────────────────────────────────
+    def _error(self, mask, column, reason, bad):
+        new = mask & ~bad
+        for i in np.flatnonzero(new)[:max(MAX_ERRORS - len(self.errors), 0)]:
+            self.errors.append({"record": self._first_record + int(i), "column": column, "error": reason})
+        return bad | mask
+
+    def _flush(self):
+        lines, self._records = self._records, []
+        if not lines:
+            return
+        t0 = time.perf_counter()
+        spec = self.spec
+        n = len(lines)
+        raw, bad = self._columns(lines)
+        for i in np.flatnonzero(bad)[:max(MAX_ERRORS - len(self.errors), 0)]:
+            self.errors.append({"record": self._first_record + int(i), "column": None,
+                                "error": "malformed record"})
+        parsed, present = {}, {}
+        for c, (ctype, required) in spec["columns"].items():
+            values, missing, cell_bad = _parse_column(raw[c], ctype)
+            parsed[c], present[c] = values, ~missing & ~cell_bad
+            if required and c not in spec["fill"]:
+                bad = self._error(missing, c, "required", bad)
+            bad = self._error(cell_bad, c, f"not a valid {ctype}", bad)
+        def num(c, default):
+            return np.where(present[c], parsed[c], default).astype(float)
+
+        for c, allowed in spec["enums"].items():
+            bad = self._error(present[c] & ~np.isin(parsed[c].astype(str), list(allowed)), c,
+                              f"must be one of {', '.join(sorted(allowed))}", bad)
+        for c in spec["positive"]:
+            bad = self._error(num(c, 1.0) <= 0, c, "must be positive", bad)
+        if spec["order"]:
+            a, b = spec["order"]
+            both = present[a] & present[b]
+            bad = self._error(both & (np.where(both, parsed[b], "") <= np.where(both, parsed[a], "")),
+                              b, f"must be after {a}", bad)
+        if "counterparty_id" in parsed:
+            bad = self._error(present["counterparty_id"]
+                              & ~np.isin(num("counterparty_id", 0), list(self._counterparties)),
+                              "counterparty_id", "unknown counterparty", bad)
+        if self.kind != "market_data":
+            bad = self._error(present["currency"]
+                              & ~np.isin(parsed["currency"].astype(str), list(self._currencies)),
+                              "currency", "no FX rate for currency", bad)
+        if self.kind == "facilities":
+            drawn = num("drawn_amount", 0.0)
+            bad = self._error((drawn < 0) | (drawn > num("limit_amount", 0.0) + 1e-9), "drawn_amount",
+                              "must be between 0 and limit_amount", bad)
+        if self.kind == "market_data":
+            bad = self._error((parsed["asset_type"] == "FX") & (num("value", 1.0) <= 0), "value",
+                              "FX rates must be positive", bad)
+
+        ok = np.flatnonzero(~bad)
+        names = list(spec["columns"])
+        rows = [{c: parsed[c][i] for c in names} for i in ok]
+        self.conn.executemany(self.sql, rows)
+        self.conn.commit()
+        self.record_count += n
+        self.inserted += len(rows)
+        self.rejected += int(bad.sum())
+        self._first_record += n
+        batch = {"records": self.record_count, "loaded": self.inserted, "rejected": self.rejected,
+                 "seconds": round(time.perf_counter() - t0, 3)}
+        self.batches.append(batch)
+
+    # ── Completion ───────────────────────────────────────────────────────────
+    def close(self):
+        """Flush the last batch, run the follow-up recompute and return the report."""
+        self._take([self._tail + self._decoder.decode(b"", final=True)])
+        self._tail = ""
+        self._flush()
+        if self.fmt == "csv" and self._header is None:
+            raise ValueError("empty upload: no CSV header")
+        recompute = self._recompute() if self.inserted else {}
+        return {
+            "kind":            self.kind,
+            "format":          self.fmt,
+            "records":         self.record_count,
+            "loaded":          self.inserted,
+            "rejected":        self.rejected,
+            "errors":          sorted(self.errors, key=lambda e: e["record"]),
+            "errors_truncated": self.rejected > len(self.errors),
+            "ignored_columns": self.ignored_columns,
+            "batches":         self.batches,
+            "recompute":       recompute,
+            "seconds":         round(time.perf_counter() - self._t0, 3),
+        }
+
+    def _recompute(self):
+        conn, out = self.conn, {}
+        t0 = time.perf_counter()
+        if self.kind == "trades":
+            out["positions"] = refresh_positions(conn)
+            out["mtm_exposure"] = exposure.update_snapshot(conn)
+        elif self.kind == "facilities":
+            out["covenants"] = covenants.run(conn)["tested"]
+        elif snapshot_for(conn, "pnl_explain"):      # extend stored explain; else left to startup
+            out["pnl_explain"] = pnl_explain.backfill(conn)
+        out["seconds"] = round(time.perf_counter() - t0, 3)
+        return out
+
+
+def refresh_positions(conn, snapshot_date=None):
+    """Rebuild the latest positions snapshot from the live blotter in one statement."""
+    snap = snapshot_date or snapshot_for(conn, "positions") or \
+        conn.execute("SELECT MAX(price_date) FROM market_data").fetchone()[0]
+    conn.execute("DELETE FROM positions WHERE snapshot_date = ?", (snap,))
+    n = conn.execute("""
+        INSERT INTO positions
+            (snapshot_date, desk, product, currency, net_notional_usd,
+             net_mtm_usd, net_dv01, net_cs01, trade_count)
+        SELECT ?, desk, product, currency,
+               ROUND(SUM(notional_usd * s), 2), ROUND(SUM(mark_to_market), 3),
+               ROUND(SUM(COALESCE(dv01, 0) * s), 2), ROUND(SUM(COALESCE(cs01, 0) * s), 4), COUNT(*)
+        FROM (SELECT *, CASE WHEN direction IN ('Long', 'Pay', 'Buy') THEN 1 ELSE -1 END AS s
+              FROM trades WHERE status = 'Live')
+        GROUP BY desk, product, currency
+    """, (snap,)).rowcount
+    conn.commit()
+    return n
+
+
+def consume(chunks, kind, fmt):
+    """
+    Run one import from a queue of byte chunks (None ends the upload, ABORT
+    abandons it and raises UploadAborted).  The queue is always drained, even
+    after an error, so the producer never blocks.
+    """
+    conn = get_db()
+    done = False
+    try:
+        with live_write():
+            importer = Importer(conn, kind, fmt)
+            for data in iter(chunks.get, None):
+                if data is ABORT:
+                    done = True
+                    raise UploadAborted(f"{kind} upload ended early; {importer.inserted:,} rows "
+                                        f"from completed batches were kept")
+                importer.feed(data)
+            done = True
+            return importer.close()
+    except BaseException:
+        while not done:
+            done = chunks.get() in (None, ABORT)
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,169 @@
+"""
+Server-sent events stream of headline risk KPIs.
+
+One KpiHub per process polls the database version every POLL_SECONDS while
+at least one client is subscribed.  The version is the published snapshot
+file (db.current) plus SQLite's PRAGMA data_version on a read-only watcher
+connection, which moves whenever another connection commits.  When it
+moves, the KPIs are computed once and only the values that changed are
+fanned out to every subscriber queue.  Open dashboards therefore cost one
+computation per data change, not one query storm per refresh.
+
+Events:
+    snapshot   every KPI, sent on connect (and to resync a slow client)
+    delta      the KPIs that changed, sent on each data change
+    error      a poll failed (sent once per distinct error); polling carries on
+
+A comment line goes out every HEARTBEAT_SECONDS so proxies keep the
+connection open.
+"""
+import asyncio
+import sqlite3
+import traceback
+
+import orjson
+from starlette.concurrency import run_in_threadpool
+
+from db import current, get_db
+from services.snapshots import snapshot_for
+
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15.0
+QUEUE_MAX = 16
+RETRY_MS = 3000
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def compute(conn):
+    """Current headline KPIs, flat name → value (limit utilisation per country)."""
+    one = lambda sql, *p: conn.execute(sql, p).fetchone()[0]
+    var = conn.execute("SELECT var_1d_99 FROM var_history WHERE desk IS NULL AND snapshot_date=?",
+                       (snapshot_for(conn, "var_history"),)).fetchone()
+    kpis = {
+        "credit_rwa_usd_bn":          round(one("SELECT COALESCE(SUM(rwa),0) FROM credit_facilities "
+                                                "WHERE status='Active'"), 3),
+        "total_expected_loss_usd_bn": round(one("SELECT COALESCE(SUM(expected_loss),0) FROM credit_facilities "
+                                                "WHERE status='Active'"), 6),
+        "market_var_1d_99_usd_m":     round(var[0] if var else 0, 2),
+        "total_cva_usd_m":            round(one("SELECT COALESCE(SUM(cva_usd),0) FROM cva_history "
+                                                "WHERE snapshot_date=?", snapshot_for(conn, "cva_history")), 3),
+        "saccr_rwa_usd_bn":           round(one("SELECT COALESCE(SUM(rwa_usd),0) FROM sa_ccr "
+                                                "WHERE snapshot_date=?", snapshot_for(conn, "sa_ccr")), 3),
+    }
+    util = conn.execute("SELECT country_iso2, utilisation_pct FROM country_limits ORDER BY country_iso2").fetchall()
+    kpis["max_limit_utilisation_pct"] = round(max((u or 0 for _, u in util), default=0), 1)
+    for iso2, u in util:
+        kpis[f"limit_utilisation_pct.{iso2}"] = round(u or 0, 1)
+    return kpis
+
+
+def _sse(event, version, data):
+    return (f"event: {event}\nid: {version}\ndata: ".encode()
+            + orjson.dumps(data) + b"\n\n")
+
+
+class KpiHub:
+    """Single poller / computation shared by every stream subscriber."""
+
+    def __init__(self, poll_seconds=POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.kpis = {}
+        self.version = 0
+        self._subs = set()
+        self._task = None
+        self._watch = None                # (path, read-only connection)
+        self._seen = None
+        self._error = None                # last poll error sent to subscribers
+
+    def _data_version(self):
+        path = current()
+        if path is None:
+            return None
+        if self._watch is None or self._watch[0] != path:
+            if self._watch:
+                self._watch[1].close()
+            self._watch = (path, sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False))
+        return path, self._watch[1].execute("PRAGMA data_version").fetchone()[0]
+
+    def _poll(self):
+        """Changed KPIs since the last poll ({} when nothing moved)."""
+        key = self._data_version()
+        if key is None or key == self._seen:
+            return {}
+        self._seen = key
+        conn = get_db()
+        try:
+            kpis = compute(conn)
+        finally:
+            conn.close()
+        changed = {k: v for k, v in kpis.items() if self.kpis.get(k) != v}
+        changed.update({k: None for k in self.kpis if k not in kpis})
+        self.kpis = kpis
+        return changed
+
+    def _reset_watch(self):
+        if self._watch:
+            self._watch[1].close()
+        self._watch, self._seen = None, None
+
+    def _send(self, q, message):
+        if q.full():                      # slow client: drop its backlog, resync
+            while not q.empty():
+                q.get_nowait()
+            message = _sse("snapshot", self.version, self.kpis)
+        q.put_nowait(message)
+
+    async def _run(self):
+        try:
+            while self._subs:
+                first = not self.kpis
+                try:
+                    changed = await run_in_threadpool(self._poll)
+                    self._error = None
+                except Exception as e:            # e.g. snapshot swapped mid-poll: retry next tick
+                    traceback.print_exc()
+                    self._reset_watch()
+                    changed = None
+                    if repr(e) != self._error:
+                        self._error = repr(e)
+                        for q in list(self._subs):
+                            self._send(q, _sse("error", self.version, {"error": self._error}))
+                if changed:
+                    self.version += 1
+                    message = _sse("snapshot" if first else "delta", self.version, changed)
+                    for q in list(self._subs):
+                        self._send(q, message)
+                await asyncio.sleep(self.poll_seconds)
+        finally:
+            self._task = None
+            self._reset_watch()
+
+    async def subscribe(self):
+        q = asyncio.Queue(maxsize=QUEUE_MAX)
+        self._subs.add(q)
+        if self.kpis:
+            q.put_nowait(_sse("snapshot", self.version, self.kpis))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return q
+
+    def unsubscribe(self, q):
+        self._subs.discard(q)
+
+
+hub = KpiHub()
+
+
+async def events(request, kpi_hub=hub):
+    """SSE byte stream for one client; unsubscribes when it disconnects."""
+    q = await kpi_hub.subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        while not await request.is_disconnected():
+            try:
+                yield await asyncio.wait_for(q.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+    finally:
+        kpi_hub.unsubscribe(q)
@@ -0,0 +1,58 @@
+"""
+Free-text search over counterparties, financials, facilities and trades.
+
+search_index (db.SEARCH_SCHEMA) is an FTS5 table kept in step with its source
+tables by triggers.  User input is never passed to MATCH verbatim: it is
+tokenised into quoted terms so punctuation ("term-loan-b", "BBB+") cannot
+produce FTS syntax errors.  Each bare term becomes a prefix query, while a
+"quoted phrase" stays an exact phrase.  Terms are ANDed together.  Results
+are ranked by BM25 with title and tags weighted above body text.
+"""
+import re
+
+from db import SEARCH_SOURCES
+
+KINDS = tuple(SEARCH_SOURCES)
+# bm25() weights per column: kind, ref_id, counterparty_id, title, body, tags
+BM25_WEIGHTS = (0.0, 0.0, 0.0, 8.0, 1.0, 4.0)
+SNIPPET_TOKENS = 16
+
+
+def match_expression(q):
+    """FTS5 MATCH expression for free text, or None if it has no terms."""
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\w+)', q or ""):
+        if phrase:
+            terms = re.findall(r"\w+", phrase)
+            if terms:
+                parts.append('"' + " ".join(terms) + '"')
+        else:
+            parts.append(f'"{word}"*')
+    return " ".join(parts) or None
+
+
+def search(conn, q, kind=None, limit=20, offset=0):
+    """Ranked hits with <mark>-highlighted title and body snippet."""
+    match = match_expression(q)
+    if match is None:
+        return []
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    sql = f"""
+        SELECT s.kind, CAST(s.ref_id AS INTEGER) AS id,
+               CAST(s.counterparty_id AS INTEGER) AS counterparty_id,
+               c.name AS counterparty_name,
+               highlight(search_index, 3, '<mark>', '</mark>') AS title,
+               snippet(search_index, 4, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet,
+               s.tags,
+               ROUND(bm25(search_index, {weights}), 4) AS score
+        FROM search_index s
+        LEFT JOIN counterparties c ON c.id = s.counterparty_id
+        WHERE search_index MATCH ?
+    """
+    params = [match]
+    if kind:
+        sql += " AND s.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY bm25(search_index, " + weights + ") LIMIT ? OFFSET ?"
+    params += [limit, offset]
+    return [dict(r) for r in conn.execute(sql, params).fetchall()]
@@ -0,0 +1,298 @@
+"""
+Counterparty similarity: local vectors and an IVF nearest-neighbour index.
+
+Each counterparty becomes a unit vector from two parts:
+
+  text     signed feature hashing of its embedding_text, read as "Key: value"
+           fields ("sector:energy", "tag:high-yield", "rating:bb+", …).
+           Entity, employee and founding fields are skipped, so the name does
+           not drive similarity.  Hashing is stateless, so new rows embed
+           without refitting a vocabulary.
+  numeric  rating notch, log headcount and the latest financial ratios, each
+           z-scored with scaling fixed when the index is built.
+
+The index is an inverted file over a k-means coarse quantizer (√N lists).  A
+query scans the `nprobe` nearest lists with one matrix-vector product, so a
+top-k lookup touches about nprobe·√N vectors.  New counterparties are
+appended to their nearest list, and the quantizer is retrained once the index
+has grown 4× past its training size.  Everything runs locally with numpy.
+
+One index is cached per database file, behind a per-file lock: builds,
+incremental adds and searches on the same file are serialised, so two
+requests never train or append concurrently.  Indexes for files that are no
+longer published as the current database are dropped.
+"""
+import math
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from db import current
+from generators.counterparties import RATING_ORDER
+
+TEXT_DIM = 256
+NUMERIC = ["rating_notch", "log_employees", "ebitda_margin", "net_debt_ebitda",
+           "interest_coverage", "roe", "roa"]
+TEXT_WEIGHT, NUMERIC_WEIGHT = 0.8, 0.6
+SKIP_FIELDS = {"entity", "employees", "founded"}
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 12
+KMEANS_SAMPLE = 20_000
+RETRAIN_GROWTH = 4
+
+_FIELD_RE = re.compile(r"(?:^|\.\s)([A-Z][A-Za-z\- ]+):\s")
+_lock = threading.Lock()
+_path_locks = {}
+_index_cache = {}
+
+
+# ── Vectorizer ────────────────────────────────────────────────────────────────
+
+def text_features(text):
+    """Field-qualified tokens of an embedding_text."""
+    parts = _FIELD_RE.split(text or "")
+    feats = []
+    for key, value in zip(parts[1::2], parts[2::2]):
+        key = key.strip().lower().replace(" ", "_")
+        if key in SKIP_FIELDS:
+            continue
+        value = value.rstrip(".").lower()
+        if key == "risk_tags":
+            feats += [f"tag:{t.strip()}" for t in value.split(",") if t.strip()]
+        else:
+            feats += [f"{key}:{w}" for w in re.findall(r"[\w+\-]+", value)]
+    return feats
+
+
+def hash_text(texts, dim=TEXT_DIM):
+    """(N × dim) L2-normalised signed hashed term counts."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for f in text_features(text):
+            h = zlib.crc32(f.encode())
+            out[i, h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.where(norms > 0, norms, 1.0)
+
+
+def _normalise(v):
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.where(norms > 0, norms, 1.0)
+
+
+def load_features(conn, min_id=0):
+    """(ids, names, embedding texts, N × len(NUMERIC) raw numeric features) for id > min_id."""
+    rows = conn.execute("""
+        SELECT c.id, c.name, c.embedding_text, c.internal_rating, c.employee_count,
+               f.ebitda_margin, f.net_debt_ebitda, f.interest_coverage, f.roe, f.roa
+        FROM counterparties c
+        LEFT JOIN financials f ON f.counterparty_id = c.id AND f.fiscal_year = (
+            SELECT MAX(fiscal_year) FROM financials WHERE counterparty_id = c.id)
+        WHERE c.id > ?
+        ORDER BY c.id
+    """, (min_id,)).fetchall()
+    rank = {r: i for i, r in enumerate(RATING_ORDER)}
+    numeric = np.array([
+        [rank.get(r[3], len(RATING_ORDER) // 2), math.log1p(r[4] or 0),
+         *(np.nan if v is None else v for v in r[5:])]
+        for r in rows], dtype=float).reshape(len(rows), len(NUMERIC))
+    numeric[:, NUMERIC.index("interest_coverage")] = np.clip(
+        numeric[:, NUMERIC.index("interest_coverage")], -5, 30)
+    return [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], numeric
+
+
+class Vectorizer:
+    """Hashed text + scaled numerics → unit vectors; scaling fixed at fit time."""
+
+    def __init__(self, mean, std):
+        self.mean, self.std = mean, std
+        self.dim = TEXT_DIM + len(NUMERIC)
+
+    @classmethod
+    def fit(cls, numeric):
+        mean = np.nanmean(numeric, axis=0) if len(numeric) else np.zeros(len(NUMERIC))
+        std = np.nanstd(numeric, axis=0) if len(numeric) else np.ones(len(NUMERIC))
+        return cls(np.nan_to_num(mean), np.where(np.nan_to_num(std) > 0, np.nan_to_num(std), 1.0))
+
+    def transform(self, texts, numeric):
+        z = np.nan_to_num((numeric - self.mean) / self.std)       # missing → sector-neutral 0
+        z = np.clip(z, -4, 4) / math.sqrt(len(NUMERIC))
+        vec = np.hstack([TEXT_WEIGHT * hash_text(texts), NUMERIC_WEIGHT * z]).astype(np.float32)
+        return _normalise(vec)
+
+
+# ── IVF index ─────────────────────────────────────────────────────────────────
+
+def _kmeans(x, k, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = x[rng.choice(len(x), min(len(x), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)          # cosine on unit vectors
+        for j in range(k):
+            members = sample[assign == j]
+            if len(members):
+                centroids[j] = members.mean(axis=0)
+        centroids = _normalise(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file cosine index over unit vectors with incremental adds."""
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.n = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self.centroids = None
+        self.lists = []
+        self.trained_size = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def ids(self):
+        return self._ids[:self.n]
+
+    @property
+    def vectors(self):
+        return self._vectors[:self.n]
+
+    def _reserve(self, n):
+        """Grow the backing arrays geometrically so appends are amortised O(1)."""
+        if n <= len(self._ids):
+            return
+        cap = max(n, 2 * len(self._ids), 64)
+        ids = np.empty(cap, dtype=np.int64)
+        vectors = np.empty((cap, self.dim), dtype=np.float32)
+        ids[:self.n], vectors[:self.n] = self.ids, self.vectors
+        self._ids, self._vectors = ids, vectors
+
+    def train(self):
+        n = self.n
+        k = max(1, int(math.sqrt(n)))
+        self.centroids = _kmeans(self.vectors, k)
+        assign = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(k + 1))
+        self.lists = [order[bounds[j]:bounds[j + 1]] for j in range(k)]
+        self.trained_size = n
+
+    def add(self, ids, vectors):
+        start, end = self.n, self.n + len(ids)
+        self._reserve(end)
+        self._ids[start:end], self._vectors[start:end] = ids, vectors
+        self.n = end
+        if self.centroids is None or end > RETRAIN_GROWTH * max(self.trained_size, 1):
+            self.train()
+            return
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for j in np.unique(assign):
+            self.lists[j] = np.concatenate([self.lists[j], start + np.flatnonzero(assign == j)])
+
+    def vector(self, ref_id):
+        pos = np.flatnonzero(self.ids == ref_id)
+        return self.vectors[pos[0]] if len(pos) else None
+
+    def search(self, query, k=10, nprobe=DEFAULT_NPROBE, exclude=None, exact=False):
+        """[(id, cosine similarity)] of the k nearest vectors."""
+        if exact or self.centroids is None or nprobe >= len(self.lists):
+            cand = np.arange(self.n)
+            sims = self.vectors @ query
+        else:
+            probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            cand = np.concatenate([self.lists[j] for j in probe])
+            sims = self.vectors[cand] @ query
+        if exclude is not None:
+            keep = self.ids[cand] != exclude
+            cand, sims = cand[keep], sims[keep]
+        top = min(k, len(cand))
+        if top == 0:
+            return []
+        best = np.argpartition(-sims, top - 1)[:top]
+        best = best[np.argsort(-sims[best])]
+        return [(int(self.ids[cand[i]]), float(sims[i])) for i in best]
+
+
+# ── Cached index over the database ────────────────────────────────────────────
+
+class SimilarityIndex:
+    def __init__(self, vectorizer, index, fingerprint):
+        self.vectorizer, self.index, self.fingerprint = vectorizer, index, fingerprint
+
+    @classmethod
+    def build(cls, conn, fingerprint):
+        ids, _, texts, numeric = load_features(conn)
+        vec = Vectorizer.fit(numeric)
+        index = IVFIndex(vec.dim)
+        if ids:
+            index.add(ids, vec.transform(texts, numeric))
+        return cls(vec, index, fingerprint)
+
+    def add_new(self, conn, fingerprint):
+        """Embed and add counterparties with ids above the current maximum."""
+        ids, _, texts, numeric = load_features(conn, int(self.index.ids.max(initial=0)))
+        if ids:
+            self.index.add(ids, self.vectorizer.transform(texts, numeric))
+        self.fingerprint = fingerprint
+        return len(ids)
+
+
+def _fingerprint(conn):
+    cp = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0), MAX(last_updated) FROM counterparties").fetchone()
+    fin = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM financials").fetchone()
+    return tuple(cp), tuple(fin)
+
+
+def _path_lock(path):
+    """Lock guarding the cached index for `path`; forgets other paths' indexes."""
+    with _lock:
+        if path not in _path_locks:
+            keep = {path, current()}       # a request on the old file must not evict the new one
+            for stale in [p for p in _path_locks if p not in keep]:
+                _path_locks.pop(stale)
+                _index_cache.pop(stale, None)
+            _path_locks[path] = threading.RLock()
+        return _path_locks[path]
+
+
+def get_index(conn, path):
+    """
+    Index for the database at `path`.  Counterparties appended since the last
+    call are added incrementally.  Any other change (edits, new financials)
+    rebuilds the index.
+    """
+    with _path_lock(path):
+        return _get_index(conn, path)
+
+
+def _get_index(conn, path):
+    fp = _fingerprint(conn)
+    cached = _index_cache.get(path)
+    if cached is None:
+        cached = _index_cache[path] = SimilarityIndex.build(conn, fp)
+    elif cached.fingerprint != fp:
+        (old_n, old_max, _), old_fin = cached.fingerprint
+        (n, max_id, _), fin = fp
+        appended_only = (fin == old_fin and max_id > old_max
+                         and n - old_n == conn.execute(
+                             "SELECT COUNT(*) FROM counterparties WHERE id > ?", (old_max,)).fetchone()[0])
+        if appended_only:
+            cached.add_new(conn, fp)
+        else:
+            cached = _index_cache[path] = SimilarityIndex.build(conn, fp)
+    return cached
+
+
+def similar(conn, path, cp_id, k=10, nprobe=DEFAULT_NPROBE, exact=False):
+    """Top-k most similar counterparties to cp_id, or None if cp_id is unknown."""
+    with _path_lock(path):                # a concurrent add may retrain the lists
+        idx = _get_index(conn, path)
+        query = idx.index.vector(cp_id)
+        if query is None:
+            return None
+        return idx.index.search(query, k, nprobe, exclude=cp_id, exact=exact)
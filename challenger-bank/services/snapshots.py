@@ -0,0 +1,127 @@
+"""
+Snapshot registry lookups and history compaction.
+
+Every date-partitioned table (db.SNAPSHOT_TABLES) registers its snapshot
+dates in `snapshots` via insert triggers, so "latest snapshot on or before
+as_of" is a primary-key probe rather than a MAX() scan of the history table,
+and the read itself is a range on the table's date index.
+
+Compaction keeps every snapshot newer than `keep_daily_days` and thins older
+history to the last snapshot of each month.  By default it only touches
+COMPACT_TABLES, the point-in-time risk snapshots where month-ends are enough.
+Daily series that analytics read as series (market_data returns, the P&L
+tables and VaR forecasts behind the backtest) are compacted only when named
+with --table.
+
+Usage (from the challenger-bank/ directory):
+    python -m services.snapshots                 # list snapshot counts
+    python -m services.snapshots --compact       # thin old dailies to month-ends
+    python -m services.snapshots --compact --table pnl_explain   # opt a daily table in
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from db import SNAPSHOT_TABLES
+
+# Thinned by default.  market_data, pnl_attribution, pnl_explain and
+# var_history must stay daily (returns, backtest windows) unless named explicitly.
+COMPACT_TABLES = ("pd_history", "positions", "collateral", "mtm_exposure", "pfe_profiles",
+                  "cva_history", "sa_ccr", "country_exposures", "transfer_risk")
+KEEP_DAILY_DAYS = 400
+
+
+def _check_table(table):
+    if table not in SNAPSHOT_TABLES:
+        raise ValueError(f"{table} is not a snapshot table")
+
+
+def snapshot_for(conn, table, as_of=None):
+    """Latest registered snapshot of `table` on or before as_of (None = latest)."""
+    _check_table(table)
+    row = conn.execute("""
+        SELECT snapshot_date FROM snapshots
+        WHERE table_name=? AND snapshot_date <= COALESCE(?, '9999-12-31')
+        ORDER BY snapshot_date DESC LIMIT 1
+    """, (table, as_of)).fetchone()
+    return row[0] if row else None
+
+
+def snapshot_dates(conn, table):
+    _check_table(table)
+    return [r[0] for r in conn.execute(
+        "SELECT snapshot_date FROM snapshots WHERE table_name=? ORDER BY snapshot_date",
+        (table,)).fetchall()]
+
+
+def registry_summary(conn):
+    return [dict(r) for r in conn.execute("""
+        SELECT table_name, COUNT(*) AS snapshots,
+               MIN(snapshot_date) AS first_date, MAX(snapshot_date) AS latest_date
+        FROM snapshots GROUP BY table_name ORDER BY table_name
+    """).fetchall()]
+
+
+def compact(conn, tables=None, keep_daily_days=KEEP_DAILY_DAYS):
+    """
+    Delete snapshots older than keep_daily_days (relative to each table's
+    latest) that are not the last snapshot of their month, in `tables`
+    (default COMPACT_TABLES).  Returns {table: rows_deleted}.
+    """
+    deleted = {}
+    for table in tables or COMPACT_TABLES:
+        _check_table(table)
+        col = SNAPSHOT_TABLES[table]
+        latest = snapshot_for(conn, table)
+        if latest is None:
+            continue
+        cutoff = (date.fromisoformat(latest) - timedelta(days=keep_daily_days)).isoformat()
+        drop = [r[0] for r in conn.execute("""
+            SELECT snapshot_date FROM snapshots s
+            WHERE table_name=? AND snapshot_date < ?
+              AND snapshot_date <> (
+                  SELECT MAX(snapshot_date) FROM snapshots
+                  WHERE table_name=s.table_name
+                    AND substr(snapshot_date, 1, 7) = substr(s.snapshot_date, 1, 7))
+        """, (table, cutoff)).fetchall()]
+        if not drop:
+            deleted[table] = 0
+            continue
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _drop_dates (d TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM _drop_dates")
+        conn.executemany("INSERT INTO _drop_dates VALUES (?)", [(d,) for d in drop])
+        cur = conn.execute(f"DELETE FROM {table} WHERE {col} IN (SELECT d FROM _drop_dates)")
+        deleted[table] = cur.rowcount
+        conn.execute("""
+            DELETE FROM snapshots
+            WHERE table_name=? AND snapshot_date IN (SELECT d FROM _drop_dates)
+        """, (table,))
+        conn.commit()
+    return deleted
+
+
+if __name__ == "__main__":
+    from db import get_db, init_db
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--compact", action="store_true", help="thin old snapshots to month-ends")
+    ap.add_argument("--keep-days", type=int, default=KEEP_DAILY_DAYS)
+    ap.add_argument("--table", action="append", help="compact these tables instead of the defaults (needed for daily P&L, VaR and market data)")
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM after compaction")
+    args = ap.parse_args()
+
+    init_db()
+    conn = get_db()
+    if args.compact:
+        result = compact(conn, args.table, args.keep_days)
+        for t, n in result.items():
+            print(f"  {t:<20} {n:>10,} rows removed")
+        if args.vacuum:
+            conn.execute("VACUUM")
+    for r in registry_summary(conn):
+        print(f"  {r['table_name']:<20} {r['snapshots']:>6} snapshots  "
+              f"{r['first_date']} → {r['latest_date']}")
+    conn.close()
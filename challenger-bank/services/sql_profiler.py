@@ -0,0 +1,215 @@
+"""
+Per-request SQL profiling.
+
+get_db() connections are created with ProfiledConnection.  While a request
+is being served (SQLProfilerMiddleware sets a context-local record list),
+every execute() is timed — including the fetch/iteration that follows — and
+appended to that list.  Outside a request (seeding, jobs) nothing is recorded.
+
+Each request then gets
+  Server-Timing: sql;dur=12.3;desc="9 queries, 1 repeated", app;dur=20.1
+and a summary is pushed onto a rolling window that /debug/sql aggregates:
+per-route SQL time, repeated query shapes (N+1 patterns) and the slowest
+statements.  Set SQL_PROFILE=0 to switch it off.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque, defaultdict
+from contextvars import ContextVar
+
+import numpy as np
+from starlette.middleware.base import BaseHTTPMiddleware
+
+ENABLED = os.environ.get("SQL_PROFILE", "1") != "0"
+
+WINDOW        = 1000   # requests kept for rolling aggregates
+SLOWEST_KEPT  = 25
+N_PLUS_ONE_MIN = 3     # same shape this many times in one request → flagged
+EXCLUDED_PREFIXES = ("/static", "/debug/sql")
+
+_current: ContextVar = ContextVar("sql_profile", default=None)
+
+_lock    = threading.Lock()
+_window  = deque(maxlen=WINDOW)
+_slowest = []          # [(ms, route, sql)] kept sorted, descending
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_SPACE  = re.compile(r"\s+")
+_RE_INLIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def query_shape(sql):
+    """Normalise a statement so calls differing only in literals compare equal."""
+    s = _RE_STRING.sub("?", sql)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_SPACE.sub(" ", s).strip()
+    return _RE_INLIST.sub("(?…)", s)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Adds fetch time to the statement record created by ProfiledConnection."""
+    _stmt = None
+
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(self, *args)
+        finally:
+            if self._stmt is not None:
+                self._stmt[1] += (time.perf_counter() - t0) * 1000
+
+    def fetchone(self):
+        return self._timed(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(sqlite3.Cursor.fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed(sqlite3.Cursor.fetchall)
+
+    def __iter__(self):
+        if self._stmt is None:
+            return super().__iter__()
+        return self._iter_timed()
+
+    def _iter_timed(self):
+        while True:
+            batch = self._timed(sqlite3.Cursor.fetchmany, 512)
+            if not batch:
+                return
+            yield from batch
+
+
+class ProfiledConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=(), /):
+        rec = _current.get()
+        if rec is None:
+            return super().execute(sql, parameters)
+        cur = self.cursor(ProfiledCursor)
+        stmt = [sql, 0.0]
+        cur._stmt = stmt
+        t0 = time.perf_counter()
+        try:
+            cur.execute(sql, parameters)
+        finally:
+            stmt[1] += (time.perf_counter() - t0) * 1000
+            rec.append(stmt)
+        return cur
+
+
+def _summarise(route, stmts, total_ms):
+    shapes = defaultdict(lambda: [0, 0.0])
+    for sql, ms in stmts:
+        agg = shapes[query_shape(sql)]
+        agg[0] += 1
+        agg[1] += ms
+    return {
+        "route":      route,
+        "total_ms":   total_ms,
+        "sql_ms":     sum(ms for _, ms in stmts),
+        "statements": len(stmts),
+        "shapes":     dict(shapes),
+        "repeated":   {s: a[0] for s, a in shapes.items() if a[0] >= N_PLUS_ONE_MIN},
+    }
+
+
+def _record(summary, stmts):
+    global _slowest
+    with _lock:
+        _window.append(summary)
+        floor = _slowest[-1][0] if len(_slowest) >= SLOWEST_KEPT else -1.0
+        fresh = [(ms, summary["route"], sql) for sql, ms in stmts if ms > floor]
+        if fresh:
+            _slowest = sorted(_slowest + fresh, key=lambda x: -x[0])[:SLOWEST_KEPT]
+
+
+def report():
+    """Rolling aggregates over the last WINDOW profiled requests."""
+    with _lock:
+        window = list(_window)
+        slowest = list(_slowest)
+
+    by_route = defaultdict(list)
+    shape_totals = defaultdict(lambda: {"calls": 0, "total_ms": 0.0, "routes": set()})
+    for s in window:
+        by_route[s["route"]].append(s)
+        for shape, (n, ms) in s["shapes"].items():
+            t = shape_totals[shape]
+            t["calls"] += n
+            t["total_ms"] += ms
+            t["routes"].add(s["route"])
+
+    routes = []
+    for route, items in by_route.items():
+        sql_ms = np.array([i["sql_ms"] for i in items])
+        tot_ms = np.array([i["total_ms"] for i in items])
+        repeated = defaultdict(int)
+        for i in items:
+            for shape, n in i["repeated"].items():
+                repeated[shape] = max(repeated[shape], n)
+        routes.append({
+            "route":           route,
+            "requests":        len(items),
+            "avg_statements":  round(float(np.mean([i["statements"] for i in items])), 1),
+            "avg_sql_ms":      round(float(sql_ms.mean()), 2),
+            "p95_sql_ms":      round(float(np.percentile(sql_ms, 95)), 2),
+            "avg_total_ms":    round(float(tot_ms.mean()), 2),
+            "sql_share":       round(float(sql_ms.sum() / tot_ms.sum()), 3) if tot_ms.sum() else 0.0,
+            "n_plus_one":      [{"shape": s, "max_calls": n} for s, n in
+                                sorted(repeated.items(), key=lambda x: -x[1])],
+        })
+    routes.sort(key=lambda r: -r["avg_sql_ms"] * r["requests"])
+
+    top_shapes = sorted(shape_totals.items(), key=lambda x: -x[1]["total_ms"])[:25]
+    return {
+        "enabled":  ENABLED,
+        "window":   len(window),
+        "routes":   routes,
+        "top_shapes": [{
+            "shape":    shape,
+            "calls":    t["calls"],
+            "total_ms": round(t["total_ms"], 2),
+            "avg_ms":   round(t["total_ms"] / t["calls"], 3),
+            "routes":   sorted(t["routes"]),
+        } for shape, t in top_shapes],
+        "slowest": [{"ms": round(ms, 3), "route": route, "sql": query_shape(sql)}
+                    for ms, route, sql in slowest],
+    }
+
+
+def reset():
+    global _slowest
+    with _lock:
+        _window.clear()
+        _slowest = []
+
+
+class SQLProfilerMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if not ENABLED or request.url.path.startswith(EXCLUDED_PREFIXES):
+            return await call_next(request)
+
+        stmts = []
+        token = _current.set(stmts)
+        t0 = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - t0) * 1000
+
+        route = request.scope.get("route")
+        summary = _summarise(route.path if route else request.url.path, stmts, total_ms)
+        _record(summary, stmts)
+
+        desc = f"{summary['statements']} queries"
+        if summary["repeated"]:
+            desc += f", {len(summary['repeated'])} repeated"
+        response.headers["Server-Timing"] = (
+            f'sql;dur={summary["sql_ms"]:.2f};desc="{desc}", app;dur={total_ms:.2f}'
+        )
+        return response
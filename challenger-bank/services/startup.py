@@ -0,0 +1,175 @@
+"""
+Background startup: snapshot recovery, seeding, schema and cache warm-up.
+
+The app lifespan starts run() on a daemon thread and begins serving at once,
+so time to first byte does not depend on the dataset size.  Stages run in
+order and each records its status, timing and latest detail:
+
+    snapshot    re-point DB_PATH at the last published snapshot (db.recover)
+    seed        build and publish a dataset, only when there is none
+    schema      init_db(): schema, triggers and registry backfills
+    precompute  P&L explain backfill, covenant tests, exposure history,
+                similarity index, cashflow schedules
+
+Data is servable once `schema` is done.  Until then WarmupMiddleware answers
+pages with a small self-refreshing "warming up" page and API calls with a
+503 JSON body; /health and /health/ready always pass through.  A failed
+precompute step is recorded but does not hold back readiness: the stored
+tables it tops up (P&L explain, covenant tests) are also refreshed by the
+importer, and every in-memory cache is built lazily on first use.  GET
+routes never write, so these recomputes only run here, in the importer and
+in the CLIs.
+"""
+import html
+import os
+import threading
+import time
+import traceback
+
+from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from db import DB_PATH, current, get_db, init_db, live_write, recover
+from generators.seed_all import seed
+from services import cashflows, covenants, exposure, pnl_explain, similarity
+
+STAGES = ("snapshot", "seed", "schema", "precompute")
+DATA_STAGE = "schema"
+RETRY_AFTER_SECONDS = 5
+PASSTHROUGH_PREFIXES = ("/health", "/static", "/docs", "/redoc", "/openapi.json", "/debug")
+
+_lock = threading.Lock()
+_t0 = time.time()
+_stages = {name: {"status": "pending", "seconds": None, "detail": None} for name in STAGES}
+_started = {}
+
+
+def _set(stage, **fields):
+    with _lock:
+        if fields.get("status") == "running":
+            _started[stage] = time.perf_counter()
+        elif fields.get("status") in ("done", "skipped", "failed") and stage in _started:
+            fields["seconds"] = round(time.perf_counter() - _started[stage], 3)
+        _stages[stage].update(fields)
+
+
+def data_ready():
+    return _stages[DATA_STAGE]["status"] == "done"
+
+
+def failed():
+    return any(s["status"] == "failed" for n, s in _stages.items() if n != "precompute")
+
+
+def status():
+    """Readiness report for /health/ready."""
+    with _lock:
+        stages = [{"stage": n, **s} for n, s in _stages.items()]
+    return {
+        "ready":   data_ready(),
+        "warm":    all(s["status"] in ("done", "skipped") for s in stages),
+        "failed":  failed(),
+        "uptime_seconds": round(time.time() - _t0, 1),
+        "stages":  stages,
+    }
+
+
+def _write(fn, conn):
+    with live_write(wait=True):
+        return fn(conn)
+
+
+def _precompute():
+    steps = (
+        ("pnl_explain backfill", lambda conn: _write(pnl_explain.backfill, conn)),
+        ("covenant tests",       lambda conn: _write(covenants.run, conn)),
+        ("exposure history",     lambda conn: exposure.compute(conn)),
+        ("similarity index",     lambda conn: similarity.get_index(conn, current())),
+        ("cashflow schedules",   lambda conn: [cashflows.book(conn, s) for s in cashflows.SOURCES]),
+    )
+    errors = []
+    conn = get_db()
+    try:
+        for label, fn in steps:
+            _set("precompute", detail=label)
+            try:
+                fn(conn)
+            except Exception as e:                 # lazy paths rebuild it on first use
+                errors.append(f"{label}: {e!r}")
+                traceback.print_exc()
+    finally:
+        conn.close()
+    return errors
+
+
+def run():
+    """Bring the database up stage by stage; never raises."""
+    stage = None
+    try:
+        stage = "snapshot"
+        _set(stage, status="running")
+        path = recover()
+        _set(stage, status="done", detail=path)
+
+        stage = "seed"
+        if path is None or os.path.getsize(DB_PATH) < 10_000:
+            _set(stage, status="running")
+            print("Database empty — running seed …")
+            seed(force=True, progress=lambda label: _set("seed", detail=label))
+            _set(stage, status="done", detail=current())
+        else:
+            _set(stage, status="skipped", detail="published snapshot present")
+
+        stage = "schema"
+        _set(stage, status="running")
+        init_db()
+        _set(stage, status="done")
+
+        stage = "precompute"
+        _set(stage, status="running")
+        errors = _precompute()
+        _set(stage, status="failed" if errors else "done", detail="; ".join(errors) or None)
+    except Exception as e:
+        traceback.print_exc()
+        _set(stage, status="failed", detail=repr(e))
+
+
+def start():
+    thread = threading.Thread(target=run, name="startup", daemon=True)
+    thread.start()
+    return thread
+
+
+_WARMING_HTML = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8">
+<meta http-equiv="refresh" content="{retry}">
+<title>Warming up — Risk Platform</title>
+<style>
+  body {{ background:#0d1117; color:#c9d1d9; font:13px -apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,sans-serif;
+         display:flex; align-items:center; justify-content:center; height:100vh; margin:0; }}
+  .box {{ background:#161b22; border:1px solid #30363d; border-radius:6px; padding:24px 32px; min-width:360px; }}
+  h1 {{ font-size:16px; margin:0 0 12px; }}
+  td {{ padding:2px 12px 2px 0; }} .muted {{ color:#8b949e; }} .failed {{ color:#f85149; }}
+</style></head>
+<body><div class="box"><h1>{title}</h1><table>{rows}</table>
+<p class="muted">This page refreshes every {retry}s.</p></div></body></html>"""
+
+
+def _warming_page(report):
+    rows = "".join(
+        f'<tr><td>{s["stage"]}</td><td class="{s["status"]}">{s["status"]}</td>'
+        f'<td class="muted">{html.escape(str(s["detail"] or ""))}</td></tr>'
+        for s in report["stages"])
+    title = "Startup failed" if report["failed"] else "Challenger Bank is warming up …"
+    return _WARMING_HTML.format(retry=RETRY_AFTER_SECONDS, title=title, rows=rows)
+
+
+class WarmupMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if data_ready() or request.url.path.startswith(PASSTHROUGH_PREFIXES):
+            return await call_next(request)
+        report = status()
+        headers = {"Retry-After": str(RETRY_AFTER_SECONDS)}
+        if request.url.path.startswith("/api"):
+            return JSONResponse({"detail": "warming up", **report}, status_code=503, headers=headers)
+        return HTMLResponse(_warming_page(report), status_code=503, headers=headers)
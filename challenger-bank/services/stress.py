@@ -0,0 +1,449 @@
+"""
+Scenario factor space, vectorized book repricing and reverse stress testing.
+
+The 16 shock columns of `scenarios` are mapped to market_data series so the
+factor covariance can be estimated from history.  BookKernel collapses the
+live trade blotter into per-desk first- and second-order sensitivities to
+those factors, so repricing a batch of B shock vectors is two (B × 16) @ (16 ×
+desks) products.
+
+reverse_stress() finds the most plausible shock — smallest Mahalanobis
+distance under the horizon-scaled covariance — whose book loss reaches a
+threshold.  In whitened coordinates (x = C z, C C' = Σ) distance is |z| and
+P&L along any ray is a quadratic in the radius, so each candidate direction
+is solved in closed form and a cross-entropy search over directions handles
+the non-linear (gamma / convexity) terms.
+
+scenario_grid() evaluates an N × M surface of two combined factor shocks,
+optionally on top of a named scenario, in one broadcast over the kernel.
+"""
+import math
+from collections import OrderedDict
+from datetime import date
+from statistics import NormalDist
+
+import numpy as np
+
+from services import options
+
+# (scenarios column, market_data asset, kind, currency or underlying)
+#   rate   : shock in bps, history = Δ value (%) × 100
+#   fx     : shock in %, + = local ccy weakens vs USD
+#   equity : shock in %
+#   spread : shock in bps
+FACTORS = [
+    ("usd_rates_shock_bps", "USD_10Y", "rate",   "USD"),
+    ("gbp_rates_shock_bps", "GBP_10Y", "rate",   "GBP"),
+    ("cny_rates_shock_bps", "CNY_10Y", "rate",   "CNY"),
+    ("brl_rates_shock_bps", "BRL_10Y", "rate",   "BRL"),
+    ("zar_rates_shock_bps", "ZAR_10Y", "rate",   "ZAR"),
+    ("gbpusd_shock_pct",    "GBPUSD",  "fx",     "GBP"),
+    ("usdcny_shock_pct",    "USDCNY",  "fx",     "CNY"),
+    ("usdbrl_shock_pct",    "USDBRL",  "fx",     "BRL"),
+    ("usdzar_shock_pct",    "USDZAR",  "fx",     "ZAR"),
+    ("us_equity_shock_pct", "US_SPX",  "equity", "US_SPX"),
+    ("uk_equity_shock_pct", "UK_FTSE", "equity", "UK_FTSE"),
+    ("cn_equity_shock_pct", "CN_CSI",  "equity", "CN_CSI"),
+    ("br_equity_shock_pct", "BR_IBOV", "equity", "BR_IBOV"),
+    ("za_equity_shock_pct", "ZA_JSE",  "equity", "ZA_JSE"),
+    ("ig_spread_shock_bps", "CS_BBB",  "spread", "IG"),
+    ("hy_spread_shock_bps", "CS_BB",   "spread", "HY"),
+]
+FACTOR_COLUMNS = [f[0] for f in FACTORS]
+N_FACTORS = len(FACTORS)
+
+RATE_IDX   = {f[3]: i for i, f in enumerate(FACTORS) if f[2] == "rate"}
+FX_IDX     = {f[3]: i for i, f in enumerate(FACTORS) if f[2] == "fx"}
+EQUITY_IDX = {f[3]: i for i, f in enumerate(FACTORS) if f[2] == "equity"}
+SPREAD_IDX = {f[3]: i for i, f in enumerate(FACTORS) if f[2] == "spread"}
+
+IG_RATINGS = {"AAA","AA+","AA","AA-","A+","A","A-","BBB+","BBB","BBB-"}
+
+EQ_VOL = 0.20          # flat vol for option gamma
+DEFAULT_HORIZON = 10   # days
+DEFAULT_LOOKBACK = 750
+
+_cov_cache = OrderedDict()
+_kernel_cache = OrderedDict()
+_grid_cache = OrderedDict()
+_CACHE_MAX = 16
+
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _CACHE_MAX:
+        cache.popitem(last=False)
+    return value
+
+
+# ── Factor history and covariance ─────────────────────────────────────────────
+
+def factor_levels(conn, lookback_days=None, as_of=None):
+    """(dates, T × 16 market_data levels) for the factor series."""
+    assets = [f[1] for f in FACTORS]
+    ph = ",".join("?" * len(assets))
+    rows = conn.execute(f"""
+        SELECT asset_id, price_date, value FROM market_data
+        WHERE asset_id IN ({ph}) AND price_date <= COALESCE(?, '9999-12-31')
+        ORDER BY price_date
+    """, (*assets, as_of)).fetchall()
+    dates = sorted({r[1] for r in rows})
+    if lookback_days:
+        dates = dates[-(lookback_days + 1):]
+    d_idx = {d: i for i, d in enumerate(dates)}
+    a_idx = {a: j for j, a in enumerate(assets)}
+    levels = np.full((len(dates), len(assets)), np.nan)
+    for asset_id, d, v in rows:
+        i = d_idx.get(d)
+        if i is not None:
+            levels[i, a_idx[asset_id]] = v
+    return dates, levels
+
+
+def factor_moves(levels, horizon=1):
+    """Moves of factor levels over `horizon` rows in shock units ((T-horizon) × 16, empty if T ≤ horizon)."""
+    moves = np.empty((max(len(levels) - horizon, 0), N_FACTORS))
+    for j, (_, asset, kind, ccy) in enumerate(FACTORS):
+        col = levels[:, j]
+        if kind == "rate":
+            moves[:, j] = (col[horizon:] - col[:-horizon]) * 100
+        elif kind == "spread":
+            moves[:, j] = col[horizon:] - col[:-horizon]
+        else:
+            moves[:, j] = np.log(col[horizon:] / col[:-horizon]) * 100
+            if kind == "fx" and asset.startswith(ccy):   # GBPUSD: GBP weakens ⇒ pair falls
+                moves[:, j] *= -1
+    return moves
+
+
+def factor_history(conn, lookback_days=DEFAULT_LOOKBACK, as_of=None):
+    """(dates, T × 16 daily factor moves in shock units) from market_data."""
+    dates, levels = factor_levels(conn, lookback_days, as_of)
+    moves = factor_moves(levels)
+    keep = ~np.isnan(moves).any(axis=1)
+    return [d for d, k in zip(dates[1:], keep) if k], moves[keep]
+
+
+def covariance(conn, horizon_days=DEFAULT_HORIZON, lookback_days=DEFAULT_LOOKBACK, as_of=None):
+    """Horizon-scaled factor covariance, cached per (latest date, horizon, lookback)."""
+    latest = conn.execute(
+        "SELECT MAX(price_date) FROM market_data WHERE price_date <= COALESCE(?, '9999-12-31')",
+        (as_of,)).fetchone()[0]
+    key = (latest, horizon_days, lookback_days)
+    if key in _cov_cache:
+        _cov_cache.move_to_end(key)
+        return _cov_cache[key]
+    _, moves = factor_history(conn, lookback_days, latest)
+    cov = np.cov(moves, rowvar=False) * horizon_days
+    # Small ridge keeps the Cholesky factor well-defined for near-collinear tenors
+    cov += np.eye(N_FACTORS) * 1e-6 * np.trace(cov) / N_FACTORS
+    return _cache_put(_cov_cache, key, cov)
+
+
+# ── Repricing kernel ──────────────────────────────────────────────────────────
+
+class BookKernel:
+    """
+    Desk-level delta (D × 16) and diagonal gamma (D × 16) of the live book.
+
+    P&L (USD M) of shocks X (B × 16):  X @ delta.T + ½ (X ** 2) @ gamma.T
+    """
+
+    def __init__(self, desks, delta, gamma, trade_count):
+        self.desks = desks
+        self.delta = delta
+        self.gamma = gamma
+        self.trade_count = trade_count
+        self.total_delta = delta.sum(axis=0)
+        self.total_gamma = gamma.sum(axis=0)
+
+    @classmethod
+    def from_trades(cls, trades, today="2025-12-31", spots=None, surface=None):
+        """
+        Kernel for `trades`.  With spots ({asset: level}) equity options take
+        Black–Scholes delta and gamma from services.options at the surface
+        vol (flat EQ_VOL without one); otherwise their stored delta and a
+        gamma implied from it.
+        """
+        today = date.fromisoformat(today)
+        desks = sorted({t["desk"] for t in trades})
+        d_idx = {d: i for i, d in enumerate(desks)}
+        delta = np.zeros((len(desks), N_FACTORS))
+        gamma = np.zeros((len(desks), N_FACTORS))
+        inv_cdf = NormalDist().inv_cdf
+        pdf = NormalDist().pdf
+
+        for t in trades:
+            row = d_idx[t["desk"]]
+            product = t["product"]
+            sign = 1 if t["direction"] in ("Long", "Pay", "Buy") else -1
+            notional = t["notional_usd"] or 0.0
+            spread_i = SPREAD_IDX["IG" if t["rating"] in IG_RATINGS else "HY"]
+
+            if product in ("IRS", "XCS"):
+                # dv01 is stored unsigned: payer gains when rates rise
+                delta[row, RATE_IDX.get(t["currency"], RATE_IDX["USD"])] += sign * (t["dv01"] or 0)
+
+            elif product in ("Government Bond", "Corporate Bond"):
+                dv01 = t["dv01"] or 0                     # signed by direction
+                r_i = RATE_IDX.get(t["currency"], RATE_IDX["USD"])
+                delta[row, r_i] -= dv01
+                # Convexity ≈ D² + D with D = |dv01| × 1e4 / notional
+                if t["notional"]:
+                    dur = abs(dv01) * 1e4 / t["notional"]
+                    gamma[row, r_i] += sign * notional * (dur * dur + dur) / 1e8
+                if product == "Corporate Bond":
+                    delta[row, spread_i] -= dv01
+
+            elif product == "CDS":
+                delta[row, spread_i] += (t["cs01"] or 0) * (1 if t["direction"] == "Buy" else -1)
+
+            elif product in ("FX Forward", "NDF", "FX Option"):
+                ccy = t["currency"] if t["currency"] in FX_IDX else "GBP"
+                # Long GBPUSD loses when GBP weakens; long USDxxx gains
+                pair_sign = -1 if ccy == "GBP" else 1
+                delta[row, FX_IDX[ccy]] += sign * pair_sign * notional / 100
+
+            elif product == "Equity Option":
+                eq_i = EQUITY_IDX.get(t["floating_index"], EQUITY_IDX["US_SPX"])
+                tau = max((date.fromisoformat(t["maturity_date"]) - today).days / 365, 1 / 52)
+                spot = (spots or {}).get(FACTORS[eq_i][1])
+                if spot and math.isfinite(spot) and t.get("strike"):
+                    # units × ∂V/∂S × S per 1% move, units × ∂²V/∂S² × S² per (1%)²
+                    vol = surface.vol(FACTORS[eq_i][1], tau) if surface else EQ_VOL
+                    g = options.price(spot, t["strike"], tau, vol, t.get("option_type") == "Call")
+                    units = sign * notional / t["strike"]
+                    delta[row, eq_i] += units * float(g.delta) * spot / 100
+                    gamma[row, eq_i] += units * float(g.gamma) * spot * spot / 1e4
+                    continue
+                d = t["delta"] or 0.0                     # already signed by direction
+                delta[row, eq_i] += d * notional / 100
+                d1 = inv_cdf(min(max(abs(d), 0.01), 0.99))
+                gamma[row, eq_i] += sign * notional * pdf(d1) / (EQ_VOL * math.sqrt(tau)) / 1e4
+            # Commodity forwards have no factor in the scenario space
+
+        return cls(desks, delta, gamma, len(trades))
+
+    def pnl(self, shocks):
+        """Desk P&L (B × D, USD M) for shocks (B × 16 or 16,)."""
+        x = np.atleast_2d(np.asarray(shocks, dtype=float))
+        return x @ self.delta.T + 0.5 * (x * x) @ self.gamma.T
+
+    def total_pnl(self, shocks):
+        x = np.atleast_2d(np.asarray(shocks, dtype=float))
+        return x @ self.total_delta + 0.5 * (x * x) @ self.total_gamma
+
+
+def book_kernel(conn):
+    """Kernel for the live book at the latest market levels, cached until either changes."""
+    fp = tuple(conn.execute("""
+        SELECT COUNT(*), COALESCE(MAX(id), 0), ROUND(TOTAL(notional_usd), 4), ROUND(TOTAL(mark_to_market), 4),
+               (SELECT MAX(price_date) FROM market_data)
+        FROM trades WHERE status='Live'
+    """).fetchone())
+    if fp in _kernel_cache:
+        _kernel_cache.move_to_end(fp)
+        return _kernel_cache[fp]
+    trades = [dict(r) for r in conn.execute("""
+        SELECT t.desk, t.product, t.direction, t.currency, t.notional, t.notional_usd,
+               t.maturity_date, t.floating_index, t.strike, t.option_type, t.delta, t.dv01, t.cs01,
+               c.internal_rating AS rating
+        FROM trades t JOIN counterparties c ON c.id = t.counterparty_id
+        WHERE t.status='Live'
+    """).fetchall()]
+    today, spots = options.latest_levels(conn)
+    kernel = BookKernel.from_trades(trades, today=today or "2025-12-31", spots=spots,
+                                    surface=options.surface(conn))
+    return _cache_put(_kernel_cache, fp, kernel)
+
+
+# ── Reverse stress test ───────────────────────────────────────────────────────
+
+def _ray_radius(a, b, loss):
+    """
+    Smallest r > 0 with P&L(r) = a r + ½ b r² ≤ -loss, per direction
+    (inf where the ray never reaches the loss).
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    r = np.full(a.shape, np.inf)
+    lin = np.abs(b) < 1e-12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_lin = np.where(a < 0, -loss / a, np.inf)
+        disc = a * a - 2 * b * loss
+        sq = np.sqrt(np.where(disc >= 0, disc, np.nan))
+        r1 = (-a - sq) / b
+        r2 = (-a + sq) / b
+    r1 = np.where(np.isfinite(r1) & (r1 > 0), r1, np.inf)
+    r2 = np.where(np.isfinite(r2) & (r2 > 0), r2, np.inf)
+    r[lin] = r_lin[lin]
+    r[~lin] = np.minimum(r1, r2)[~lin]
+    return r
+
+
+def reverse_stress(kernel, cov, loss, batch=2048, iterations=25, elite_frac=0.05, seed=0):
+    """
+    Most plausible shock (min Mahalanobis distance) with total book loss ≥ loss.
+
+    Returns dict with the shock vector, its distance, desk P&L and the
+    number of candidate evaluations; None if no direction reaches the loss.
+    """
+    rng = np.random.default_rng(seed)
+    chol = np.linalg.cholesky(cov)
+    g = chol.T @ kernel.total_delta          # delta gradient in whitened space
+
+    def radii(U):
+        X = U @ chol.T
+        return _ray_radius(X @ kernel.total_delta, (X * X) @ kernel.total_gamma, loss)
+
+    # Linear (delta-only) optimum: steepest-loss direction in whitened space
+    norm_g = np.linalg.norm(g)
+    if norm_g == 0 and not kernel.total_gamma.any():
+        return None
+    mean = -g / norm_g if norm_g else rng.standard_normal(N_FACTORS)
+    mean /= np.linalg.norm(mean)
+    linear_distance = loss / norm_g if norm_g else math.inf
+
+    best_u, best_r = mean, float(radii(mean[None, :])[0])
+    scale = 0.5
+    n_elite = max(2, int(batch * elite_frac))
+    evaluations = 1
+    for it in range(iterations):
+        U = mean + scale * rng.standard_normal((batch, N_FACTORS))
+        if it == 0:   # global coverage in case the non-linear optimum lies elsewhere
+            U[batch // 2:] = rng.standard_normal((batch - batch // 2, N_FACTORS))
+        U /= np.linalg.norm(U, axis=1, keepdims=True)
+        r = radii(U)
+        evaluations += batch
+        order = np.argsort(r)[:n_elite]
+        if r[order[0]] < best_r:
+            best_r, best_u = float(r[order[0]]), U[order[0]]
+        elite = U[order[np.isfinite(r[order])]]
+        if len(elite) == 0:
+            scale = min(scale * 1.5, 2.0)
+            continue
+        mean = elite.mean(axis=0)
+        mean /= np.linalg.norm(mean)
+        scale = max(float(elite.std(axis=0).mean()), 1e-3)
+
+    if not math.isfinite(best_r):
+        return None
+    shock = chol @ (best_u * best_r)
+    desk_pnl = kernel.pnl(shock)[0]
+    return {
+        "loss_threshold_usd_m": loss,
+        "mahalanobis":          round(best_r, 4),
+        "linear_mahalanobis":   round(linear_distance, 4) if math.isfinite(linear_distance) else None,
+        "evaluations":          evaluations,
+        "total_pnl_usd_m":      round(float(kernel.total_pnl(shock)[0]), 2),
+        "desk_pnl_usd_m":       {d: round(float(p), 2) for d, p in zip(kernel.desks, desk_pnl)},
+        "shocks":               {c: round(float(v), 2) for c, v in zip(FACTOR_COLUMNS, shock)},
+    }
+
+
+class ScenarioNameTaken(ValueError):
+    """The name belongs to a scenario that is not a saved reverse stress."""
+
+
+def save_scenario(conn, result, name=None, horizon_days=DEFAULT_HORIZON):
+    """
+    Insert a reverse-stress result into scenarios + scenario_results; returns
+    its id.  Re-using the name of an earlier reverse stress replaces it in
+    place; any other existing name raises ScenarioNameTaken.
+    """
+    loss = result["loss_threshold_usd_m"]
+    name = name or f"Reverse Stress {loss:,.0f}M ({date.today().isoformat()})"
+    row = {c: result["shocks"][c] for c in FACTOR_COLUMNS}
+    row.update(
+        scenario_name=name,
+        scenario_type="Reverse Stress",
+        description=(f"Most plausible {horizon_days}-day shock producing a {loss:,.0f}M USD book loss "
+                     f"(Mahalanobis distance {result['mahalanobis']:.2f})."),
+        reference_date=None,
+    )
+    cols = ["scenario_name", "scenario_type", "description", "reference_date", *FACTOR_COLUMNS]
+    existing = conn.execute("SELECT id, scenario_type FROM scenarios WHERE scenario_name=?",
+                            (name,)).fetchone()
+    if existing and existing[1] != "Reverse Stress":
+        raise ScenarioNameTaken(f"'{name}' is an existing {existing[1]} scenario")
+    if existing:
+        sc_id = existing[0]
+        conn.execute("DELETE FROM scenario_results WHERE scenario_id=?", (sc_id,))
+        conn.execute(f"UPDATE scenarios SET {', '.join(f'{c}=:{c}' for c in cols)} WHERE id=:id",
+                     {**row, "id": sc_id})
+    else:
+        sc_id = conn.execute(f"""
+            INSERT INTO scenarios ({', '.join(cols)})
+            VALUES ({', '.join(':' + c for c in cols)})
+        """, row).lastrowid
+    results = [{
+        "scenario_id": sc_id, "desk": desk, "pnl_impact_usd": pnl,
+        "var_breached": 1 if abs(pnl) > 50 else 0, "notes": None,
+    } for desk, pnl in result["desk_pnl_usd_m"].items()]
+    total = result["total_pnl_usd_m"]
+    results.append({
+        "scenario_id": sc_id, "desk": None, "pnl_impact_usd": total,
+        "var_breached": 1 if abs(total) > 200 else 0,
+        "notes": f"Portfolio total stressed P&L: {total:.1f}M USD",
+    })
+    conn.executemany("""
+        INSERT INTO scenario_results
+        (scenario_id, desk, product, pnl_impact_usd, credit_loss_usd, var_breached, notes)
+        VALUES (:scenario_id, :desk, NULL, :pnl_impact_usd, 0.0, :var_breached, :notes)
+    """, results)
+    conn.commit()
+    return sc_id
+
+
+# ── Two-factor scenario grids ─────────────────────────────────────────────────
+
+def scenario_grid(kernel, x_factor, x_values, y_factor, y_values, base=None):
+    """
+    Desk P&L surface (N × M × D, USD M) for every combination of x_values on
+    x_factor and y_values on y_factor, with the other factors at `base`
+    (16-vector, default 0).  Gamma is diagonal, so the surface separates into
+    a base term plus one term per axis and is a single broadcast sum.
+    """
+    xi, yi = FACTOR_COLUMNS.index(x_factor), FACTOR_COLUMNS.index(y_factor)
+    if xi == yi:
+        raise ValueError("x and y must be different factors")
+    x = np.asarray(x_values, dtype=float)
+    y = np.asarray(y_values, dtype=float)
+    b = np.zeros(N_FACTORS) if base is None else np.asarray(base, dtype=float).copy()
+    b[[xi, yi]] = 0.0
+
+    def axis(i, v):                            # P&L of factor i moving to v (len × D)
+        return np.outer(v, kernel.delta[:, i]) + 0.5 * np.outer(v * v, kernel.gamma[:, i])
+
+    return kernel.pnl(b)[0] + axis(xi, x)[:, None, :] + axis(yi, y)[None, :, :]
+
+
+def grid(kernel, x_factor, x_range, y_factor, y_range, base=None):
+    """
+    scenario_grid() over evenly spaced axes (lo, hi, steps) as a JSON-ready
+    dict, cached per book kernel and grid definition.
+    """
+    key = (kernel, x_factor, tuple(x_range), y_factor, tuple(y_range),
+           None if base is None else tuple(base))
+    if key in _grid_cache:
+        _grid_cache.move_to_end(key)
+        return _grid_cache[key]
+    x = np.linspace(*x_range[:2], int(x_range[2]))
+    y = np.linspace(*y_range[:2], int(y_range[2]))
+    desk = scenario_grid(kernel, x_factor, x, y_factor, y, base)
+    total = desk.sum(axis=2)
+    i, j = np.unravel_index(np.argmin(total), total.shape)
+    result = {
+        "x":               {"factor": x_factor, "values": np.round(x, 4).tolist()},
+        "y":               {"factor": y_factor, "values": np.round(y, 4).tolist()},
+        "trade_count":     kernel.trade_count,
+        "desks":           kernel.desks,
+        "total_pnl_usd_m": np.round(total, 3).tolist(),
+        "desk_pnl_usd_m":  {d: np.round(desk[:, :, k], 3).tolist() for k, d in enumerate(kernel.desks)},
+        "worst": {
+            "x": round(float(x[i]), 4), "y": round(float(y[j]), 4),
+            "total_pnl_usd_m": round(float(total[i, j]), 3),
+        },
+    }
+    return _cache_put(_grid_cache, key, result)